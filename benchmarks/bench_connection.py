@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""Per-hit overhead of connecting on every call vs. the pooled client.
+
+Usage::
+
+    python -m benchmarks.bench_connection --mongo-uri mongodb://localhost -n 1000
+
+The "per-call client" column reproduces what the decorator used to do on
+every invocation (build a new :class:`pymongo.MongoClient`, run the lookup
+and leave the client open); the "pooled client" column is a cache hit
+through :func:`mongo_memoize.memoize` as it is now.
+"""
+
+from __future__ import absolute_import, print_function
+
+import argparse
+import time
+import uuid
+
+import pymongo
+
+from mongo_memoize import memoize
+
+
+def bench_per_call_client(mongo_uri, db_name, iterations):
+    clients = []
+    start = time.perf_counter()
+    for _ in range(iterations):
+        client = pymongo.MongoClient(mongo_uri)
+        client[db_name]['cache'].find_one({'key': 'missing'})
+        clients.append(client)
+    elapsed = time.perf_counter() - start
+    for client in clients:
+        client.close()
+    return elapsed / iterations
+
+
+def bench_pooled_client(mongo_uri, db_name, iterations):
+    @memoize(db_name=db_name, mongo_uri=mongo_uri)
+    def func(x):
+        return x
+
+    func(1)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func(1)
+    return (time.perf_counter() - start) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mongo-uri', default='mongodb://localhost')
+    parser.add_argument('-n', '--iterations', type=int, default=1000)
+    args = parser.parse_args()
+
+    db_name = 'bench_' + uuid.uuid4().hex
+    try:
+        before = bench_per_call_client(args.mongo_uri, db_name, args.iterations)
+        after = bench_pooled_client(args.mongo_uri, db_name, args.iterations)
+    finally:
+        pymongo.MongoClient(args.mongo_uri).drop_database(db_name)
+
+    print('per-call client: {:8.1f} us/hit'.format(before * 1e6))
+    print('pooled client:   {:8.1f} us/hit'.format(after * 1e6))
+    print('speedup:         {:8.1f}x'.format(before / after))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""Throughput of the key generators and size of the keys they produce.
+
+Usage::
+
+    python -m benchmarks.bench_keygen [-n ITERATIONS] [--mongo-uri mongodb://localhost --documents 100000]
+
+With ``--mongo-uri``, the size of the unique ``key`` index is also measured
+after inserting ``--documents`` cache keys into a scratch database.
+"""
+
+from __future__ import absolute_import, print_function
+
+import argparse
+import time
+import uuid
+from collections import OrderedDict
+
+import bson
+
+from mongo_memoize import PickleDigestKeyGenerator, PickleMD5KeyGenerator
+
+KEY_GENERATORS = OrderedDict([
+    ('md5 hex', PickleMD5KeyGenerator()),
+    ('blake2b 16 B', PickleDigestKeyGenerator()),
+    ('blake2b 8 B', PickleDigestKeyGenerator(digest_size=8)),
+    ('sha1 16 B', PickleDigestKeyGenerator(algorithm='sha1')),
+])
+
+ARGUMENTS = OrderedDict([
+    ('one int', ((42,), {})),
+    ('mixed', ((1, 'alice', 0.5), {'limit': 10, 'tags': ['a', 'b']})),
+    ('10k ints', ((list(range(10000)),), {})),
+])
+
+
+def bench_throughput(key_generator, args, kwargs, iterations):
+    module = __name__.encode('utf-8')
+    best = None
+    for _ in range(3):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            key_generator(module, args, kwargs)
+        elapsed = (time.perf_counter() - start) / iterations
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def bench_index_size(key_generator, mongo_uri, documents):
+    import pymongo
+
+    client = pymongo.MongoClient(mongo_uri)
+    db_name = 'bench_' + uuid.uuid4().hex
+    try:
+        col = client[db_name]['cache']
+        col.create_index('key', unique=True)
+        module = __name__.encode('utf-8')
+        for start in range(0, documents, 10000):
+            col.insert_many([{'key': key_generator(module, (i,), {})}
+                             for i in range(start, min(start + 10000, documents))], ordered=False)
+        return client[db_name].command('collStats', 'cache')['indexSizes']['key_1']
+    finally:
+        client.drop_database(db_name)
+        client.close()
+
+
+def run(iterations=10000, key_generators=KEY_GENERATORS, arguments=ARGUMENTS, mongo_uri=None, documents=100000):
+    results = []
+    for name, key_generator in key_generators.items():
+        key = key_generator(b'module', (1,), {})
+        result = OrderedDict([
+            ('key_generator', name),
+            ('key_size', len(bson.encode({'key': key})) - len(bson.encode({'key': None}))),
+        ])
+        for arguments_name, (args, kwargs) in arguments.items():
+            n = max(iterations // 100, 10) if arguments_name == '10k ints' else iterations
+            result[arguments_name + '_us'] = bench_throughput(key_generator, args, kwargs, n) * 1e6
+        if mongo_uri is not None:
+            result['index_size'] = bench_index_size(key_generator, mongo_uri, documents)
+        results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--iterations', type=int, default=10000)
+    parser.add_argument('--mongo-uri', default=None)
+    parser.add_argument('--documents', type=int, default=100000)
+    args = parser.parse_args()
+
+    results = run(args.iterations, mongo_uri=args.mongo_uri, documents=args.documents)
+    columns = [column for column in results[0] if column != 'key_generator']
+    print('{:<14}'.format('key generator') + ''.join('{:>16}'.format(column) for column in columns))
+    for r in results:
+        print('{:<14}'.format(r['key_generator']) +
+              ''.join('{:>16.2f}'.format(r[column]) if isinstance(r[column], float) else '{:>16}'.format(r[column])
+                      for column in columns))
+
+
+if __name__ == '__main__':
+    main()
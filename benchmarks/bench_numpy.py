@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""Encode/decode throughput of NumPy arrays from 1 MB to 1 GB.
+
+Usage::
+
+    python -m benchmarks.bench_numpy [--max-size MB]
+
+Encoding covers ``serialize`` and decoding covers ``deserialize`` of the
+payload as it is returned by PyMongo (BSON encoding is left out since
+documents over 16 MB are stored in chunks).
+"""
+
+from __future__ import absolute_import, print_function
+
+import argparse
+import time
+from collections import OrderedDict
+
+import numpy
+
+from mongo_memoize import OutOfBandPickleSerializer, PickleSerializer
+
+SERIALIZERS = OrderedDict([
+    ('pickle base64', PickleSerializer()),
+    ('pickle binary', PickleSerializer(binary=True)),
+    ('out-of-band', OutOfBandPickleSerializer()),
+])
+
+SIZES_MB = [1, 16, 128, 1024]
+
+
+def measure(func, iterations):
+    best = None
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def run(max_size_mb=1024, iterations=3, serializers=SERIALIZERS):
+    results = []
+    for size_mb in SIZES_MB:
+        if size_mb > max_size_mb:
+            break
+        array = numpy.random.random(size_mb * 1024 * 1024 // 8)
+        for name, serializer in serializers.items():
+            payload = serializer.serialize(array)
+            encode = measure(lambda: serializer.serialize(array), iterations)
+            decode = measure(lambda: serializer.deserialize(payload), iterations)
+            results.append(OrderedDict([
+                ('size_mb', size_mb),
+                ('serializer', name),
+                ('payload_mb', len(payload) / 1024.0 / 1024.0),
+                ('encode_mb_s', size_mb / encode),
+                ('decode_mb_s', size_mb / decode),
+            ]))
+            del payload
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--max-size', type=int, default=1024, help='largest array in MB')
+    parser.add_argument('-n', '--iterations', type=int, default=3)
+    args = parser.parse_args()
+
+    print('{:>8} {:<16} {:>12} {:>14} {:>14}'.format(
+        'size MB', 'serializer', 'payload MB', 'encode MB/s', 'decode MB/s'))
+    for r in run(args.max_size, args.iterations):
+        print('{:>8} {:<16} {:>12.1f} {:>14.0f} {:>14.0f}'.format(
+            r['size_mb'], r['serializer'], r['payload_mb'], r['encode_mb_s'], r['decode_mb_s']))
+
+
+if __name__ == '__main__':
+    main()
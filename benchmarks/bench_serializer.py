@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""Document size and encode/decode throughput of the serializers.
+
+Usage::
+
+    python -m benchmarks.bench_serializer [-n ITERATIONS]
+
+Encoding covers ``serialize`` plus BSON encoding of the cache document, and
+decoding covers BSON decoding plus ``deserialize``, i.e. the CPU work done
+on a miss and on a hit respectively.
+"""
+
+from __future__ import absolute_import, print_function
+
+import argparse
+import datetime
+import time
+from collections import OrderedDict
+
+import bson
+
+from mongo_memoize import CompressedSerializer, PickleSerializer, TypedSerializer
+from mongo_memoize.serializer import available_codecs
+
+PAYLOADS = OrderedDict([
+    ('int', 42),
+    ('small dict', {'id': 1, 'name': 'alice', 'tags': ['a', 'b'], 'score': 0.5}),
+    ('list of 10k ints', list(range(10000))),
+    ('1k records', [{'id': i, 'name': 'user%d' % i, 'active': i % 2 == 0} for i in range(1000)]),
+    ('1 MB bytes', bytes(bytearray(range(256))) * 4096),
+    ('json-like 1 MB', {'rows': [{'id': i, 'country': 'JP', 'status': 'active', 'amount': i % 100 * 1.5}
+                                 for i in range(15000)]}),
+    ('datetime', datetime.datetime(2020, 1, 2, 3, 4, 5)),
+    ('1k tuples', [(i, 'user%d' % i) for i in range(1000)]),
+])
+
+SERIALIZERS = OrderedDict([
+    ('pickle base64', PickleSerializer()),
+    ('pickle binary', PickleSerializer(binary=True)),
+    ('zlib level 1', CompressedSerializer(codec='zlib', level=1)),
+    ('zlib level 6', CompressedSerializer(codec='zlib', level=6)),
+    ('bz2', CompressedSerializer(codec='bz2')),
+    ('lzma preset 1', CompressedSerializer(codec='lzma', level=1)),
+    ('typed', TypedSerializer()),
+])
+for _codec in ('lz4', 'zstd', 'snappy'):
+    if _codec in available_codecs():
+        SERIALIZERS[_codec] = CompressedSerializer(codec=_codec)
+
+
+def measure(func, iterations):
+    best = None
+    for _ in range(3):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        elapsed = (time.perf_counter() - start) / iterations
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def bench(serializer, payload, iterations):
+    document = bson.encode({'result': serializer.serialize(payload)})
+
+    def encode():
+        bson.encode({'result': serializer.serialize(payload)})
+
+    def decode():
+        serializer.deserialize(bson.decode(document)['result'])
+
+    return OrderedDict([
+        ('size', len(document)),
+        ('encode_us', measure(encode, iterations) * 1e6),
+        ('decode_us', measure(decode, iterations) * 1e6),
+    ])
+
+
+def run(iterations=200, serializers=SERIALIZERS, payloads=PAYLOADS):
+    results = []
+    for payload_name, payload in payloads.items():
+        for serializer_name, serializer in serializers.items():
+            result = OrderedDict([('payload', payload_name), ('serializer', serializer_name)])
+            result.update(bench(serializer, payload, iterations))
+            results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--iterations', type=int, default=200)
+    args = parser.parse_args()
+
+    print('{:<18} {:<22} {:>12} {:>12} {:>12}'.format(
+        'payload', 'serializer', 'size (B)', 'encode (us)', 'decode (us)'))
+    for r in run(args.iterations):
+        print('{:<18} {:<22} {:>12} {:>12.1f} {:>12.1f}'.format(
+            r['payload'], r['serializer'], r['size'], r['encode_us'], r['decode_us']))
+
+
+if __name__ == '__main__':
+    main()
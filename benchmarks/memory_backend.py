@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""In-process stand-in for a MongoDB client, for benchmarking.
+
+It implements just the subset of the PyMongo API used by
+:class:`mongo_memoize.Memoizer` on its hit and miss paths: equality and
+``$in`` filters, projections, ``$set``/``$unset`` upserts, returning the
+replaced document or not, and unordered bulk writes of
+:class:`pymongo.UpdateOne`. Documents are kept BSON-encoded, so
+encoding and decoding costs are still measured; only the network round
+trip and the server work are left out.
+
+Usage::
+
+    client = MemoryClient()
+
+    @memoize(mongo_client_cb=lambda: client)
+    def func():
+        ...
+"""
+
+from __future__ import absolute_import
+
+import threading
+
+import bson
+from bson.objectid import ObjectId
+from pymongo import UpdateOne
+
+
+class MemoryClient(object):
+
+    def __init__(self):
+        self._databases = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name):
+        with self._lock:
+            if name not in self._databases:
+                self._databases[name] = MemoryDatabase(name)
+            return self._databases[name]
+
+    def drop_database(self, name):
+        with self._lock:
+            self._databases.pop(name, None)
+
+    def close(self):
+        pass
+
+
+class MemoryDatabase(object):
+
+    def __init__(self, name):
+        self.name = name
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name):
+        with self._lock:
+            if name not in self._collections:
+                self._collections[name] = MemoryCollection(self, name)
+            return self._collections[name]
+
+    def list_collection_names(self):
+        return list(self._collections)
+
+
+class MemoryCollection(object):
+
+    def __init__(self, database, name):
+        self.database = database
+        self.name = name
+        self.full_name = '{}.{}'.format(database.name, name)
+        # BSON-encoded documents by _id, and _id by value of each unique field
+        self._documents = {}
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    def create_index(self, keys, unique=False, **kwargs):
+        # only unique single-field indexes speed up lookups here
+        if unique and isinstance(keys, str):
+            with self._lock:
+                self._indexes.setdefault(keys, {})
+        return keys
+
+    def find_one(self, filter, projection=None):
+        for document in self.find(filter, projection):
+            return document
+        return None
+
+    def find(self, filter, projection=None, **kwargs):
+        with self._lock:
+            encoded = [self._documents[_id] for _id in self._match(filter)]
+        return [_project(bson.decode(data), projection) for data in encoded]
+
+    def count_documents(self, filter):
+        with self._lock:
+            return len(self._match(filter))
+
+    def update_one(self, filter, update, upsert=False):
+        with self._lock:
+            self._update(filter, update, upsert)
+
+    def find_one_and_update(self, filter, update, projection=None, upsert=False):
+        with self._lock:
+            previous = self._update(filter, update, upsert)
+        return None if previous is None else _project(previous, projection)
+
+    def bulk_write(self, requests, ordered=True):
+        with self._lock:
+            for request in requests:
+                assert isinstance(request, UpdateOne), 'Only UpdateOne is supported.'
+                self._update(request._filter, request._doc, request._upsert)
+
+    def insert_many(self, documents, ordered=True):
+        with self._lock:
+            for document in documents:
+                document.setdefault('_id', ObjectId())
+                self._write(document)
+
+    def delete_many(self, filter):
+        with self._lock:
+            for _id in self._match(filter):
+                self._delete(_id)
+
+    def _match(self, filter):
+        ids = None
+        for field, condition in filter.items():
+            values = condition['$in'] if isinstance(condition, dict) else [condition]
+            if field == '_id':
+                matched = set(_hashable(value) for value in values if _hashable(value) in self._documents)
+            elif field in self._indexes:
+                matched = set(self._indexes[field][_hashable(value)] for value in values
+                              if _hashable(value) in self._indexes[field])
+            else:
+                matched = set(_id for _id, data in self._documents.items()
+                              if bson.decode(data).get(field) in values)
+            ids = matched if ids is None else ids & matched
+        return list(self._documents) if ids is None else list(ids)
+
+    def _update(self, filter, update, upsert):
+        # returns the document before the update, or None
+        ids = self._match(filter)
+        previous = None
+        if ids:
+            previous = bson.decode(self._documents[ids[0]])
+            document = dict(previous)
+        elif upsert:
+            document = dict((field, value) for field, value in filter.items() if not isinstance(value, dict))
+            document.setdefault('_id', ObjectId())
+        else:
+            return None
+        document.update(update.get('$set', {}))
+        for field in update.get('$unset', {}):
+            document.pop(field, None)
+        self._write(document)
+        return previous
+
+    def _write(self, document):
+        _id = _hashable(document['_id'])
+        if _id in self._documents:
+            self._delete(_id)
+        self._documents[_id] = bson.encode(document)
+        for field, index in self._indexes.items():
+            if field in document:
+                index[_hashable(document[field])] = _id
+
+    def _delete(self, _id):
+        document = bson.decode(self._documents.pop(_id))
+        for field, index in self._indexes.items():
+            if field in document:
+                index.pop(_hashable(document[field]), None)
+
+
+def _hashable(value):
+    return bytes(value) if isinstance(value, bytearray) else value
+
+
+def _project(document, projection):
+    if not projection:
+        return document
+    fields = set(field for field, included in projection.items() if included)
+    fields.add('_id')
+    return dict((field, value) for field, value in document.items() if field in fields)
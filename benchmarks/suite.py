@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""Benchmark suite measuring the overhead added by the decorator.
+
+Usage::
+
+    python -m benchmarks.suite [--mongo-uri mongodb://localhost] [-o results.json] [--quick]
+
+By default the cache lives in an in-process stand-in for MongoDB (see
+:mod:`benchmarks.memory_backend`), which isolates the work done by
+mongo_memoize itself (key generation, serialization, BSON encoding and
+bookkeeping) from the network and the server. With ``--mongo-uri`` the
+same cases also run against a real server, in a scratch database that is
+dropped afterwards.
+
+The results are written as JSON, so that two runs (e.g. of two releases)
+can be compared with ``--compare OLD.json``.
+"""
+
+from __future__ import absolute_import, print_function
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import pymongo
+
+from benchmarks import bench_keygen, bench_serializer
+from benchmarks.memory_backend import MemoryClient
+from mongo_memoize import LocalCache, SharedCache, memoize
+
+SMALL_RESULT = {'id': 1, 'name': 'alice', 'tags': ['a', 'b'], 'score': 0.5}
+THREADS = (1, 2, 4, 8)
+
+
+def _measure(func, iterations):
+    # best of three runs, in microseconds per call
+    best = None
+    for _ in range(3):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        elapsed = (time.perf_counter() - start) / iterations
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1e6
+
+
+def _memoized(client, db_name, **kwargs):
+    @memoize(db_name=db_name, mongo_client_cb=lambda: client, collection_name='bench_' + uuid.uuid4().hex,
+             **kwargs)
+    def func(i):
+        return SMALL_RESULT
+    return func
+
+
+def bench_calls(client, db_name, iterations):
+    """Latency of a hit, a hit in the local cache, a hit in the shared cache
+    and a miss, against the undecorated function."""
+    def plain(i):
+        return SMALL_RESULT
+
+    func = _memoized(client, db_name)
+    func(0)
+    local = _memoized(client, db_name, local_cache=LocalCache())
+    local(0)
+    tmpdir = tempfile.mkdtemp()
+    shared = _memoized(client, db_name, shared_cache=SharedCache(os.path.join(tmpdir, 'cache.sqlite')))
+    shared(0)
+    missed = _memoized(client, db_name)
+    counter = iter(range(10 ** 9))
+
+    try:
+        return OrderedDict([
+            ('plain_us', _measure(lambda: plain(0), iterations)),
+            ('hit_us', _measure(lambda: func(0), iterations)),
+            ('local_hit_us', _measure(lambda: local(0), iterations)),
+            ('shared_hit_us', _measure(lambda: shared(0), iterations)),
+            ('miss_us', _measure(lambda: missed(next(counter)), iterations)),
+        ])
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def bench_batch(client, db_name, iterations, batch_size=1000):
+    """Per-call latency of `batch_size` hits, called one by one and with
+    ``map``."""
+    func = _memoized(client, db_name)
+    args = [(i,) for i in range(batch_size)]
+    func.map(args)
+    rounds = max(iterations // batch_size, 1)
+
+    def single():
+        for a in args:
+            func(*a)
+
+    return OrderedDict([
+        ('batch_size', batch_size),
+        ('single_us', _measure(single, rounds) / batch_size),
+        ('map_us', _measure(lambda: func.map(args), rounds) / batch_size),
+    ])
+
+
+def bench_threads(client, db_name, iterations, threads=THREADS):
+    """Throughput of hits with several threads calling the same function."""
+    func = _memoized(client, db_name)
+    for i in range(100):
+        func(i)
+
+    def worker():
+        for n in range(iterations):
+            func(n % 100)
+
+    results = OrderedDict()
+    for count in threads:
+        workers = [threading.Thread(target=worker) for _ in range(count)]
+        start = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        results['{}_threads_calls_per_s'.format(count)] = count * iterations / (time.perf_counter() - start)
+    return results
+
+
+def run_backend(client, db_name, iterations):
+    return OrderedDict([
+        ('calls', bench_calls(client, db_name, iterations)),
+        ('batch', bench_batch(client, db_name, iterations)),
+        ('threads', bench_threads(client, db_name, iterations)),
+    ])
+
+
+def run(iterations=2000, mongo_uri=None):
+    """Run every case and return the results as a JSON-serializable dict."""
+    results = OrderedDict()
+    results['meta'] = OrderedDict([
+        ('date', datetime.datetime.now(datetime.timezone.utc).isoformat()),
+        ('python', sys.version.split()[0]),
+        ('platform', platform.platform()),
+        ('pymongo', pymongo.version),
+        ('iterations', iterations),
+    ])
+    results['keygen'] = bench_keygen.run(iterations)
+    # the largest payloads take up to a second per iteration with the slow codecs
+    results['serializer'] = bench_serializer.run(max(iterations // 200, 1))
+
+    db_name = 'bench_' + uuid.uuid4().hex
+    results['memory'] = run_backend(MemoryClient(), db_name, iterations)
+    if mongo_uri is not None:
+        client = pymongo.MongoClient(mongo_uri)
+        try:
+            results['mongodb'] = run_backend(client, db_name, iterations)
+        finally:
+            client.drop_database(db_name)
+            client.close()
+    return results
+
+
+def _flatten(results, prefix=''):
+    # {'memory': {'calls': {'hit_us': 1}}} -> {'memory.calls.hit_us': 1}
+    flat = OrderedDict()
+    for name, value in results.items():
+        if name == 'meta':
+            continue
+        if isinstance(value, list):
+            value = OrderedDict(('/'.join(str(v) for v in row.values() if isinstance(v, str)), row)
+                                for row in value)
+        if isinstance(value, dict):
+            flat.update(_flatten(value, prefix + name + '.'))
+        elif isinstance(value, float):
+            flat[prefix + name] = value
+    return flat
+
+
+def compare(old, new):
+    """Print the relative change of every measurement between two runs."""
+    old, new = _flatten(old), _flatten(new)
+    for name, value in new.items():
+        if name in old and old[name]:
+            print('{:<70} {:>12.2f} {:>+8.1%}'.format(name, value, value / old[name] - 1))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-n', '--iterations', type=int, default=2000)
+    parser.add_argument('--quick', action='store_true', help='run 10 times fewer iterations')
+    parser.add_argument('--mongo-uri', default=None, help='also run against this server')
+    parser.add_argument('-o', '--output', default='benchmark_results.json')
+    parser.add_argument('--compare', default=None, help='results of a previous run')
+    args = parser.parse_args()
+
+    iterations = args.iterations // 10 if args.quick else args.iterations
+    results = run(iterations, args.mongo_uri)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print('results written to {}'.format(args.output))
+
+    for backend in ('memory', 'mongodb'):
+        if backend in results:
+            for name, value in _flatten(results[backend], backend + '.').items():
+                print('{:<50} {:>14.2f}'.format(name, value))
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,6 +2,11 @@
 from __future__ import absolute_import
 
 from mongo_memoize.decorator import memoize, Memoizer
-from mongo_memoize.key_generator import PickleMD5KeyGenerator
-from mongo_memoize.serializer import NoopSerializer, PickleSerializer
-from mongo_memoize.reset import reset_cache
+from mongo_memoize.key_generator import PickleMD5KeyGenerator, PickleDigestKeyGenerator
+from mongo_memoize.local_cache import LocalCache
+from mongo_memoize.shared_cache import SharedCache
+from mongo_memoize.serializer import NoopSerializer, PickleSerializer, CompressedSerializer, OutOfBandPickleSerializer, \
+    TypedSerializer
+from mongo_memoize.reset import reset_cache, invalidate_tags, collect_old_versions
+from mongo_memoize.writer import BackgroundWriter
+from mongo_memoize.metrics import CallbackCollector, InMemoryCollector
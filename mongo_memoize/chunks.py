@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+from bson.binary import Binary
+from bson.objectid import ObjectId
+
+#: The size of the chunks of spilled payloads in bytes.
+CHUNK_SIZE = 4 * 1024 * 1024
+
+
+def chunk_collection_name(collection_name):
+    """Return the name of the collection holding the chunks of a cache
+    collection."""
+    return collection_name + '.chunks'
+
+
+def ensure_chunk_indexes(chunk_col):
+    chunk_col.create_index([('key', 1), ('gen', 1), ('n', 1)], unique=True)
+    chunk_col.create_index('qualname')
+    chunk_col.create_index('expiresAt', expireAfterSeconds=0)
+
+
+class ChunkStore(object):
+    """Stores payloads too large for a cache document as a series of chunk
+    documents, like GridFS.
+
+    Each write of a key creates a new generation of chunks, referenced by
+    the cache document, so that readers never see a mix of two writes.
+    Chunks carry the ``qualname`` and ``expiresAt`` of their cache document
+    so that :func:`reset_cache <mongo_memoize.reset_cache>` and the TTL index
+    remove them too.
+
+    :param chunk_col: The collection holding the chunks.
+    :param int chunk_size: The size of the chunks in bytes.
+    """
+
+    def __init__(self, chunk_col, chunk_size=CHUNK_SIZE):
+        self.chunk_col = chunk_col
+        self.chunk_size = chunk_size
+
+    def put(self, key, data, qualname=None, expiresAt=None, encoding=None):
+        """Store `data` and return the reference to save in the cache
+        document.
+
+        :param str encoding: How `data` encodes the payload, recorded in the
+            reference, e.g. ``'bson'`` for a payload which is not binary.
+        """
+        gen = ObjectId()
+        view = memoryview(data)
+        size = len(view)
+
+        chunks = []
+        for n, start in enumerate(range(0, size, self.chunk_size)):
+            chunk = {'key': key, 'gen': gen, 'n': n, 'data': Binary(view[start:start + self.chunk_size])}
+            if qualname is not None:
+                chunk['qualname'] = qualname
+            if expiresAt is not None:
+                chunk['expiresAt'] = expiresAt
+            chunks.append(chunk)
+            if len(chunks) == 4:
+                self.chunk_col.insert_many(chunks, ordered=False)
+                chunks = []
+        if chunks:
+            self.chunk_col.insert_many(chunks, ordered=False)
+
+        ref = {'gen': gen, 'size': size, 'chunks': -(-size // self.chunk_size)}
+        if isinstance(data, Binary) and data.subtype:
+            ref['subtype'] = data.subtype
+        if encoding is not None:
+            ref['encoding'] = encoding
+        return ref
+
+    def get(self, key, ref):
+        """Return the payload referenced by `ref`, or None if some chunks
+        are missing (e.g. deleted by a concurrent write).
+
+        The chunks are copied into a single preallocated ``bytearray`` as
+        they are received, which is returned as is. The BSON binary subtype
+        of the payload, if any, is ``ref['subtype']``.
+        """
+        buf = bytearray(ref['size'])
+        view = memoryview(buf)
+        offset = 0
+        count = 0
+        cursor = self.chunk_col.find({'key': key, 'gen': ref['gen']}, {'_id': 0, 'n': 1, 'data': 1}).sort('n', 1)
+        for chunk in cursor:
+            if chunk['n'] != count:
+                return None
+            data = chunk['data']
+            view[offset:offset + len(data)] = data
+            offset += len(data)
+            count += 1
+        view.release()
+
+        if count != ref['chunks'] or offset != ref['size']:
+            return None
+        return buf
+
+    def delete(self, key, keep=None):
+        """Delete the chunks of `key`, except the generation `keep`."""
+        query = {'key': key}
+        if keep is not None:
+            query['gen'] = {'$ne': keep}
+        self.chunk_col.delete_many(query)
+
+    def delete_many(self, keys):
+        """Delete the chunks of each key of `keys`."""
+        self.chunk_col.delete_many({'key': {'$in': list(keys)}})
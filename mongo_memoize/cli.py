@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""Command line maintenance of the cache.
+
+Usage::
+
+    python -m mongo_memoize gc myapp.orders:get_orders myapp.orders:Orders.total --pause 0.1
+    python -m mongo_memoize export myapp.orders:get_orders orders.bson.gz
+    python -m mongo_memoize import orders.bson.gz --function myapp.orders:get_orders
+
+Functions are given as ``module:qualified_name`` and imported, so that
+their cache settings are read from their decorator.
+"""
+
+from __future__ import absolute_import, print_function
+
+import argparse
+import importlib
+
+from mongo_memoize.dump import export_cache, import_cache
+from mongo_memoize.reset import collect_old_versions
+
+
+def import_function(path):
+    """Import a function from its ``module:qualified_name`` path."""
+    module_name, sep, qualname = path.partition(':')
+    if not sep or not qualname:
+        raise argparse.ArgumentTypeError('expected module:function, got {!r}'.format(path))
+    try:
+        obj = importlib.import_module(module_name)
+        for name in qualname.split('.'):
+            obj = getattr(obj, name)
+    except (ImportError, AttributeError) as e:
+        raise argparse.ArgumentTypeError('cannot import {}: {}'.format(path, e))
+    if not hasattr(obj, 'memoizer'):
+        raise argparse.ArgumentTypeError('{} is not memoized'.format(path))
+    return obj
+
+
+def gc(args):
+    deleted = collect_old_versions(args.functions, db_name=args.db_name, mongo_uri=args.mongo_uri,
+                                   batch_size=args.batch_size, pause=args.pause, verbose=args.verbose)
+    print('{} documents removed'.format(deleted))
+
+
+def export(args):
+    exported = export_cache(args.function, args.path, db_name=args.db_name, mongo_uri=args.mongo_uri,
+                            collection_name=args.collection_name, batch_size=args.batch_size, verbose=args.verbose)
+    print('{} documents exported'.format(exported))
+
+
+def import_(args):
+    imported = import_cache(args.path, args.function, db_name=args.db_name, mongo_uri=args.mongo_uri,
+                            collection_name=args.collection_name, batch_size=args.batch_size, verbose=args.verbose)
+    print('{} documents imported'.format(imported))
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(prog='python -m mongo_memoize', description=__doc__.splitlines()[0])
+    parser.add_argument('--mongo-uri', default=None,
+                        help='MongoDB connection URI (default: the one of the functions)')
+    parser.add_argument('--db-name', default=None, help='database name (default: the one of the functions)')
+    parser.add_argument('-v', '--verbose', action='store_true')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    command = commands.add_parser('gc', help='remove the results of the old versions of versioned functions')
+    command.add_argument('functions', nargs='+', type=import_function, metavar='module:function')
+    command.add_argument('--batch-size', type=int, default=1000, help='documents removed per delete')
+    command.add_argument('--pause', type=float, default=0, help='seconds to sleep between two batches')
+    command.set_defaults(run=gc)
+
+    command = commands.add_parser('export', help='write the cached results of a function to a file')
+    command.add_argument('function', type=import_function, metavar='module:function')
+    command.add_argument('path', help='the file to write, gzip-compressed if it ends with .gz')
+    command.add_argument('--collection-name', default=None,
+                         help='collection name (default: the one of the function)')
+    command.add_argument('--batch-size', type=int, default=1000, help='documents per round trip')
+    command.set_defaults(run=export)
+
+    command = commands.add_parser('import', help='load the cached results exported to a file')
+    command.add_argument('path', help='the file to read')
+    command.add_argument('--function', type=import_function, default=None, metavar='module:function',
+                         help='the function whose collection receives the results')
+    command.add_argument('--collection-name', default=None,
+                         help='collection name (default: the one of the function, or cache)')
+    command.add_argument('--batch-size', type=int, default=1000, help='documents per bulk write')
+    command.set_defaults(run=import_)
+
+    return parser
+
+
+def main(argv=None):
+    args = make_parser().parse_args(argv)
+    args.run(args)
+
+
+if __name__ == '__main__':
+    main()
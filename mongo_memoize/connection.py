@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import atexit
+import os
+import threading
+
+import pymongo
+
+_lock = threading.Lock()
+_clients = {}
+_pid = os.getpid()
+
+
+def client_key(mongo_uri=None, connection_options=None):
+    """Return the key identifying a pooled client.
+
+    :param str mongo_uri: MongoDB connection URI.
+    :param dict connection_options: Additional parameters passed to
+        :class:`pymongo.MongoClient`.
+    """
+    options = connection_options or {}
+    return (mongo_uri, tuple(sorted((k, repr(v)) for k, v in options.items())))
+
+
+def _reset_after_fork():
+    """Forget the clients inherited from the parent process.
+
+    PyMongo clients are not fork-safe, so the child must not reuse (or close)
+    the sockets and monitor threads of its parent.
+    """
+    global _lock, _pid
+
+    _lock = threading.Lock()
+    _clients.clear()
+    _pid = os.getpid()
+
+
+def get_client(mongo_uri=None, connection_options=None):
+    """Return the process-wide client for the given URI and options.
+
+    The client is created on first use and shared by every caller asking for
+    the same URI and options. A new client is created after ``os.fork()``.
+
+    :param str mongo_uri: MongoDB connection URI.
+    :param dict connection_options: Additional parameters passed to
+        :class:`pymongo.MongoClient`.
+    """
+    if _pid != os.getpid():
+        _reset_after_fork()
+
+    key = client_key(mongo_uri, connection_options)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            client = pymongo.MongoClient(mongo_uri, **(connection_options or {}))
+            _clients[key] = client
+
+    return client
+
+
+def close_clients():
+    """Close every pooled client. Registered to run at interpreter exit."""
+    if _pid != os.getpid():
+        _reset_after_fork()
+        return
+
+    with _lock:
+        clients = list(_clients.values())
+        _clients.clear()
+
+    for client in clients:
+        try:
+            client.close()
+        except Exception:
+            pass
+
+
+atexit.register(close_clients)
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -2,27 +2,257 @@
 
 from __future__ import absolute_import, print_function
 
-import pymongo
-from functools import wraps
+import asyncio
+import hashlib
+import inspect
+import os
+import pickle
+import re
+import threading
+import types
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
+from itertools import islice, repeat
 
+import bson
+from bson.binary import Binary
+from bson.objectid import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import CollectionInvalid, DuplicateKeyError, PyMongoError
+
+from mongo_memoize.chunks import CHUNK_SIZE, ChunkStore, chunk_collection_name, ensure_chunk_indexes
+from mongo_memoize.connection import client_key, get_client
 from mongo_memoize.key_generator import PickleMD5KeyGenerator
-from mongo_memoize.serializer import PickleSerializer
+from mongo_memoize.lease import Lease, ensure_lease_indexes, lease_collection_name
+from mongo_memoize.serializer import PICKLE_SUBTYPE, PickleSerializer
+from mongo_memoize.writer import BackgroundWriter, get_default_writer
 
 import datetime
+import time
+
+_MISSING = object()
+
+#: The fields of the cache documents needed to serve a hit.
+READ_FIELDS = ('result', 'spill', 'error', 'expiresAt', 'staleAt')
+
+_MAX_COLLECTION_NAME_LENGTH = 80
+
+# the argument values stored in the params field
+_PARAM_TYPES = (str, int, float, bool, type(None), datetime.datetime, ObjectId)
+
+# the fields of a cache document that are removed when it is overwritten
+# without them
+_REPLACED_FIELDS = ('result', 'spill', 'error', 'errorType', 'expiresAt', 'staleAt', 'tags')
+
+# payloads above this size are stored in chunks, leaving room in the 16 MB
+# document for the other fields
+SPILL_THRESHOLD = 15 * 1024 * 1024
+
+# the interval between two writes of the hit counts, in seconds
+_HIT_FLUSH_INTERVAL = 10
+
+# bounds of the interval between two polls of a lease waiter, in seconds
+_LEASE_POLL_MIN = 0.01
+_LEASE_POLL_MAX = 0.5
+
+
+# the number of items of a container whose size is measured, at the top
+# level and below it; the size of the other items is extrapolated
+_SIZE_SAMPLE = 100
+_NESTED_SIZE_SAMPLE = 10
+_MAX_SIZE_DEPTH = 3
+
+
+def _payload_size(payload, depth=0):
+    # the approximate BSON size of a payload, without encoding it
+    if isinstance(payload, (bytes, bytearray)):
+        return len(payload)
+    if isinstance(payload, str):
+        return len(payload) if payload.isascii() else len(payload.encode('utf-8'))
+    if isinstance(payload, (dict, list, tuple)):
+        if depth >= _MAX_SIZE_DEPTH:
+            return 16 * len(payload)
+        items = payload.items() if isinstance(payload, dict) else enumerate(payload)
+        sample = _SIZE_SAMPLE if depth == 0 else _NESTED_SIZE_SAMPLE
+        # the type, the name and the terminator of each element
+        size = sum(len(str(name)) + 2 + _payload_size(value, depth + 1)
+                   for name, value in islice(items, sample))
+        if len(payload) > sample:
+            size = size * len(payload) // sample
+        return size + 5
+    # numbers, dates, ObjectIds
+    return 8
+
+
+_executor_lock = threading.Lock()
+_default_executor = None
+_executor_pid = None
+
+
+def _get_default_executor():
+    global _default_executor, _executor_pid
+
+    pid = os.getpid()
+    if _executor_pid != pid:
+        # threads of the parent do not survive os.fork()
+        with _executor_lock:
+            if _executor_pid != pid:
+                _default_executor = ThreadPoolExecutor(thread_name_prefix='mongo_memoize')
+                _executor_pid = pid
+    return _default_executor
+
+
+class _Flight(object):
+    """A computation shared by concurrent callers of the same key."""
+
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def _invoke(func, args, kwargs):
+    # calls the undecorated function; module-level so that it can be sent to
+    # a process pool together with the (picklable) decorated function
+    return getattr(func, '__wrapped__', func)(*args, **kwargs)
+
+
+def _timed_invoke(func, args, kwargs):
+    start = time.perf_counter()
+    ret = _invoke(func, args, kwargs)
+    return ret, time.perf_counter() - start
+
+
+def function_collection_name(prefix, func):
+    """Return the name of the collection caching the results of `func` alone:
+    `prefix`, the module name and the qualified name of the function, with
+    the characters other than letters, digits, ``_`` and ``.`` replaced."""
+    name = '{}_{}_{}'.format(prefix, func.__module__, func.__qualname__)
+    name = re.sub(r'[^0-9A-Za-z_.]', '_', name)
+    if len(name) > _MAX_COLLECTION_NAME_LENGTH:
+        # leaves room for the database name and the .chunks/.leases suffixes
+        digest = hashlib.md5(name.encode('utf-8')).hexdigest()[:8]
+        name = name[:_MAX_COLLECTION_NAME_LENGTH - 9] + '_' + digest
+    return name
+
+
+def code_version(func):
+    """Return a digest of the bytecode of `func` and of the functions it
+    defines, used as its version with ``version='auto'``. It changes with
+    the code, and with the Python version compiling it."""
+    func = inspect.unwrap(func)
+    code = getattr(func, '__code__', None)
+    if code is None:
+        raise ValueError("version='auto' requires a Python function, got {!r}.".format(func))
+    digest = hashlib.md5()
+    _hash_code(digest, code)
+    return digest.hexdigest()[:12]
+
+
+def _hash_code(digest, code):
+    digest.update(code.co_code)
+    digest.update(repr(code.co_names).encode('utf-8'))
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            _hash_code(digest, const)
+        else:
+            digest.update(_const_repr(const).encode('utf-8'))
+
+
+def _const_repr(const):
+    # the order of frozensets depends on the hash seed of the process
+    if isinstance(const, frozenset):
+        return 'frozenset({})'.format(sorted(_const_repr(c) for c in const))
+    if isinstance(const, tuple):
+        return '({})'.format(', '.join(_const_repr(c) for c in const))
+    return repr(const)
+
+
+def _is_param(value):
+    if isinstance(value, int):
+        return -2 ** 63 <= value < 2 ** 63
+    return isinstance(value, _PARAM_TYPES)
+
+
+def _is_empty(ret):
+    if ret is None:
+        return True
+    try:
+        return len(ret) == 0
+    except TypeError:
+        return False
+
+
+def _accepts_subtype(serializer):
+    try:
+        parameters = inspect.signature(serializer.deserialize).parameters
+    except (TypeError, ValueError):
+        return False
+    return 'subtype' in parameters or \
+        any(p.kind == inspect.Parameter.VAR_KEYWORD for p in parameters.values())
+
+
+def _timestamp(dt):
+    # PyMongo returns naive UTC datetimes unless the client is tz_aware
+    if dt is None:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
+    return dt.timestamp()
+
 
 class Memoizer(object):
 
+    # Collections whose schema has been bootstrapped by this process.
+    _schema_lock = threading.Lock()
+    _schema_ready = set()
+
     def __init__(self, db_name='mongo_memoize', mongo_client_cb=None, mongo_uri=None, collection_name=None,
                  prefix='memoize', capped=False, capped_size=100000000, capped_max=None, max_age=None,
-                 connection_options={}, key_generator=None, serializer=None, verbose=False, timeout=0):
+                 connection_options={}, key_generator=None, serializer=None, verbose=False, timeout=0,
+                 skip_schema=False, local_cache=None, executor=None, single_flight=False,
+                 lease_timeout=None, lease_wait=None, stale_ttl=None, refresh_workers=2,
+                 max_pending_refreshes=100, write_behind=False, spill_threshold=SPILL_THRESHOLD,
+                 chunk_size=CHUNK_SIZE, legacy_key_generator=None, key_as_id=False, lean=False,
+                 debug_max_length=None, metrics=None, cache_exceptions=(), exception_ttl=60,
+                 negative_ttl=None, is_negative=None, queryable_args=False, tags=None, version=None,
+                 track_hits=False, shared_cache=None):
 
         self.serializer = serializer
         if not self.serializer:
             self.serializer = PickleSerializer()
+        # serializers predating spilling only take the payload
+        self._subtype_aware = _accepts_subtype(self.serializer)
 
         self.key_generator = key_generator
         if not self.key_generator:
             self.key_generator = PickleMD5KeyGenerator()
+        self.legacy_key_generator = legacy_key_generator
+        self.key_as_id = key_as_id
+        # the field holding the cache key in the cache documents
+        self.key_field = '_id' if key_as_id else 'key'
+        # the fields read on lookups; the others are only for humans
+        self.projection = dict.fromkeys(READ_FIELDS + (self.key_field,), 1)
+        self.lean = lean
+        self.debug_max_length = debug_max_length
+        self.metrics = metrics
+        self.cache_exceptions = tuple(cache_exceptions)
+        self.exception_ttl = exception_ttl
+        self.negative_ttl = negative_ttl
+        self.is_negative = is_negative if is_negative is not None else _is_empty
+        self.queryable_args = queryable_args
+        self.tags = tags
+        self.version = version
+        self.track_hits = track_hits
+        self._hit_counts = defaultdict(int)
+        self._hits_lock = threading.Lock()
+        self._hits_flushed_at = time.monotonic()
+        self._signatures = {}
+        self._versions = {}
+        self._namespaces = {}
 
         self.mongo_uri = mongo_uri
         self.connection_options = connection_options
@@ -36,30 +266,100 @@ class Memoizer(object):
         self.verbose = verbose
         self.timeout = timeout
         self.max_age = max_age
+        self.skip_schema = skip_schema
+        self.local_cache = local_cache
+        self.shared_cache = shared_cache
+        self.executor = executor
+        self.single_flight = single_flight
+        self.lease_timeout = lease_timeout
+        self.lease_wait = lease_wait if lease_wait is not None else lease_timeout
+
+        if stale_ttl is not None and max_age is not None:
+            assert stale_ttl <= max_age, 'stale_ttl must not exceed max_age.'
+        self.stale_ttl = stale_ttl
+        self.refresh_workers = refresh_workers
+        self.max_pending_refreshes = max_pending_refreshes
+
+        self.spill_threshold = spill_threshold
+        self.chunk_size = chunk_size
+
+        if isinstance(write_behind, BackgroundWriter):
+            self.writer = write_behind
+        elif write_behind:
+            self.writer = get_default_writer()
+        else:
+            self.writer = None
+
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
 
         self.mongo_client_cb = mongo_client_cb
+        self.db_conn = None
         self.db = None
         self.is_connected = False
         self.external_db_conn = True if mongo_client_cb else False
+        self._pid = None
+        self._cache_col = None
+        self._inflight_tasks = {}
+        self._flights = {}
+        self._flights_lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._refresh_executor = None
+        self._refresh_pid = None
+        self._refreshing = set()
+        self._refresh_tasks = set()
 
     def connect(self):
+        """Attach to the MongoDB client of the current process.
+
+        The client is obtained once per process: ``mongo_client_cb`` is called
+        only on the first call (and again after ``os.fork()``), otherwise the
+        client is taken from the process-wide pool shared by every memoizer
+        using the same URI and options.
+        """
+        pid = os.getpid()
+        if self.is_connected and self._pid == pid:
+            return
+
         if self.external_db_conn:
             self.db_conn = self.mongo_client_cb()
         else:
-            self.db_conn = pymongo.MongoClient(
-                self.mongo_uri, *self.connection_options)        
+            self.db_conn = get_client(self.mongo_uri, self.connection_options)
         self.db = self.db_conn[self.db_name]
+        self._cache_col = None
+        self._pid = pid
         self.is_connected = True
 
     def disconnect(self):
-        if not self.external_db_conn:
-            try:
-                self.db_conn.close()
-            except AttributeError:
-                self.db_conn = None
-            self.is_connected = False
+        """Detach from the client. Pooled clients are closed at exit."""
+        self.db_conn = None
+        self.db = None
+        self._cache_col = None
+        self.is_connected = False
 
-    def initialize_col(self, func):
+    def _schema_key(self):
+        if self.external_db_conn:
+            conn = id(self.mongo_client_cb)
+        else:
+            conn = client_key(self.mongo_uri, self.connection_options)
+        return (conn, self.db_name, self.collection_name, self.capped, self.capped_size,
+                self.capped_max, self.expires, self.lease_timeout is not None, self.key_as_id,
+                self.tags is not None, self.track_hits)
+
+    @property
+    def expires(self):
+        """Whether some cache documents have an expiry date."""
+        return self.max_age is not None or bool(self.cache_exceptions) or self.negative_ttl is not None
+
+    def ensure_schema(self):
+        """Create the cache collection and its indexes.
+
+        This is done lazily on the first call of the memoized function, once
+        per process and collection. Call it explicitly to bootstrap the
+        collection at deploy time.
+        """
+        self.connect()
         col_name = self.collection_name
 
         if self.capped:
@@ -71,21 +371,1025 @@ class Memoizer(object):
                 if self.capped_max:
                     capped_args['max'] = self.capped_max
 
-                self.db.create_collection(col_name, capped=True, **capped_args)
+                try:
+                    self.db.create_collection(col_name, capped=True, **capped_args)
+                except CollectionInvalid:
+                    # created concurrently by another process
+                    pass
 
         cache_col = self.db[col_name]
-        cache_col.create_index('key', unique=True)
+        if not self.key_as_id:
+            cache_col.create_index('key', unique=True)
+        # used by reset_cache
+        cache_col.create_index('qualname')
+        if self.tags is not None:
+            # used by invalidate_tags
+            cache_col.create_index('tags')
+        if self.track_hits:
+            # used by prefetch
+            cache_col.create_index([('qualname', 1), ('hits', -1)])
 
-        if self.max_age is not None:
+        if self.expires:
             # if the document db supports it or not.
             cache_col.create_index('expiresAt', expireAfterSeconds=0)
 
+        if self.lease_timeout is not None:
+            ensure_lease_indexes(self.db[lease_collection_name(col_name)])
+
+        with self._schema_lock:
+            self._schema_ready.add(self._schema_key())
+
         return cache_col
 
+    def drop_collections(self):
+        """Drop the cache collection, with its chunks and leases, and
+        bootstrap it again. With `skip_schema`, the schema is managed
+        elsewhere and would not be rebuilt, so their documents are deleted
+        instead.
+
+        Only use it on a collection dedicated to one function: this is how
+        :func:`reset_cache <mongo_memoize.reset_cache>` clears them.
+        """
+        self.connect()
+        col_name = self.collection_name
+        names = (col_name, chunk_collection_name(col_name), lease_collection_name(col_name))
+        if self.skip_schema:
+            for name in names:
+                self.db[name].delete_many({})
+            return
+
+        for name in names:
+            self.db.drop_collection(name)
+
+        schema_key = self._schema_key()
+        with self._schema_lock:
+            self._schema_ready.discard(schema_key)
+        self._cache_col = None
+        self.ensure_schema()
+        if self.spill_threshold is not None:
+            # the other processes consider the chunk indexes created
+            ensure_chunk_indexes(self.db[names[1]])
+            with self._schema_lock:
+                self._schema_ready.add(schema_key + ('chunks',))
+
+    def initialize_col(self, func):
+        """Return the cache collection, bootstrapping its schema if needed."""
+        self.connect()
+        if self._cache_col is None:
+            if self.collection_name is None:
+                self.collection_name = function_collection_name(self.prefix, func)
+            if self.skip_schema or self._schema_key() in self._schema_ready:
+                self._cache_col = self.db[self.collection_name]
+            else:
+                self._cache_col = self.ensure_schema()
+        return self._cache_col
+
+    def get_version(self, func):
+        """Return the version of `func` as a string, or None if it is not
+        versioned."""
+        if self.version is None:
+            return None
+        version = self._versions.get(func)
+        if version is None:
+            version = code_version(func) if self.version == 'auto' else str(self.version)
+            self._versions[func] = version
+        return version
+
+    def namespace(self, func):
+        """Return the namespace of the cache keys of `func`: its module, its
+        module and qualified name if it caches exceptions, or its module,
+        qualified name and version if it is versioned."""
+        namespace = self._namespaces.get(func)
+        if namespace is None:
+            version = self.get_version(func)
+            if version is None and self.cache_exceptions:
+                # a cached exception is only raised by the function which
+                # stored it, whatever the other functions of its module
+                namespace = '{}.{}'.format(func.__module__, func.__qualname__).encode('utf-8')
+            elif version is None:
+                namespace = func.__module__.encode('utf-8')
+            else:
+                namespace = '{}.{}@{}'.format(func.__module__, func.__qualname__, version).encode('utf-8')
+            self._namespaces[func] = namespace
+        return namespace
+
+    def make_key(self, func, args, kwargs):
+        """Return the cache key of a call."""
+        if self.metrics is None:
+            return self.key_generator(self.namespace(func), args, kwargs)
+
+        start = time.perf_counter()
+        cache_key = self.key_generator(self.namespace(func), args, kwargs)
+        self.metrics.timing(func.__qualname__, 'key', time.perf_counter() - start)
+        return cache_key
+
+    def make_legacy_key(self, func, args, kwargs):
+        """Return the cache key of a call under `legacy_key_generator`, or
+        None."""
+        if self.legacy_key_generator is None or args is None:
+            return None
+        return self.legacy_key_generator(self.namespace(func), args, kwargs or {})
+
+    def lookup(self, cache_col, cache_key, legacy_key=None):
+        """Return the cache document stored under `cache_key`, or None.
+
+        A document found under `legacy_key` instead is moved to `cache_key`.
+        """
+        if legacy_key is None:
+            return cache_col.find_one({self.key_field: cache_key}, self.projection)
+
+        cached_obj = cache_col.find_one({self.key_field: {'$in': [cache_key, legacy_key]}}, self.projection)
+        if cached_obj is not None and cached_obj[self.key_field] == legacy_key:
+            self.migrate_key(cache_col, legacy_key, cache_key, cached_obj)
+        return cached_obj
+
+    def migrate_key(self, cache_col, legacy_key, cache_key, cached_obj):
+        """Move the cache document (and its chunks) stored under
+        `legacy_key` to `cache_key`."""
+        if 'spill' in cached_obj:
+            self.get_chunk_store().chunk_col.update_many({'key': legacy_key}, {'$set': {'key': cache_key}})
+        try:
+            if self.key_as_id:
+                # _id is immutable: copy the whole document
+                document = cache_col.find_one({'_id': legacy_key})
+                if document is not None:
+                    cache_col.insert_one(dict(document, _id=cache_key))
+            else:
+                cache_col.update_one({'_id': cached_obj['_id']}, {'$set': {'key': cache_key}})
+        except DuplicateKeyError:
+            # written under the new key meanwhile
+            pass
+        if self.key_as_id:
+            cache_col.delete_one({'_id': legacy_key})
+        else:
+            cache_col.delete_one({'_id': cached_obj['_id'], 'key': legacy_key})
+        cached_obj[self.key_field] = cache_key
+
+    def make_document(self, func, args, kwargs, ret):
+        """Build the fields of the cache document storing `ret`."""
+        if self.metrics is None:
+            payload = self.serializer.serialize(ret)
+        else:
+            start = time.perf_counter()
+            payload = self.serializer.serialize(ret)
+            self.metrics.timing(func.__qualname__, 'serialize', time.perf_counter() - start)
+            self.metrics.payload_size(func.__qualname__, _payload_size(payload))
+
+        now = datetime.datetime.now(datetime.timezone.utc)
+        resultSet = self._describe(func, args, kwargs, now)
+        resultSet['result'] = payload
+        self._tag(resultSet, args, kwargs, ret)
+
+        if self.negative_ttl is not None and self.is_negative(ret):
+            ttl = self.negative_ttl if self.max_age is None else min(self.negative_ttl, self.max_age)
+            resultSet['expiresAt'] = now+datetime.timedelta(seconds=ttl)
+            return resultSet
+
+        if self.max_age is not None:
+            resultSet['expiresAt'] = now+datetime.timedelta(seconds=self.max_age)
+        if self.stale_ttl is not None:
+            resultSet['staleAt'] = now+datetime.timedelta(seconds=self.stale_ttl)
+
+        return resultSet
+
+    def make_error_document(self, func, args, kwargs, error):
+        """Build the fields of the cache document storing the exception
+        `error`, or return None if it cannot be pickled."""
+        try:
+            payload = Binary(pickle.dumps(error, protocol=-1), PICKLE_SUBTYPE)
+        except Exception:
+            return None
+
+        now = datetime.datetime.now(datetime.timezone.utc)
+        resultSet = self._describe(func, args, kwargs, now)
+        resultSet['error'] = payload
+        resultSet['errorType'] = type(error).__name__
+        self._tag(resultSet, args, kwargs, error)
+        resultSet['expiresAt'] = now+datetime.timedelta(seconds=self.exception_ttl)
+        return resultSet
+
+    def _describe(self, func, args, kwargs, now):
+        # the fields describing the call, used for invalidation and debugging
+        resultSet = {
+            'qualname': str(func.__qualname__),
+            # the qualified name is only unique within the module
+            'module': func.__module__,
+            'cachedAt': now,
+        }
+        if self.version is not None:
+            resultSet['version'] = self.get_version(func)
+        if self.queryable_args:
+            resultSet['params'] = self.make_params(func, args, kwargs)
+        if not self.lean:
+            resultSet['args'] = self._debug_string(args)
+            resultSet['kwargs'] = self._debug_string(kwargs)
+        return resultSet
+
+    def make_tags(self, args, kwargs, result):
+        """Return the tags of the cache document storing `result`, the
+        static `tags` or those returned by ``tags(result, *args, **kwargs)``."""
+        tags = self.tags
+        if callable(tags):
+            tags = tags(result, *args, **kwargs)
+        if tags is None:
+            return []
+        if isinstance(tags, str):
+            return [tags]
+        return list(tags)
+
+    def _tag(self, resultSet, args, kwargs, result):
+        if self.tags is not None:
+            tags = self.make_tags(args, kwargs, result)
+            if tags:
+                resultSet['tags'] = tags
+
+    def make_params(self, func, args, kwargs):
+        """Return the arguments of a call by parameter name, keeping those
+        with a scalar BSON value, for ``reset_cache(where=...)``."""
+        signature = self._signatures.get(func)
+        if signature is None:
+            signature = self._signatures[func] = inspect.signature(func)
+        try:
+            bound = signature.bind(*args, **kwargs)
+        except TypeError:
+            return {}
+        bound.apply_defaults()
+
+        params = {}
+        for name, value in bound.arguments.items():
+            parameter = signature.parameters[name]
+            if parameter.kind == parameter.VAR_KEYWORD:
+                params.update((k, v) for k, v in value.items() if _is_param(v))
+            elif _is_param(value):
+                params[name] = value
+        return params
+
+    @staticmethod
+    def make_update(resultSet):
+        """Return the update writing `resultSet` over any previous version of
+        the document."""
+        update = {'$set': resultSet}
+        unset = dict((field, '') for field in _REPLACED_FIELDS if field not in resultSet)
+        if unset:
+            update['$unset'] = unset
+        return update
+
+    def _debug_string(self, value):
+        string = str(value)
+        if self.debug_max_length is not None and len(string) > self.debug_max_length:
+            string = string[:self.debug_max_length] + '...'
+        return string
+
+    def store(self, cache_col, cache_key, resultSet):
+        """Upsert the cache document of `cache_key`, or queue the upsert in
+        write-behind mode."""
+        if self.spills(resultSet):
+            self._store_spilled(cache_col, cache_key, resultSet)
+            return
+
+        if self.writer is not None:
+            self.writer.put(cache_col, {self.key_field: cache_key}, self.make_update(resultSet))
+            if self.spill_threshold is not None:
+                # the chunks of a spilled document this one may replace
+                self.writer.delete(self.get_chunk_store().chunk_col, {'key': cache_key})
+            return
+
+        if self.spill_threshold is None:
+            cache_col.update_one(
+                    {self.key_field: cache_key},
+                    self.make_update(resultSet),
+                    upsert=True
+                )
+            return
+
+        # the replaced document tells whether it left chunks behind, in the
+        # same round trip
+        previous = cache_col.find_one_and_update(
+                {self.key_field: cache_key},
+                self.make_update(resultSet),
+                {'_id': False, 'spill': True},
+                upsert=True
+            )
+        if previous is not None and 'spill' in previous:
+            self.get_chunk_store().delete(cache_key)
+
+    def spills(self, resultSet):
+        """Return whether the payload of the document is stored in chunks."""
+        payload = resultSet.get('result')
+        if self.spill_threshold is None or payload is None:
+            return False
+        if isinstance(payload, (bytes, bytearray, str)):
+            return _payload_size(payload) > self.spill_threshold
+        if not isinstance(payload, (dict, list)):
+            return False
+        # e.g. the compressed or BSON-native payloads; their estimated size
+        # may be extrapolated, so they are encoded when it comes close
+        if _payload_size(payload) * 2 <= self.spill_threshold:
+            return False
+        return len(bson.encode({'result': payload})) > self.spill_threshold
+
+    def get_chunk_store(self):
+        """Return the :class:`ChunkStore <mongo_memoize.chunks.ChunkStore>`
+        holding the payloads larger than `spill_threshold`."""
+        return ChunkStore(self.db[chunk_collection_name(self.collection_name)], self.chunk_size)
+
+    def _store_spilled(self, cache_col, cache_key, resultSet):
+        # always written synchronously: the chunks of the previous write can
+        # only be removed once the document points to the new ones
+        chunk_store = self.get_chunk_store()
+        schema_key = self._schema_key() + ('chunks',)
+        if schema_key not in self._schema_ready:
+            ensure_chunk_indexes(chunk_store.chunk_col)
+            with self._schema_lock:
+                self._schema_ready.add(schema_key)
+
+        resultSet = dict(resultSet)
+        payload = resultSet.pop('result')
+        encoding = None
+        if not isinstance(payload, (bytes, bytearray)):
+            payload = bson.encode({'result': payload})
+            encoding = 'bson'
+        resultSet['spill'] = chunk_store.put(cache_key, payload, qualname=resultSet.get('qualname'),
+                                             expiresAt=resultSet.get('expiresAt'), encoding=encoding)
+        cache_col.update_one(
+                {self.key_field: cache_key},
+                self.make_update(resultSet),
+                upsert=True
+            )
+        chunk_store.delete(cache_key, keep=resultSet['spill']['gen'])
+
+    def fetch(self, func, cache_key, args=None, kwargs=None):
+        """Return the deserialized result cached in MongoDB under
+        `cache_key`, or ``_MISSING``. A stale result is returned as is and
+        refreshed in the background."""
+        cached_obj = self.fetch_document(func, cache_key, args, kwargs)
+        if cached_obj is None:
+            return _MISSING
+
+        if self.is_stale(cached_obj):
+            self._schedule_refresh(func, args, kwargs, cache_key)
+        return self._decode(func, cache_key, cached_obj)
+
+    def fetch_document(self, func, cache_key, args=None, kwargs=None):
+        """Return the cache document of `cache_key`, or None, and count the
+        hit or miss."""
+        cache_col = self.initialize_col(func)
+        start = time.perf_counter()
+        cached_obj = self.lookup(cache_col, cache_key, self.make_legacy_key(func, args, kwargs))
+        if self.metrics is not None:
+            self.metrics.timing(func.__qualname__, 'lookup', time.perf_counter() - start)
+        if cached_obj is not None and self.is_expired(cached_obj):
+            # not yet removed by the TTL monitor
+            cached_obj = None
+        hit = cached_obj is not None
+        self._count(func, hit=hit)
+        if hit and self.track_hits:
+            self._track_hits([cache_key])
+        if self.verbose:
+            print("Cache {}: {} ___ {}".format('hit' if hit else 'miss', args, kwargs))
+        return cached_obj
+
+    def is_expired(self, cached_obj):
+        """Return whether the cache document is past its expiry."""
+        expires_at = cached_obj.get('expiresAt')
+        return expires_at is not None and _timestamp(expires_at) <= time.time()
+
+    def is_stale(self, cached_obj):
+        """Return whether the cache document is past its soft expiry."""
+        stale_at = cached_obj.get('staleAt')
+        return stale_at is not None and _timestamp(stale_at) <= time.time()
+
+    def save(self, func, cache_key, resultSet):
+        """Store the cache document built by :meth:`make_document`."""
+        cache_col = self.initialize_col(func)
+        if self.metrics is None:
+            self.store(cache_col, cache_key, resultSet)
+            return
+
+        start = time.perf_counter()
+        self.store(cache_col, cache_key, resultSet)
+        self.metrics.timing(func.__qualname__, 'write', time.perf_counter() - start)
+
+    def call(self, func, args, kwargs):
+        """Return the cached result of ``func(*args, **kwargs)``, computing
+        and storing it on a miss."""
+        cache_key = self.make_key(func, args, kwargs)
+
+        if self.local_cache is not None:
+            ret = self.local_cache.get(self._local_key(cache_key), _MISSING)
+            if ret is not _MISSING:
+                if self.metrics is not None:
+                    self.metrics.count(func.__qualname__, 'local_hits')
+                if self.track_hits:
+                    self._track_hits([cache_key])
+                return ret
+
+        if self.shared_cache is not None:
+            ret = self._fetch_shared(func, cache_key)
+            if ret is not _MISSING:
+                if self.track_hits:
+                    self._track_hits([cache_key])
+                return ret
+
+        ret = self.fetch(func, cache_key, args, kwargs)
+        if ret is not _MISSING:
+            return ret
+
+        if self.single_flight:
+            return self._compute_once(func, args, kwargs, cache_key)
+        return self.compute(func, args, kwargs, cache_key)
+
+    def compute(self, func, args, kwargs, cache_key):
+        """Call `func` and store its result under `cache_key`."""
+        start = time.perf_counter()
+        try:
+            ret = func(*args, **kwargs)
+        except Exception as e:
+            self._failed(func, args, kwargs, cache_key, e)
+            raise
+        if self.metrics is not None:
+            self.metrics.timing(func.__qualname__, 'compute', time.perf_counter() - start)
+
+        resultSet = self.make_document(func, args, kwargs, ret)
+        self.save(func, cache_key, resultSet)
+        self._cache_locally(cache_key, ret, resultSet)
+
+        return ret
+
+    def _failed(self, func, args, kwargs, cache_key, error):
+        # counts the exception raised by `func` and caches it if requested
+        if self.metrics is not None:
+            self.metrics.count(func.__qualname__, 'errors')
+        if not isinstance(error, self.cache_exceptions):
+            return
+
+        resultSet = self.make_error_document(func, args, kwargs, error)
+        if resultSet is None:
+            return
+        try:
+            self.save(func, cache_key, resultSet)
+        except Exception as e:
+            # the exception of the function is more useful to the caller
+            if self.verbose:
+                print("Cache write failed: {} ___ {}: {!r}".format(args, kwargs, e))
+
+    def _compute_once(self, func, args, kwargs, cache_key):
+        # concurrent misses of this process wait for a single computation
+        with self._flights_lock:
+            flight = self._flights.get(cache_key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[cache_key] = _Flight()
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            if self.local_cache is not None:
+                flight.result = self.local_cache.get(self._local_key(cache_key), _MISSING)
+                if flight.result is not _MISSING:
+                    return flight.result
+            # the previous flight of this key may have stored the result
+            # since our lookup
+            flight.result = self._load(func, cache_key)
+            if flight.result is not _MISSING:
+                return flight.result
+            flight.result = self._compute_leased(func, args, kwargs, cache_key)
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._flights_lock:
+                del self._flights[cache_key]
+            flight.event.set()
+
+    def _compute_leased(self, func, args, kwargs, cache_key):
+        # across processes, the holder of the lease computes while the
+        # others poll for its result
+        if self.lease_timeout is None:
+            return self.compute(func, args, kwargs, cache_key)
+
+        lease = Lease(self.get_lease_collection(func), cache_key, self.lease_timeout)
+        deadline = time.monotonic() + self.lease_wait
+        delay = _LEASE_POLL_MIN
+        while not lease.acquire():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                # waited long enough for the holder: compute locally
+                return self.compute(func, args, kwargs, cache_key)
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, _LEASE_POLL_MAX)
+            ret = self._load(func, cache_key)
+            if ret is not _MISSING:
+                return ret
+
+        try:
+            # the previous holder may have stored the result meanwhile
+            ret = self._load(func, cache_key)
+            if ret is not _MISSING:
+                return ret
+            return self.compute(func, args, kwargs, cache_key)
+        finally:
+            lease.release()
+
+    async def call_async(self, func, args, kwargs):
+        """Coroutine version of :meth:`call` for ``async def`` functions.
+
+        MongoDB is accessed from :attr:`executor` so the event loop never
+        blocks, and concurrent awaits of the same key share one lookup and
+        one computation.
+        """
+        cache_key = self.make_key(func, args, kwargs)
+
+        if self.local_cache is not None:
+            ret = self.local_cache.get(self._local_key(cache_key), _MISSING)
+            if ret is not _MISSING:
+                if self.metrics is not None:
+                    self.metrics.count(func.__qualname__, 'local_hits')
+                if self.track_hits:
+                    # written by the next lookup, off the event loop
+                    self._track_hits([cache_key], flush=False)
+                return ret
+
+        loop = asyncio.get_running_loop()
+        inflight_key = (loop, cache_key)
+        task = self._inflight_tasks.get(inflight_key)
+        if task is None:
+            task = loop.create_task(self._call_async(func, args, kwargs, cache_key))
+            self._inflight_tasks[inflight_key] = task
+            task.add_done_callback(lambda _: self._inflight_tasks.pop(inflight_key, None))
+
+        # a cancelled caller must not cancel the computation of the others
+        return await asyncio.shield(task)
+
+    async def _call_async(self, func, args, kwargs, cache_key):
+        loop = asyncio.get_running_loop()
+        executor = self.get_executor()
+
+        if self.shared_cache is not None:
+            # SQLite may wait for the lock of the file
+            ret = await loop.run_in_executor(executor, self._fetch_shared, func, cache_key)
+            if ret is not _MISSING:
+                if self.track_hits:
+                    self._track_hits([cache_key], flush=False)
+                return ret
+
+        cached_obj = await loop.run_in_executor(executor, self.fetch_document, func, cache_key, args, kwargs)
+        if cached_obj is not None:
+            if self.is_stale(cached_obj):
+                self._schedule_refresh_async(func, args, kwargs, cache_key)
+            if 'spill' not in cached_obj and self.shared_cache is None:
+                ret = self._decode(func, cache_key, cached_obj)
+            else:
+                ret = await loop.run_in_executor(executor, self._decode, func, cache_key, cached_obj)
+            if ret is not _MISSING:
+                return ret
+
+        if not self.single_flight or self.lease_timeout is None:
+            return await self._compute_async(func, args, kwargs, cache_key)
+
+        lease = Lease(self.get_lease_collection(func), cache_key, self.lease_timeout)
+        deadline = time.monotonic() + self.lease_wait
+        delay = _LEASE_POLL_MIN
+        while not await loop.run_in_executor(executor, lease.acquire):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return await self._compute_async(func, args, kwargs, cache_key)
+            await asyncio.sleep(min(delay, remaining))
+            delay = min(delay * 2, _LEASE_POLL_MAX)
+            ret = await loop.run_in_executor(executor, self._load, func, cache_key)
+            if ret is not _MISSING:
+                return ret
+
+        try:
+            ret = await loop.run_in_executor(executor, self._load, func, cache_key)
+            if ret is not _MISSING:
+                return ret
+            return await self._compute_async(func, args, kwargs, cache_key)
+        finally:
+            await loop.run_in_executor(executor, lease.release)
+
+    async def _compute_async(self, func, args, kwargs, cache_key):
+        start = time.perf_counter()
+        try:
+            ret = await func(*args, **kwargs)
+        except Exception as e:
+            await asyncio.get_running_loop().run_in_executor(
+                self.get_executor(), self._failed, func, args, kwargs, cache_key, e)
+            raise
+        if self.metrics is not None:
+            self.metrics.timing(func.__qualname__, 'compute', time.perf_counter() - start)
+
+        resultSet = self.make_document(func, args, kwargs, ret)
+        await asyncio.get_running_loop().run_in_executor(
+            self.get_executor(), self.save, func, cache_key, resultSet)
+        if self.shared_cache is None:
+            self._cache_locally(cache_key, ret, resultSet)
+        else:
+            await asyncio.get_running_loop().run_in_executor(
+                self.get_executor(), self._cache_locally, cache_key, ret, resultSet)
+
+        return ret
+
+    def get_lease_collection(self, func):
+        """Return the collection holding the single-flight leases."""
+        self.initialize_col(func)
+        return self.db[lease_collection_name(self.collection_name)]
+
+    def _load(self, func, cache_key):
+        cache_col = self.initialize_col(func)
+        cached_obj = self.lookup(cache_col, cache_key)
+        if cached_obj is None or self.is_expired(cached_obj):
+            return _MISSING
+        return self._decode(func, cache_key, cached_obj)
+
+    def _decode(self, func, cache_key, cached_obj):
+        if 'error' in cached_obj:
+            # a cached exception
+            raise pickle.loads(cached_obj['error'])
+
+        subtype = None
+        if 'result' in cached_obj:
+            payload = cached_obj['result']
+        else:
+            payload, subtype = self._read_spilled(cache_key, cached_obj['spill'])
+            if payload is None:
+                # overwritten or expired meanwhile
+                return _MISSING
+
+        if self.metrics is None:
+            ret = self._deserialize(payload, subtype)
+        else:
+            start = time.perf_counter()
+            ret = self._deserialize(payload, subtype)
+            self.metrics.timing(func.__qualname__, 'deserialize', time.perf_counter() - start)
+        self._cache_locally(cache_key, ret, cached_obj, payload)
+        return ret
+
+    def _read_spilled(self, cache_key, ref):
+        # returns the payload stored in chunks and, if it is binary, its BSON
+        # binary subtype, or (None, None)
+        payload = self.get_chunk_store().get(cache_key, ref)
+        if payload is None:
+            return None, None
+        if ref.get('encoding') == 'bson':
+            return bson.decode(payload)['result'], None
+        return payload, ref.get('subtype', 0)
+
+    def _deserialize(self, payload, subtype=None):
+        # the subtype of binary payloads reassembled from chunks is given
+        # explicitly, as they are a bytearray
+        if subtype is None:
+            return self.serializer.deserialize(payload)
+        if self._subtype_aware:
+            return self.serializer.deserialize(payload, subtype=subtype)
+        # as PyMongo would have decoded it from an inline document
+        return self.serializer.deserialize(Binary(bytes(payload), subtype) if subtype else bytes(payload))
+
+    def _fetch_shared(self, func, cache_key):
+        # returns the result cached in the shared tier, or _MISSING
+        entry = self.shared_cache.get(self._shared_key(cache_key))
+        if entry is None:
+            return _MISSING
+        payload, expires = entry
+        ret = self.serializer.deserialize(payload)
+        if self.local_cache is not None:
+            self.local_cache.set(self._local_key(cache_key), ret, size=_payload_size(payload), expires=expires)
+        if self.metrics is not None:
+            self.metrics.count(func.__qualname__, 'shared_hits')
+        return ret
+
+    def _local_key(self, cache_key):
+        # a LocalCache may be given to several functions, whose keys only
+        # differ by module
+        return self, cache_key
+
+    def _shared_key(self, cache_key):
+        # the shared tier holds the keys of every collection
+        if isinstance(cache_key, str):
+            cache_key = cache_key.encode('utf-8')
+        return '{}.{}:'.format(self.db_name, self.collection_name).encode('utf-8') + bytes(cache_key)
+
+    def _schedule_refresh(self, func, args, kwargs, cache_key):
+        # recomputes a stale result in the background; refreshes beyond
+        # max_pending_refreshes are dropped, the next caller retries
+        executor = self._get_refresh_executor()
+        with self._refresh_lock:
+            if cache_key in self._refreshing or len(self._refreshing) >= self.max_pending_refreshes:
+                return
+            self._refreshing.add(cache_key)
+
+        try:
+            executor.submit(self._refresh, func, args, kwargs, cache_key)
+        except RuntimeError:
+            # the executor is shutting down
+            self._refresh_done(cache_key)
+
+    def _refresh(self, func, args, kwargs, cache_key):
+        try:
+            if self.single_flight and self.lease_timeout is not None:
+                lease = Lease(self.get_lease_collection(func), cache_key, self.lease_timeout)
+                if not lease.acquire():
+                    # another process is refreshing it
+                    return
+                try:
+                    self.compute(func, args, kwargs, cache_key)
+                finally:
+                    lease.release()
+            else:
+                self.compute(func, args, kwargs, cache_key)
+        except Exception as e:
+            if self.verbose:
+                print("Cache refresh failed: {} ___ {}: {!r}".format(args, kwargs, e))
+        finally:
+            self._refresh_done(cache_key)
+
+    def _schedule_refresh_async(self, func, args, kwargs, cache_key):
+        with self._refresh_lock:
+            if cache_key in self._refreshing or len(self._refreshing) >= self.max_pending_refreshes:
+                return
+            self._refreshing.add(cache_key)
+
+        task = asyncio.get_running_loop().create_task(self._refresh_async(func, args, kwargs, cache_key))
+        self._refresh_tasks.add(task)
+        task.add_done_callback(self._refresh_tasks.discard)
+
+    async def _refresh_async(self, func, args, kwargs, cache_key):
+        try:
+            await self._compute_async(func, args, kwargs, cache_key)
+        except Exception as e:
+            if self.verbose:
+                print("Cache refresh failed: {} ___ {}: {!r}".format(args, kwargs, e))
+        finally:
+            self._refresh_done(cache_key)
+
+    def _refresh_done(self, cache_key):
+        with self._refresh_lock:
+            self._refreshing.discard(cache_key)
+
+    def _get_refresh_executor(self):
+        pid = os.getpid()
+        if self._refresh_pid != pid:
+            with self._refresh_lock:
+                if self._refresh_pid != pid:
+                    # threads of the parent do not survive os.fork()
+                    self._refresh_executor = ThreadPoolExecutor(
+                        self.refresh_workers, thread_name_prefix='mongo_memoize_refresh')
+                    self._refreshing = set()
+                    self._refresh_pid = pid
+        return self._refresh_executor
+
+    def get_executor(self):
+        """Return the executor running MongoDB operations of coroutine
+        functions. A process-wide thread pool is used by default."""
+        if self.executor is not None:
+            return self.executor
+        return _get_default_executor()
+
+    def map(self, func, arg_list=None, kwarg_list=None, executor=None, batch_size=10000):
+        """Return the results of `func` for many calls at once.
+
+        All hits are fetched with one ``$in`` query per `batch_size` keys, only
+        the misses are computed, and their results are written back with a
+        single unordered bulk write.
+
+        :param list arg_list: The positional arguments (a tuple) of each call.
+        :param list kwarg_list: The keyword arguments (a dict) of each call.
+        :param executor: :class:`concurrent.futures.Executor` used to compute
+            the misses. When using a process pool, `func` must be picklable,
+            which is the case for the decorated module-level functions.
+        :param int batch_size: The maximum number of keys per lookup query.
+        """
+        arg_list, kwarg_list = self.normalize_args_list(arg_list, kwarg_list)
+        calls = [(tuple(args), dict(kwargs)) for args, kwargs in zip(arg_list, kwarg_list)]
+        keys = [self.make_key(func, args, kwargs) for args, kwargs in calls]
+        results = [None] * len(calls)
+
+        pending = OrderedDict()
+        local_hits = 0
+        for i, cache_key in enumerate(keys):
+            if self.local_cache is not None:
+                ret = self.local_cache.get(self._local_key(cache_key), _MISSING)
+                if ret is not _MISSING:
+                    results[i] = ret
+                    local_hits += 1
+                    continue
+            if self.shared_cache is not None and cache_key not in pending:
+                ret = self._fetch_shared(func, cache_key)
+                if ret is not _MISSING:
+                    results[i] = ret
+                    continue
+            pending.setdefault(cache_key, []).append(i)
+
+        metrics = self.metrics
+        if metrics is not None and local_hits:
+            metrics.count(func.__qualname__, 'local_hits', local_hits)
+        if not pending:
+            return results
+
+        cache_col = self.initialize_col(func)
+        pending_keys = list(pending)
+        # the keys of the spilled documents found, whose chunks are removed
+        # if they are replaced by inline ones
+        spilled = set()
+        for start in range(0, len(pending_keys), batch_size):
+            batch = pending_keys[start:start + batch_size]
+            legacy_keys = {}
+            if self.legacy_key_generator is not None:
+                for cache_key in batch:
+                    args, kwargs = calls[pending[cache_key][0]]
+                    legacy_keys[self.make_legacy_key(func, args, kwargs)] = cache_key
+
+            start = time.perf_counter()
+            cached_objs = list(cache_col.find({self.key_field: {'$in': batch + list(legacy_keys)}}, self.projection))
+            if metrics is not None:
+                metrics.timing(func.__qualname__, 'lookup', time.perf_counter() - start)
+
+            for cached_obj in cached_objs:
+                cache_key = cached_obj[self.key_field]
+                if cache_key in legacy_keys:
+                    cache_key = legacy_keys[cache_key]
+                    if cache_key not in pending:
+                        continue
+                    self.migrate_key(cache_col, cached_obj[self.key_field], cache_key, cached_obj)
+                if cache_key not in pending:
+                    continue
+                if 'spill' in cached_obj:
+                    spilled.add(cache_key)
+                if self.is_expired(cached_obj):
+                    continue
+                if self.is_stale(cached_obj):
+                    args, kwargs = calls[pending[cache_key][0]]
+                    # the decorated function would return the stale result
+                    self._schedule_refresh(getattr(func, '__wrapped__', func), args, kwargs, cache_key)
+                ret = self._decode(func, cache_key, cached_obj)
+                if ret is _MISSING:
+                    continue
+                for i in pending.pop(cache_key):
+                    results[i] = ret
+
+        self._count(func, hit=True, n=len(pending_keys) - len(pending))
+        self._count(func, hit=False, n=len(pending))
+        if self.track_hits:
+            # the local hits too
+            self._track_hits(cache_key for cache_key in keys if cache_key not in pending)
+        if self.verbose:
+            print("Cache hit: {}, miss: {}".format(len(pending_keys) - len(pending), len(pending)))
+
+        if not pending:
+            return results
+
+        missed = [calls[indices[0]] for indices in pending.values()]
+        invoke = _invoke if metrics is None else _timed_invoke
+        try:
+            if executor is None:
+                computed = [invoke(func, args, kwargs) for args, kwargs in missed]
+            else:
+                computed = list(executor.map(invoke, repeat(func), *zip(*missed)))
+        except Exception:
+            if metrics is not None:
+                metrics.count(func.__qualname__, 'errors')
+            raise
+        if metrics is not None:
+            for _, seconds in computed:
+                metrics.timing(func.__qualname__, 'compute', seconds)
+            computed = [ret for ret, _ in computed]
+
+        documents = [self.make_document(func, args, kwargs, ret) for (args, kwargs), ret in zip(missed, computed)]
+
+        start = time.perf_counter()
+        requests = []
+        unspilled = []
+        for (cache_key, indices), resultSet, ret in zip(pending.items(), documents, computed):
+            if self.spills(resultSet):
+                self._store_spilled(cache_col, cache_key, resultSet)
+            elif self.writer is not None:
+                self.writer.put(cache_col, {self.key_field: cache_key}, self.make_update(resultSet))
+                if cache_key in spilled:
+                    self.writer.delete(self.get_chunk_store().chunk_col, {'key': cache_key})
+            else:
+                requests.append(UpdateOne({self.key_field: cache_key}, self.make_update(resultSet), upsert=True))
+                if cache_key in spilled:
+                    unspilled.append(cache_key)
+            self._cache_locally(cache_key, ret, resultSet)
+            for i in indices:
+                results[i] = ret
+
+        if requests:
+            cache_col.bulk_write(requests, ordered=False)
+        if unspilled:
+            self.get_chunk_store().delete_many(unspilled)
+        if metrics is not None:
+            metrics.timing(func.__qualname__, 'write', time.perf_counter() - start)
+
+        return results
+
+    def stats(self):
+        """Return hit/miss counters of the in-process and MongoDB tiers."""
+        stats = dict(mongo=dict(hits=self.hits, misses=self.misses))
+        if self.local_cache is not None:
+            stats['local'] = self.local_cache.stats()
+        if self.shared_cache is not None:
+            stats['shared'] = self.shared_cache.stats()
+        if self.writer is not None:
+            stats['writer'] = self.writer.stats()
+        return stats
+
+    def _count(self, func, hit, n=1):
+        with self._stats_lock:
+            if hit:
+                self.hits += n
+            else:
+                self.misses += n
+        if self.metrics is not None and n:
+            self.metrics.count(func.__qualname__, 'hits' if hit else 'misses', n)
+
+    def _track_hits(self, cache_keys, flush=True):
+        with self._hits_lock:
+            for cache_key in cache_keys:
+                self._hit_counts[cache_key] += 1
+            due = time.monotonic() - self._hits_flushed_at >= _HIT_FLUSH_INTERVAL
+        if due and flush:
+            self.flush_hits()
+
+    def flush_hits(self):
+        """Add the hits counted since the last flush to the ``hits`` field of
+        the cache documents (see `track_hits`). This is done every 10 seconds
+        by the calling threads."""
+        with self._hits_lock:
+            counts, self._hit_counts = self._hit_counts, defaultdict(int)
+            self._hits_flushed_at = time.monotonic()
+        cache_col = self._cache_col
+        if not counts or cache_col is None:
+            return
+
+        now = datetime.datetime.now(datetime.timezone.utc)
+        requests = [UpdateOne({self.key_field: cache_key}, {'$inc': {'hits': n}, '$set': {'hitAt': now}})
+                    for cache_key, n in counts.items()]
+        try:
+            cache_col.bulk_write(requests, ordered=False)
+        except PyMongoError:
+            # the counts only rank the entries for prefetch; losing some is fine
+            pass
+
+    def prefetch(self, func, n=1000):
+        """Load the `n` results of `func` with the most hits (see
+        `track_hits`), or else the most recent ones, into the local and
+        shared caches. Return the number of results loaded.
+
+        Call it at worker startup, so that the first calls of the hottest
+        arguments do not go to MongoDB.
+        """
+        assert self.local_cache is not None or self.shared_cache is not None, \
+            'prefetch requires a local_cache or a shared_cache.'
+        cache_col = self.initialize_col(func)
+        query = {'qualname': str(func.__qualname__), 'error': {'$exists': False}}
+        cursor = cache_col.find(query, self.projection, sort=[('hits', -1), ('cachedAt', -1)], limit=n)
+
+        loaded = 0
+        for cached_obj in cursor:
+            if self.is_expired(cached_obj) or self.is_stale(cached_obj):
+                continue
+            subtype = None
+            if 'result' in cached_obj:
+                payload = cached_obj['result']
+            else:
+                payload, subtype = self._read_spilled(cached_obj[self.key_field], cached_obj['spill'])
+                if payload is None:
+                    continue
+            self._cache_locally(cached_obj[self.key_field], self._deserialize(payload, subtype), cached_obj,
+                                payload)
+            loaded += 1
+        return loaded
+
+    def _cache_locally(self, cache_key, ret, document, payload=None):
+        if self.local_cache is None and self.shared_cache is None:
+            return
+        # stale entries are left to MongoDB so that they get refreshed
+        expires = _timestamp(document.get('staleAt') or document.get('expiresAt'))
+        if payload is None:
+            payload = document.get('result')
+
+        if self.local_cache is not None:
+            if 'spill' in document:
+                size = document['spill']['size']
+            else:
+                size = _payload_size(payload)
+            self.local_cache.set(self._local_key(cache_key), ret, size=size, expires=expires)
+        if self.shared_cache is not None and payload is not None:
+            if isinstance(payload, bytearray):
+                # reassembled from chunks
+                payload = Binary(payload, document['spill'].get('subtype', 0))
+            self.shared_cache.set(self._shared_key(cache_key), payload, expires=expires)
+
     @staticmethod
     def normalize_args_list(arg_list, kwarg_list):
         if arg_list is None and kwarg_list is None:
-            return list()
+            return list(), list()
 
         if arg_list is None:
             arg_list = [() for _ in kwarg_list]
@@ -96,13 +1400,22 @@ class Memoizer(object):
                                  "provide it as a named argument.")
             kwarg_list = [dict() for _ in arg_list]
 
+        if len(arg_list) != len(kwarg_list):
+            raise ValueError("arg_list and kwarg_list must have the same length.")
+
         return arg_list, kwarg_list
 
 
 def memoize(
         db_name='mongo_memoize', mongo_uri=None, mongo_client_cb=None, collection_name="cache",
         prefix='memoize', capped=False, capped_size=100000000, capped_max=None, max_age=None,
-        connection_options={}, key_generator=None, serializer=None, verbose=False, timeout=0
+        connection_options={}, key_generator=None, serializer=None, verbose=False, timeout=0,
+        skip_schema=False, local_cache=None, executor=None, single_flight=False, lease_timeout=None,
+        lease_wait=None, stale_ttl=None, refresh_workers=2, max_pending_refreshes=100,
+        write_behind=False, spill_threshold=SPILL_THRESHOLD, chunk_size=CHUNK_SIZE,
+        legacy_key_generator=None, key_as_id=False, lean=False, debug_max_length=None, metrics=None,
+        cache_exceptions=(), exception_ttl=60, negative_ttl=None, is_negative=None, queryable_args=False,
+        tags=None, version=None, track_hits=False, shared_cache=None
 ):
     """A decorator that caches results of the function in MongoDB.
 
@@ -117,11 +1430,15 @@ def memoize(
     :param str db_name: MongoDB database name.
     :param func mongo_client_cb: A function which returns MongoDB database connection as PyMongo Client    
     :param str mongo_uri: Mongodb Connection URI
-    :param str collection_name: MongoDB collection name. If not specified, the
-        collection name is generated automatically using the prefix, the module
-        name, and the function name.
+    :param str collection_name: MongoDB collection name. The ``cache``
+        collection is shared by every function by default. If None, the
+        function gets its own collection, named after the prefix, the module
+        name, and the function name (see :func:`function_collection_name
+        <mongo_memoize.decorator.function_collection_name>`), so that it has its
+        own indexes, capped size and TTL, and :func:`reset_cache
+        <mongo_memoize.reset_cache>` can simply drop it.
     :param str prefix: Prefix of the MongoDB collection name. This argument is
-        only valid when the collection_name argument is not specified.
+        only valid when the collection_name argument is None.
     :param bool capped: Whether to use the capped collection.
     :param int capped_size: The maximum size of the capped collection in bytes.
     :param int capped_max: The maximum number of items in the capped collection.
@@ -132,54 +1449,145 @@ def memoize(
         :class:`PickleMD5KeyGenerator <mongo_memoize.PickleMD5KeyGenerator>` is used by default.
     :param serializer: Serializer instance.
         :class:`PickleSerializer <mongo_memoize.PickleSerializer>` is used by default.
+    :param bool skip_schema: Never create the collection or its indexes. Useful
+        for read-only workers when the schema is bootstrapped at deploy time
+        with :meth:`Memoizer.ensure_schema`.
+    :param local_cache: :class:`LocalCache <mongo_memoize.LocalCache>` instance
+        used as an in-process tier in front of MongoDB. Hits and misses of
+        both tiers are reported by ``func.memoizer.stats()``. It can be
+        shared by several functions.
+    :param shared_cache: :class:`SharedCache <mongo_memoize.SharedCache>`
+        instance used as a tier shared by the processes of the host, between
+        `local_cache` and MongoDB. Its entries are not removed by
+        :func:`reset_cache <mongo_memoize.reset_cache>`: give it a `ttl`
+        when results may be reset.
+    :param executor: :class:`concurrent.futures.Executor` running the MongoDB
+        operations of ``async def`` functions. A process-wide thread pool is
+        used by default.
+    :param bool single_flight: Compute a missing result once when it is
+        requested concurrently: the other callers of this process wait for
+        it instead of calling the function too.
+    :param float lease_timeout: With `single_flight`, also coordinate the
+        processes sharing the cache: the process holding a lease on the key
+        (stored in the ``<collection_name>.leases`` collection) computes the
+        result while the others poll for it. The lease can be taken over
+        after `lease_timeout` seconds if its holder died.
+    :param float lease_wait: The maximum number of seconds to wait for the
+        holder of the lease before computing the result locally. Defaults to
+        `lease_timeout`.
+    :param stale_ttl: The age in seconds after which a cached item is stale.
+        Stale items are still returned, and recomputed in the background so
+        that only callers past `max_age` wait for the function.
+    :param int refresh_workers: The number of threads recomputing stale items.
+    :param int max_pending_refreshes: The maximum number of stale items being
+        recomputed at once. Further refreshes are skipped.
+    :param write_behind: Return results without waiting for their upsert,
+        which is queued to a :class:`BackgroundWriter <mongo_memoize.BackgroundWriter>`
+        and sent with other writes in bulk. Pass True to use the process-wide
+        writer, or a writer instance. Writer counters are reported by
+        ``func.memoizer.stats()``.
+    :param int spill_threshold: Serialized results larger than this many bytes
+        do not fit in a document and are stored in chunks in the
+        ``<collection_name>.chunks`` collection instead. None disables it.
+    :param int chunk_size: The size of the chunks in bytes.
+    :param legacy_key_generator: The key generator previously used for this
+        cache, when switching `key_generator` (e.g. to
+        :class:`PickleDigestKeyGenerator <mongo_memoize.PickleDigestKeyGenerator>`).
+        Results cached under the old keys are still found, and moved to the
+        new keys when read.
+    :param bool key_as_id: Store the cache key as the ``_id`` of the cache
+        documents instead of in an indexed ``key`` field, which saves an
+        index and makes lookups primary key lookups. Existing collections
+        can be converted with :func:`migrate_to_key_as_id
+        <mongo_memoize.migration.migrate_to_key_as_id>`.
+    :param bool lean: Do not store the ``args`` and ``kwargs`` fields, the
+        string forms of the arguments kept for debugging.
+    :param int debug_max_length: Truncate the ``args`` and ``kwargs`` fields
+        to this many characters.
+    :param metrics: :class:`MetricsCollector <mongo_memoize.metrics.MetricsCollector>`
+        receiving the hit, miss and error counts of the function, the latency
+        of each phase of its calls and the size of its serialized results,
+        e.g. an :class:`InMemoryCollector <mongo_memoize.InMemoryCollector>`.
+    :param tuple cache_exceptions: The exception types to cache. When the
+        function raises one of them, the exception is stored and raised again
+        to the callers with the same arguments for `exception_ttl` seconds,
+        instead of calling the function again. The cache keys of the function
+        then include its qualified name.
+    :param exception_ttl: The number of seconds an exception is cached.
+    :param negative_ttl: Cache negative results for this many seconds only
+        (and at most `max_age`). They are never stale.
+    :param is_negative: A function telling whether a result is negative. By
+        default, None and empty containers are.
+    :param bool queryable_args: Also store the arguments whose value is a
+        string, a number, a boolean, None, a datetime or an ObjectId in a
+        ``params`` field, by parameter name, so that :func:`reset_cache
+        <mongo_memoize.reset_cache>` can select entries by argument.
+    :param tags: The tags of the cached results, e.g. the entities they
+        depend on, removed together with :func:`invalidate_tags
+        <mongo_memoize.invalidate_tags>`: a list of strings, or a function
+        called as ``tags(result, *args, **kwargs)`` returning one. For cached
+        exceptions, `result` is the exception.
+    :param version: The version of the function, part of its cache keys, so
+        that the results of the previous versions are not read anymore once
+        it is bumped. With ``'auto'``, a digest of the bytecode of the
+        function is used (see :func:`code_version
+        <mongo_memoize.decorator.code_version>`). The results of the other
+        versions are removed by :func:`collect_old_versions
+        <mongo_memoize.collect_old_versions>`, or with ``python -m
+        mongo_memoize gc``.
+    :param bool track_hits: Count the hits of each cached result in a
+        ``hits`` field, written every 10 seconds, so that the decorated
+        function's ``prefetch(n)`` method loads the most used results into
+        the local cache (see :meth:`Memoizer.prefetch`). The counts are
+        approximate.
+
+    Coroutine functions are supported: the event loop never blocks on
+    MongoDB and concurrent awaits of the same key share one computation.
+
+    A decorated regular function has a ``map(arg_list, kwarg_list, executor=None)``
+    method computing many calls at once with batched lookups and writes (see
+    :meth:`Memoizer.map`).
+    Decorated functions also have a ``prefetch(n=1000)`` method (see
+    :meth:`Memoizer.prefetch`).
     """
 
     def decorator(func):
 
-        memoizer = Memoizer(db_name, mongo_client_cb=mongo_client_cb, mongo_uri=mongo_uri, collection_name=collection_name,
+        if collection_name is None:
+            col_name = function_collection_name(prefix, func)
+        else:
+            col_name = collection_name
+        memoizer = Memoizer(db_name, mongo_client_cb=mongo_client_cb, mongo_uri=mongo_uri, collection_name=col_name,
                             prefix=prefix, capped=capped, capped_size=capped_size, capped_max=capped_max, max_age=max_age,
                             connection_options=connection_options, key_generator=key_generator,
-                            serializer=serializer, verbose=verbose, timeout=timeout)
-        
+                            serializer=serializer, verbose=verbose, timeout=timeout,
+                            skip_schema=skip_schema, local_cache=local_cache, executor=executor,
+                            single_flight=single_flight, lease_timeout=lease_timeout, lease_wait=lease_wait,
+                            stale_ttl=stale_ttl, refresh_workers=refresh_workers,
+                            max_pending_refreshes=max_pending_refreshes, write_behind=write_behind,
+                            spill_threshold=spill_threshold, chunk_size=chunk_size,
+                            legacy_key_generator=legacy_key_generator, key_as_id=key_as_id, lean=lean,
+                            debug_max_length=debug_max_length, metrics=metrics,
+                            cache_exceptions=cache_exceptions, exception_ttl=exception_ttl,
+                            negative_ttl=negative_ttl, is_negative=is_negative, queryable_args=queryable_args,
+                            tags=tags, version=version, track_hits=track_hits, shared_cache=shared_cache)
 
-        @wraps(func)
-        def wrapped_func(*args, **kwargs):
-            memoizer.connect()
-            cache_col = memoizer.initialize_col(func)
-            cache_key = memoizer.key_generator(
-                func.__module__.encode('utf-8'), args, kwargs)
-            cached_obj = cache_col.find_one(dict(key=cache_key))
-            if cached_obj:
-                if verbose:
-                    print("Cache hit: {} ___ {}".format(args, kwargs))
-                return memoizer.serializer.deserialize(cached_obj['result'])
-
-            if verbose:
-                print("Cache miss: {} ___ {}".format(args, kwargs))
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def wrapped_func(*args, **kwargs):
+                return await memoizer.call_async(func, args, kwargs)
 
-            ret = func(*args, **kwargs)
+            wrapped_func.memoizer = memoizer
+            wrapped_func.prefetch = partial(memoizer.prefetch, func)
+            return wrapped_func
 
-            resultSet = {
-                'result': memoizer.serializer.serialize(ret),
-                'qualname': str(func.__qualname__),
-                'args': str(args),
-                'kwargs': str(kwargs),
-            }
-
-            if max_age is not None:
-                resultSet['expiresAt'] = datetime.datetime.now(datetime.timezone.utc)+datetime.timedelta(seconds=max_age)
-
-            cache_col.update_one(
-                    {'key': cache_key},
-                    {
-                        '$set': resultSet
-                    },
-                    upsert=True
-                )
-
-            memoizer.disconnect()
+        @wraps(func)
+        def wrapped_func(*args, **kwargs):
+            return memoizer.call(func, args, kwargs)
 
-            return ret
+        wrapped_func.memoizer = memoizer
+        wrapped_func.map = partial(memoizer.map, wrapped_func)
+        wrapped_func.prefetch = partial(memoizer.prefetch, wrapped_func)
 
         return wrapped_func
 
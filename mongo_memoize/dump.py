@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import datetime
+import gzip
+
+import bson
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+from pymongo import ReplaceOne
+
+from mongo_memoize.chunks import chunk_collection_name, ensure_chunk_indexes
+from mongo_memoize.connection import get_client
+from mongo_memoize.migration import _key_as_id
+
+#: The version of the file format written by :func:`export_cache`.
+FORMAT_VERSION = 1
+
+_RAW = CodecOptions(document_class=RawBSONDocument)
+
+# chunks are up to 4 MB each, so they are written by size rather than count
+_MAX_CHUNK_BYTES = 16 * 1024 * 1024
+
+
+def _open(path, mode):
+    # gzip-compressed when the file name says so
+    if path.endswith('.gz'):
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+
+def _connect(memoizer, db_name, mongo_uri, mongo_client_cb, connection_options):
+    if mongo_client_cb:
+        db_conn = mongo_client_cb()
+    elif mongo_uri is None and memoizer is not None:
+        memoizer.connect()
+        db_conn = memoizer.db_conn
+    else:
+        db_conn = get_client(mongo_uri, connection_options)
+    if db_name is None:
+        db_name = memoizer.db_name if memoizer is not None else 'mongo_memoize'
+    return db_conn[db_name]
+
+
+def export_cache(
+    method, path, db_name=None, mongo_uri=None, mongo_client_cb=None, collection_name=None,
+    connection_options={}, batch_size=1000, verbose=False
+):
+    """Write the unexpired cached results of a memoized function to a file.
+
+    The file is a stream of BSON documents, gzip-compressed if `path` ends
+    with ``.gz``: a header, then each cache document, preceded by its chunks
+    if it is spilled (see `spill_threshold`). Documents are streamed from the
+    server without being decoded, so memory use does not depend on the size
+    of the cache.
+
+    Usage:
+
+    >>> from mongo_memoize.dump import export_cache
+    >>> export_cache(monthly_totals, 'monthly_totals.bson.gz')
+
+    or from a shell::
+
+        python -m mongo_memoize export myapp.reports:monthly_totals monthly_totals.bson.gz
+
+    :param method: A memoized function.
+    :param str path: The file to write.
+    :param str db_name: MongoDB database name. Defaults to the database of
+        the decorated function.
+    :param str mongo_uri: Mongodb Connection URI. Defaults to the connection
+        of the decorated function.
+    :param func mongo_client_cb: A function which returns MongoDB database connection as PyMongo Client
+    :param str collection_name: MongoDB collection name. Defaults to the
+        collection of the decorated function.
+    :param dict connection_options: Additional parameters for establishing
+        MongoDB connection.
+    :param int batch_size: The number of documents per server round trip.
+    :param bool verbose: Print the progress.
+    :return: The number of cache documents written.
+    """
+    memoizer = method.memoizer
+    db = _connect(memoizer, db_name, mongo_uri, mongo_client_cb, connection_options)
+    if collection_name is None:
+        collection_name = memoizer.collection_name
+    cache_col = db.get_collection(collection_name, codec_options=_RAW)
+    chunk_col = db.get_collection(chunk_collection_name(collection_name), codec_options=_RAW)
+    qualname = str(method.__qualname__)
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    query = {
+        'qualname': qualname,
+        '$or': [{'expiresAt': {'$exists': False}}, {'expiresAt': {'$gt': now}}],
+    }
+
+    exported = 0
+    with _open(path, 'wb') as f:
+        f.write(bson.encode({'format': 'mongo_memoize', 'version': FORMAT_VERSION, 'qualname': qualname}))
+        for document in cache_col.find(query, batch_size=batch_size):
+            if 'spill' in document:
+                # the chunks come first, so that an imported document is
+                # never read without them
+                key = document.get('key', document['_id'])
+                for chunk in chunk_col.find({'key': key, 'gen': document['spill']['gen']}, sort=[('n', 1)]):
+                    f.write(bson.encode({'chunk': chunk}))
+            f.write(bson.encode({'cache': document}))
+            exported += 1
+            if verbose and exported % batch_size == 0:
+                print('{}: {} documents exported'.format(qualname, exported))
+    if verbose:
+        print('{}: {} documents exported'.format(qualname, exported))
+    return exported
+
+
+def import_cache(
+    path, method=None, db_name=None, mongo_uri=None, mongo_client_cb=None, collection_name=None,
+    connection_options={}, batch_size=1000, verbose=False
+):
+    """Load the cached results written by :func:`export_cache` into a cache
+    collection, e.g. of another cluster.
+
+    Documents are read one by one and written with unordered bulk upserts of
+    `batch_size` documents, and the chunks of spilled results by 16 MB, so
+    memory use does not depend on the size of the file, and an interrupted
+    import can be run again.
+
+    Usage:
+
+    >>> from mongo_memoize.dump import import_cache
+    >>> import_cache('monthly_totals.bson.gz', monthly_totals)
+
+    or from a shell::
+
+        python -m mongo_memoize import monthly_totals.bson.gz --function myapp.reports:monthly_totals
+
+    :param str path: The file to read.
+    :param method: The memoized function whose collection, database and
+        connection receive the results. Its schema is bootstrapped first, and
+        the documents are converted to its `key_as_id` layout.
+    :param str db_name: MongoDB database name. Defaults to the database of
+        `method`, or ``mongo_memoize``.
+    :param str mongo_uri: Mongodb Connection URI. Defaults to the connection
+        of `method`.
+    :param func mongo_client_cb: A function which returns MongoDB database connection as PyMongo Client
+    :param str collection_name: MongoDB collection name. Defaults to the
+        collection of `method`, or ``cache``.
+    :param dict connection_options: Additional parameters for establishing
+        MongoDB connection.
+    :param int batch_size: The number of cache documents written per bulk
+        write.
+    :param bool verbose: Print the progress.
+    :return: The number of cache documents imported.
+    """
+    memoizer = getattr(method, 'memoizer', None)
+    if memoizer is not None and not memoizer.skip_schema and mongo_uri is None and mongo_client_cb is None \
+            and db_name in (None, memoizer.db_name) and collection_name in (None, memoizer.collection_name):
+        # the indexes of the target collection are built before the import
+        memoizer.ensure_schema()
+    db = _connect(memoizer, db_name, mongo_uri, mongo_client_cb, connection_options)
+    if collection_name is None:
+        collection_name = memoizer.collection_name if memoizer is not None else 'cache'
+    cache_col = db[collection_name]
+    chunk_col = db[chunk_collection_name(collection_name)]
+    key_as_id = memoizer.key_as_id if memoizer is not None else None
+
+    imported = 0
+    documents = []
+    chunks = []
+    chunk_bytes = 0
+    chunk_indexes = False
+    with _open(path, 'rb') as f:
+        records = bson.decode_file_iter(f)
+        header = next(records, None)
+        assert header is not None and header.get('format') == 'mongo_memoize', \
+            '{} is not a mongo_memoize export.'.format(path)
+        assert header['version'] <= FORMAT_VERSION, 'Unsupported export version {}.'.format(header['version'])
+
+        for record in records:
+            if 'chunk' in record:
+                chunk = record['chunk']
+                chunk.pop('_id', None)
+                chunks.append(ReplaceOne({'key': chunk['key'], 'gen': chunk['gen'], 'n': chunk['n']}, chunk,
+                                         upsert=True))
+                if not chunk_indexes:
+                    ensure_chunk_indexes(chunk_col)
+                    chunk_indexes = True
+                chunk_bytes += len(chunk['data'])
+                if chunk_bytes >= _MAX_CHUNK_BYTES:
+                    # the chunks precede their document, which is written later
+                    _write(cache_col, [], chunk_col, chunks)
+                    chunks = []
+                    chunk_bytes = 0
+                continue
+
+            documents.append(_replacement(record['cache'], key_as_id))
+            if len(documents) >= batch_size:
+                imported += _write(cache_col, documents, chunk_col, chunks)
+                documents = []
+                chunks = []
+                chunk_bytes = 0
+                if verbose:
+                    print('{}: {} documents imported'.format(header['qualname'], imported))
+
+    imported += _write(cache_col, documents, chunk_col, chunks)
+    if verbose:
+        print('{}: {} documents imported'.format(header['qualname'], imported))
+    return imported
+
+
+def _replacement(document, key_as_id):
+    # matches an existing document by key, whatever its _id
+    if key_as_id is None:
+        key_as_id = 'key' not in document
+    if key_as_id:
+        if 'key' in document:
+            document = _key_as_id(document)
+        return ReplaceOne({'_id': document['_id']}, document, upsert=True)
+
+    if 'key' not in document:
+        document['key'] = document['_id']
+    document.pop('_id')
+    return ReplaceOne({'key': document['key']}, document, upsert=True)
+
+
+def _write(cache_col, documents, chunk_col, chunks):
+    if chunks:
+        chunk_col.bulk_write(chunks, ordered=False)
+    if documents:
+        cache_col.bulk_write(documents, ordered=False)
+    return len(documents)
@@ -2,6 +2,7 @@
 
 import sys
 import hashlib
+from functools import partial
 
 if sys.version_info[0] == 2:
     import cPickle as pickle
@@ -22,3 +23,45 @@ class PickleMD5KeyGenerator(object):
         pickled_args = pickle.dumps((function_name, args, sorted(kwargs.items())),
                                protocol=self._protocol)
         return hashlib.md5(pickled_args).hexdigest()
+
+
+class PickleDigestKeyGenerator(object):
+    """Cache key generator using Pickle and a binary digest.
+
+    Keys are raw digests, stored as BSON binary values, so the ``key`` index
+    is about half the size of the one built from hexadecimal MD5 keys. Use
+    ``legacy_key_generator=PickleMD5KeyGenerator()`` to keep reading the
+    results cached with hexadecimal keys (see :func:`memoize
+    <mongo_memoize.memoize>`).
+
+    :param int protocol: Pickle protocol version.
+    :param algorithm: The name of a :mod:`hashlib` algorithm, or a function
+        returning the digest of bytes.
+    :param int digest_size: The size of the keys in bytes. BLAKE2 digests are
+        computed with this size, other digests are truncated to it.
+    """
+
+    def __init__(self, protocol=-1, algorithm='blake2b', digest_size=16):
+        self._protocol = protocol
+        self._digest_size = digest_size
+
+        if callable(algorithm):
+            self._digest = algorithm
+        elif algorithm in ('blake2b', 'blake2s'):
+            self._digest = partial(_blake2, getattr(hashlib, algorithm), digest_size)
+        else:
+            hashlib.new(algorithm)
+            self._digest = partial(_truncated, algorithm, digest_size)
+
+    def __call__(self, function_name, args, kwargs):
+        pickled_args = pickle.dumps((function_name, args, sorted(kwargs.items())),
+                                    protocol=self._protocol)
+        return self._digest(pickled_args)
+
+
+def _blake2(hash_cls, digest_size, data):
+    return hash_cls(data, digest_size=digest_size).digest()
+
+
+def _truncated(algorithm, digest_size, data):
+    return hashlib.new(algorithm, data).digest()[:digest_size]
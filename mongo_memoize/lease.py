@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import datetime
+import os
+import socket
+import uuid
+
+from pymongo.errors import DuplicateKeyError
+
+
+def lease_collection_name(collection_name):
+    """Return the name of the collection holding the leases of a cache
+    collection."""
+    return collection_name + '.leases'
+
+
+def ensure_lease_indexes(lease_col):
+    """Let MongoDB remove the leases left behind by dead processes."""
+    lease_col.create_index('expiresAt', expireAfterSeconds=0)
+
+
+class Lease(object):
+    """A lease on one cache key, stored in MongoDB.
+
+    The process holding the lease computes the missing result while the
+    others wait for it. A lease that is not released (e.g. because its owner
+    died) can be taken over once it has expired, so the clocks of the hosts
+    should be synchronized well within `timeout`.
+
+    :param lease_col: The collection holding the leases.
+    :param key: The cache key.
+    :param float timeout: The number of seconds the lease is valid for.
+    """
+
+    def __init__(self, lease_col, key, timeout):
+        self.lease_col = lease_col
+        self.key = key
+        self.timeout = timeout
+        self.owner = '{}:{}:{}'.format(socket.gethostname(), os.getpid(), uuid.uuid4().hex)
+
+    def acquire(self):
+        """Try to acquire the lease. Return whether it is now held."""
+        now = datetime.datetime.now(datetime.timezone.utc)
+        try:
+            # inserts a new lease or takes over an expired one; raises if a
+            # live lease exists since the upsert then collides on _id
+            self.lease_col.update_one(
+                {'_id': self.key, 'expiresAt': {'$lte': now}},
+                {'$set': {
+                    'owner': self.owner,
+                    'expiresAt': now + datetime.timedelta(seconds=self.timeout),
+                }},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            return False
+        return True
+
+    def release(self):
+        """Release the lease if it is still held by this owner."""
+        self.lease_col.delete_one({'_id': self.key, 'owner': self.owner})
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+
+class LocalCache(object):
+    """Thread-safe, bounded in-process LRU cache with per-entry expiry.
+
+    It is used as the first tier in front of MongoDB and holds deserialized
+    results, so cached objects are shared between callers and must not be
+    mutated.
+
+    :param int max_entries: The maximum number of entries.
+    :param int max_bytes: The approximate maximum size of the cached entries
+        in bytes. The memoizer sizes an entry by its serialized form; entries
+        set without a size count ``sys.getsizeof`` of the value.
+    :param ttl: The maximum time in seconds an entry is kept. Entries never
+        outlive the ``expiresAt`` of their MongoDB document (see ``max_age``).
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=None, ttl=None):
+        assert max_entries > 0, 'max_entries must be positive.'
+
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def size(self):
+        """Approximate size of the cached entries in bytes."""
+        return self._bytes
+
+    def get(self, key, default=None):
+        """Return the value cached for `key`, or `default`."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+
+            value, size, expires = entry
+            if expires is not None and expires <= time.time():
+                self._remove(key)
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, size=None, expires=None):
+        """Cache `value` under `key`.
+
+        :param int size: The size of the entry in bytes.
+        :param float expires: The UNIX time at which the entry expires.
+        """
+        if size is None:
+            size = sys.getsizeof(value)
+        if self.ttl is not None:
+            ttl_expires = time.time() + self.ttl
+            if expires is None or ttl_expires < expires:
+                expires = ttl_expires
+
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+
+            self._data[key] = (value, size, expires)
+            self._bytes += size
+
+            while len(self._data) > self.max_entries or \
+                    (self.max_bytes is not None and self._bytes > self.max_bytes):
+                self._remove(next(iter(self._data)))
+                self.evictions += 1
+
+    def delete(self, key):
+        """Remove `key` from the cache."""
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+
+    def clear(self):
+        """Remove every entry."""
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Return the hit/miss counters and the current size."""
+        return dict(hits=self.hits, misses=self.misses, evictions=self.evictions,
+                    entries=len(self._data), bytes=self._bytes)
+
+    def _remove(self, key):
+        _, size, _ = self._data.pop(key)
+        self._bytes -= size
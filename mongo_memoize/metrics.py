@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import math
+import threading
+from collections import defaultdict
+
+#: The phases of a memoized call whose latency is measured.
+PHASES = ('key', 'lookup', 'deserialize', 'compute', 'serialize', 'write')
+
+#: The events counted per function.
+EVENTS = ('hits', 'misses', 'local_hits', 'shared_hits', 'errors')
+
+
+class MetricsCollector(object):
+    """Receives the measurements of memoized functions (see the ``metrics``
+    argument of :func:`memoize <mongo_memoize.memoize>`).
+
+    Every method does nothing by default; subclasses override the ones they
+    need. They are called from the calling threads, and must be fast and
+    thread-safe.
+    """
+
+    def count(self, name, event, n=1):
+        """Count `n` occurrences of `event` (one of :data:`EVENTS`) for the
+        function `name`."""
+
+    def timing(self, name, phase, seconds):
+        """Record the duration of a `phase` (one of :data:`PHASES`) of a
+        call of the function `name`."""
+
+    def payload_size(self, name, size):
+        """Record the size in bytes of a serialized result of the function
+        `name`."""
+
+
+class CallbackCollector(MetricsCollector):
+    """Forwards the measurements to callbacks, e.g. to a StatsD or
+    Prometheus client.
+
+    :param on_count: Called with ``(name, event, n)``.
+    :param on_timing: Called with ``(name, phase, seconds)``.
+    :param on_payload_size: Called with ``(name, size)``.
+    """
+
+    def __init__(self, on_count=None, on_timing=None, on_payload_size=None):
+        if on_count is not None:
+            self.count = on_count
+        if on_timing is not None:
+            self.timing = on_timing
+        if on_payload_size is not None:
+            self.payload_size = on_payload_size
+
+
+class Histogram(object):
+    """Histogram with logarithmic buckets, four per power of two, so that
+    percentiles are known within 19%."""
+
+    _BUCKETS_PER_OCTAVE = 4
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+        self.buckets = defaultdict(int)
+
+    def add(self, value):
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        bucket = int(math.floor(math.log2(value) * self._BUCKETS_PER_OCTAVE)) if value > 0 else None
+        self.buckets[bucket] += 1
+
+    def percentile(self, q):
+        """Return the upper bound of the bucket holding the `q` quantile."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bucket in sorted(self.buckets, key=lambda b: float('-inf') if b is None else b):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                if bucket is None:
+                    return 0
+                return min(2 ** ((bucket + 1) / float(self._BUCKETS_PER_OCTAVE)), self.max)
+        return self.max
+
+    def snapshot(self):
+        return dict(
+            count=self.count,
+            sum=self.sum,
+            min=self.min,
+            max=self.max,
+            mean=self.sum / self.count if self.count else None,
+            p50=self.percentile(0.5),
+            p90=self.percentile(0.9),
+            p99=self.percentile(0.99),
+        )
+
+
+class InMemoryCollector(MetricsCollector):
+    """Keeps counters and latency and payload size histograms per function
+    in memory.
+
+    Usage:
+
+        >>> from mongo_memoize import memoize, InMemoryCollector
+        >>> metrics = InMemoryCollector()
+        >>> @memoize(metrics=metrics)
+        ... def some_function():
+        ...     pass
+        ...
+        >>> metrics.snapshot()['some_function']['phases']['lookup']['p99']
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(int)
+        self._timings = defaultdict(Histogram)
+        self._sizes = defaultdict(Histogram)
+
+    def count(self, name, event, n=1):
+        with self._lock:
+            self._counters[name, event] += n
+
+    def timing(self, name, phase, seconds):
+        with self._lock:
+            self._timings[name, phase].add(seconds)
+
+    def payload_size(self, name, size):
+        with self._lock:
+            self._sizes[name].add(size)
+
+    def snapshot(self):
+        """Return the measurements by function name: the counters of each
+        event, the latency histogram of each phase in seconds and the
+        payload size histogram in bytes."""
+        with self._lock:
+            names = set(name for name, _ in self._counters) | set(name for name, _ in self._timings) | \
+                set(self._sizes)
+            snapshot = {}
+            for name in names:
+                snapshot[name] = dict(
+                    (event, self._counters.get((name, event), 0)) for event in EVENTS)
+                snapshot[name]['phases'] = dict(
+                    (phase, self._timings[name, phase].snapshot())
+                    for phase in PHASES if (name, phase) in self._timings)
+                snapshot[name]['payload_size'] = self._sizes[name].snapshot() if name in self._sizes else None
+            return snapshot
+
+    def reset(self):
+        """Forget every measurement."""
+        with self._lock:
+            self._counters.clear()
+            self._timings.clear()
+            self._sizes.clear()
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+from pymongo import ReplaceOne
+
+from mongo_memoize.chunks import chunk_collection_name, ensure_chunk_indexes
+
+
+def migrate_to_key_as_id(db, source_name, target_name, batch_size=1000, verbose=False):
+    """Copy a cache collection into a new collection using the ``key_as_id``
+    layout, where the cache key is the ``_id`` of each document.
+
+    Documents are copied in batches of unordered upserts, and the chunks of
+    spilled results are copied along, so the migration can be interrupted
+    and run again. Documents written to `source_name` after it started are
+    not copied; they are recomputed on the next miss. Once it is done, point
+    ``collection_name`` to `target_name` with ``key_as_id=True``, and drop
+    `source_name` when no process uses it anymore.
+
+    :param db: The :class:`pymongo.database.Database` holding the cache.
+    :param str source_name: The name of the cache collection to copy.
+    :param str target_name: The name of the new cache collection.
+    :param int batch_size: The number of documents written per bulk write.
+    :param bool verbose: Print the progress.
+    :return: The number of cache documents copied.
+    """
+    assert source_name != target_name, 'The target collection must differ from the source.'
+
+    copied = _copy(db[source_name], db[target_name], batch_size, verbose, _key_as_id)
+    chunks_name = chunk_collection_name(source_name)
+    if chunks_name in db.list_collection_names():
+        target_chunks = db[chunk_collection_name(target_name)]
+        ensure_chunk_indexes(target_chunks)
+        _copy(db[chunks_name], target_chunks, batch_size, verbose, dict)
+    return copied
+
+
+def _key_as_id(document):
+    document = dict(document)
+    document['_id'] = document.pop('key')
+    return document
+
+
+def _copy(source_col, target_col, batch_size, verbose, convert):
+    copied = 0
+    requests = []
+    for document in source_col.find({}, sort=[('_id', 1)], batch_size=batch_size):
+        document = convert(document)
+        requests.append(ReplaceOne({'_id': document['_id']}, document, upsert=True))
+        if len(requests) == batch_size:
+            target_col.bulk_write(requests, ordered=False)
+            copied += len(requests)
+            requests = []
+            if verbose:
+                print('{}: {} documents copied'.format(source_col.name, copied))
+    if requests:
+        target_col.bulk_write(requests, ordered=False)
+        copied += len(requests)
+    if verbose:
+        print('{}: {} documents copied'.format(source_col.name, copied))
+    return copied
@@ -1,42 +1,101 @@
 # flush_cache.py
-import pymongo
+import datetime
+import time
+from collections import OrderedDict
+
+from mongo_memoize.chunks import chunk_collection_name
+from mongo_memoize.connection import get_client
+from mongo_memoize.decorator import function_collection_name
 
 
 class Flusher(object):
-    def __init__(self, method, db_name='mongo_memoize', mongo_uri=None, mongo_client_cb=None,
-                 collection_name="cache", prefix='memoize',connection_options={}, verbose=False) -> None:
+    '''Removes the cached results of functions sharing a cache collection.
+
+    :param method: A memoized function, or a list of them.
+    :param dict where: Only remove the results of the calls with these
+        argument values (see the `queryable_args` argument of
+        :func:`memoize <mongo_memoize.memoize>`). ``ValueError`` is raised for
+        memoized functions not storing their arguments.
+    :param older_than: Only remove the results cached before this
+        ``datetime``, or more than this many seconds (or ``timedelta``) ago.
+    :param int batch_size: Remove the results by batches of this size
+        instead of with a single delete.
+    :param float pause: The number of seconds to sleep between two batches.
+    :param str keep_version: Only remove the results of the other versions
+        of the function, identified by its module and qualified name.
+    '''
+    def __init__(self, method, db_name=None, mongo_uri=None, mongo_client_cb=None,
+                 collection_name=None, prefix='memoize',connection_options={}, verbose=False,
+                 where=None, older_than=None, batch_size=None, pause=0, keep_version=None) -> None:
+        methods = list(method) if isinstance(method, (list, tuple)) else [method]
         self.mongo_uri = mongo_uri
         self.connection_options = connection_options
+
+        # the memoizer of the decorated function provides the defaults, and
+        # its connection is reused
+        memoizer = getattr(methods[0], 'memoizer', None)
+        if memoizer is not None and db_name is None:
+            db_name = memoizer.db_name
+        if db_name is None:
+            db_name = 'mongo_memoize'
         self.db_name = db_name
 
+        if collection_name is None:
+            # the collection of the decorated function, if known
+            if memoizer is not None and memoizer.collection_name is not None:
+                collection_name = memoizer.collection_name
+            else:
+                collection_name = "cache"
         self.collection_name = collection_name
         self.prefix = prefix
+        self.memoizer = memoizer
         self.verbose = verbose
 
+        self.where = where
+        self.older_than = older_than
+        self.batch_size = batch_size
+        self.pause = pause
+        self.keep_version = keep_version
+        self.selective = where is not None or older_than is not None or keep_version is not None
+
+        # a collection holding only the results of this function is dropped,
+        # then bootstrapped again by its memoizer
+        self.dedicated = len(methods) == 1 and memoizer is not None and not self.selective \
+            and collection_name == memoizer.collection_name and db_name == memoizer.db_name \
+            and collection_name == function_collection_name(memoizer.prefix, methods[0])
+
         self.mongo_client_cb = mongo_client_cb
         self.db = None
         self.is_connected = False
 
         self.external_db_conn = True if mongo_client_cb else False
 
-        self.qualname = str(method.__qualname__)
+        self.memoizers = [m.memoizer for m in methods if getattr(m, 'memoizer', None) is not None]
+        if where:
+            # their arguments are not stored, so nothing would match
+            for m in methods:
+                if getattr(m, 'memoizer', None) is not None and not m.memoizer.queryable_args:
+                    raise ValueError('where requires {} to be memoized with queryable_args=True.'.format(
+                        m.__qualname__))
+        self.qualnames = [str(m.__qualname__) for m in methods]
+        self.qualname = self.qualnames[0]
+        self.module = methods[0].__module__
 
     def connect(self):
         if self.external_db_conn:
             self.db_conn = self.mongo_client_cb()
+        elif self.mongo_uri is None and self.memoizer is not None:
+            self.memoizer.connect()
+            self.db_conn = self.memoizer.db_conn
         else:
-            self.db_conn = pymongo.MongoClient(
-                self.mongo_uri, *self.connection_options)        
+            self.db_conn = get_client(self.mongo_uri, self.connection_options)
         self.db = self.db_conn[self.db_name]
         self.is_connected = True
 
     def disconnect(self):
-        if not self.external_db_conn:
-            try:
-                self.db_conn.close()
-            except AttributeError:
-                self.db_conn = None
-            self.is_connected = False
+        self.db_conn = None
+        self.db = None
+        self.is_connected = False
 
     def get_collection(self):
         '''Get cache collection object.'''
@@ -44,43 +103,281 @@ class Flusher(object):
         cache_col = self.db[col_name]
         return cache_col
 
+    def get_query(self):
+        '''Return the query selecting the cache documents to remove.'''
+        if len(self.qualnames) == 1:
+            query = {'qualname': self.qualname}
+        else:
+            query = {'qualname': {'$in': self.qualnames}}
+
+        if self.where:
+            for name, value in self.where.items():
+                query['params.' + name] = value
+
+        if self.older_than is not None:
+            cutoff = self.older_than
+            if not isinstance(cutoff, datetime.datetime):
+                if not isinstance(cutoff, datetime.timedelta):
+                    cutoff = datetime.timedelta(seconds=cutoff)
+                cutoff = datetime.datetime.now(datetime.timezone.utc) - cutoff
+            # documents written before cachedAt was recorded are old too
+            query['$or'] = [{'cachedAt': {'$lt': cutoff}}, {'cachedAt': {'$exists': False}}]
+
+        if self.keep_version is not None:
+            # the other functions of the same name are not versions of it
+            query['module'] = self.module
+            query['version'] = {'$ne': self.keep_version}
+
+        return query
+
     def flush(self):
-        '''Flush cache.'''
-        cache_col = self.get_collection()
-        deleted_cache = cache_col.delete_many({
-            'qualname': self.qualname,
-        })
+        '''Flush cache. Return the number of removed cache entries.'''
+        self.clear_local_caches()
+        if self.dedicated:
+            return self.drop()
+
+        if self.batch_size is None and not self.selective:
+            deleted = self.delete_all()
+        else:
+            deleted = self.delete_batches()
+
         if self.verbose:
             print("flushed {} documents of {}".format(
-                    deleted_cache.deleted_count,
-                    self.qualname
+                    deleted,
+                    ', '.join(self.qualnames)
                 ))
-        
+        return deleted
+
+    def clear_local_caches(self):
+        '''Empty the in-process tier of the functions, whose entries cannot
+        be selected by query.'''
+        for memoizer in self.memoizers:
+            if memoizer.local_cache is not None:
+                memoizer.local_cache.clear()
+
+    def delete_all(self):
+        '''Remove every result of the functions with one delete.'''
+        cache_col = self.get_collection()
+        deleted_cache = cache_col.delete_many(self.get_query())
+        # chunks of the results too large for a document
+        self.db[chunk_collection_name(self.collection_name)].delete_many({
+            'qualname': self.get_query()['qualname'],
+        })
+        return deleted_cache.deleted_count
+
+    def delete_batches(self):
+        '''Remove the selected results by batches of `batch_size`.'''
+        cache_col = self.get_collection()
+        chunk_col = self.db[chunk_collection_name(self.collection_name)]
+        key_field = self.memoizer.key_field if self.memoizer is not None else 'key'
+        query = self.get_query()
+        batch_size = self.batch_size or 1000
+
+        deleted = 0
+        while True:
+            batch = list(cache_col.find(query, {key_field: 1, 'spill': 1}, limit=batch_size))
+            if not batch:
+                return deleted
+            deleted += cache_col.delete_many({'_id': {'$in': [doc['_id'] for doc in batch]}}).deleted_count
+            spilled = [doc[key_field] for doc in batch if 'spill' in doc]
+            if spilled:
+                chunk_col.delete_many({'key': {'$in': spilled}})
+            if self.verbose:
+                print("flushed {} documents of {}".format(deleted, ', '.join(self.qualnames)))
+            if len(batch) < batch_size:
+                return deleted
+            if self.pause:
+                time.sleep(self.pause)
+
+    def drop(self):
+        '''Drop the collections dedicated to the function.'''
+        deleted = self.get_collection().estimated_document_count()
+        self.memoizer.drop_collections()
+        if self.verbose:
+            print("dropped {} of {}".format(self.collection_name, self.qualname))
+        return deleted
+
+
 def reset_cache(
-    method, db_name='mongo_memoize', mongo_uri=None, mongo_client_cb=None,
-    collection_name="cache",connection_options={}, verbose=False
+    method, db_name=None, mongo_uri=None, mongo_client_cb=None,
+    collection_name=None, connection_options={}, verbose=False,
+    where=None, older_than=None, batch_size=None, pause=0
 ):
-    
+
     """ Global method to clear functional cache.
-    
+
     Usage:
 
     >>> from mongo_memoize.reset import reset_cache
     >>> reset_cache(obj.method)
     ...
+    >>> reset_cache([get_orders, get_invoices], where={'customer_id': 42})
+    ...
+    >>> reset_cache(get_report, older_than=datetime.timedelta(days=7), batch_size=1000, pause=0.1)
+    ...
 
+    :param method: A memoized function, or a list of them.
+    :param str db_name: MongoDB database name. Defaults to the database of
+        the decorated function.
+    :param func mongo_client_cb: A function which returns MongoDB database connection as PyMongo Client
+    :param str mongo_uri: Mongodb Connection URI. Defaults to the connection
+        of the decorated function.
+    :param str collection_name: MongoDB collection name. Defaults to the
+        collection of the decorated function. A collection dedicated to the
+        function (see the `collection_name` argument of :func:`memoize
+        <mongo_memoize.memoize>`) is dropped instead of being searched.
+    :param dict connection_options: Additional parameters for establishing
+        MongoDB connection.
+    :param dict where: Only remove the results of the calls with these
+        argument values. The functions must be memoized with
+        ``queryable_args=True``, or ``ValueError`` is raised.
+    :param older_than: Only remove the results cached before this
+        ``datetime``, or more than this many seconds (or ``timedelta``) ago.
+    :param int batch_size: Remove the results by batches of this size, so
+        that no single delete holds the primary for long. Selective resets
+        (`where`, `older_than`) always run by batches, of 1000 by default.
+    :param float pause: The number of seconds to sleep between two batches.
+    :return: The number of removed cache entries.
+    """
+
+    methods = list(method) if isinstance(method, (list, tuple)) else [method]
+
+    # the functions sharing a collection are reset together
+    groups = OrderedDict()
+    for m in methods:
+        memoizer = getattr(m, 'memoizer', None)
+        group = (memoizer.db_name, memoizer.collection_name) if memoizer is not None else None
+        groups.setdefault(group, []).append(m)
+
+    deleted = 0
+    for group in groups.values():
+        flusher = Flusher(group, db_name=db_name, mongo_uri=mongo_uri, mongo_client_cb=mongo_client_cb,
+                          collection_name=collection_name, connection_options=connection_options,
+                          verbose=verbose, where=where, older_than=older_than, batch_size=batch_size, pause=pause)
+        flusher.connect()
+        deleted += flusher.flush()
+        flusher.disconnect()
+    return deleted
+
+
+def invalidate_tags(
+    tags, functions=None, db_name='mongo_memoize', mongo_uri=None, mongo_client_cb=None,
+    collection_name='cache', connection_options={}, verbose=False
+):
+
+    """ Remove every cached result carrying one of `tags`, whatever the
+    function that computed it (see the `tags` argument of :func:`memoize
+    <mongo_memoize.memoize>`).
+
+    Usage:
+
+    >>> from mongo_memoize import invalidate_tags
+    >>> invalidate_tags(['customer:42'])
+    ...
+    >>> invalidate_tags(['dataset:2024-06'], functions=[monthly_totals, yearly_totals])
+    ...
+
+    The in-process caches of `functions` (see the `local_cache` argument of
+    :func:`memoize <mongo_memoize.memoize>`) are emptied in this process.
+    Results kept in the in-process cache of other processes, or of functions
+    not listed, live until they expire there.
+
+    :param list tags: The tags to invalidate.
+    :param list functions: Memoized functions whose collections, databases
+        and connections are searched, instead of `collection_name` in
+        `db_name`.
     :param str db_name: MongoDB database name.
-    :param func mongo_client_cb: A function which returns MongoDB database connection as PyMongo Client    
-    :param str mongo_uri: Mongodb Connection URI
-    :param str collection_name: MongoDB collection name. If not specified, the
-        collection name is generated automatically using the prefix, the module
-        name, and the function name.
+    :param str mongo_uri: Mongodb Connection URI.
+    :param func mongo_client_cb: A function which returns MongoDB database connection as PyMongo Client
+    :param str collection_name: MongoDB collection name.
     :param dict connection_options: Additional parameters for establishing
-        MongoDB connection."""
-    
-    flusher = Flusher(method, db_name=db_name, mongo_uri=mongo_uri, mongo_client_cb=mongo_client_cb,
-                       collection_name=collection_name, connection_options=connection_options, verbose=verbose)
-    
-    flusher.connect()
-    flusher.flush()
-    flusher.disconnect()
+        MongoDB connection.
+    :param bool verbose: Print the number of removed entries.
+    :return: The number of removed cache entries.
+    """
+
+    if isinstance(tags, str):
+        tags = [tags]
+    query = {'tags': {'$in': list(tags)}}
+
+    if functions:
+        targets = OrderedDict()
+        for function in functions:
+            memoizer = function.memoizer
+            targets.setdefault((memoizer.db_name, memoizer.collection_name), memoizer)
+            if memoizer.local_cache is not None:
+                memoizer.local_cache.clear()
+    else:
+        targets = {(db_name, collection_name): None}
+
+    deleted = 0
+    for (name, col_name), memoizer in targets.items():
+        if mongo_client_cb:
+            db_conn = mongo_client_cb()
+        elif mongo_uri is None and memoizer is not None:
+            memoizer.connect()
+            db_conn = memoizer.db_conn
+        else:
+            db_conn = get_client(mongo_uri, connection_options)
+        db = db_conn[name]
+
+        # the chunks of spilled results are only known by key
+        spilled = [doc.get('key', doc['_id'])
+                   for doc in db[col_name].find(dict(query, spill={'$exists': True}), {'key': 1})]
+        count = db[col_name].delete_many(query).deleted_count
+        if spilled:
+            db[chunk_collection_name(col_name)].delete_many({'key': {'$in': spilled}})
+        if verbose:
+            print("invalidated {} documents of {}".format(count, col_name))
+        deleted += count
+    return deleted
+
+
+def collect_old_versions(
+    method, db_name=None, mongo_uri=None, mongo_client_cb=None, collection_name=None,
+    connection_options={}, batch_size=1000, pause=0, verbose=False
+):
+
+    """ Remove the cached results of the versions of versioned functions
+    other than the current one (see the `version` argument of
+    :func:`memoize <mongo_memoize.memoize>`), by batches.
+
+    Usage:
+
+    >>> from mongo_memoize import collect_old_versions
+    >>> collect_old_versions([get_orders, get_invoices], pause=0.1)
+    ...
+
+    or from a shell, with the dotted paths of the functions::
+
+        python -m mongo_memoize gc myapp.orders:get_orders --pause 0.1
+
+    :param method: A memoized function, or a list of them.
+    :param str db_name: MongoDB database name. Defaults to the database of
+        the decorated function.
+    :param str mongo_uri: Mongodb Connection URI. Defaults to the connection
+        of the decorated function.
+    :param func mongo_client_cb: A function which returns MongoDB database connection as PyMongo Client
+    :param str collection_name: MongoDB collection name. Defaults to the
+        collection of the decorated function.
+    :param dict connection_options: Additional parameters for establishing
+        MongoDB connection.
+    :param int batch_size: The number of documents removed per delete.
+    :param float pause: The number of seconds to sleep between two batches.
+    :param bool verbose: Print the progress.
+    :return: The number of removed cache entries.
+    """
+
+    methods = list(method) if isinstance(method, (list, tuple)) else [method]
+
+    deleted = 0
+    for m in methods:
+        version = m.memoizer.get_version(getattr(m, '__wrapped__', m))
+        assert version is not None, '{} is not versioned.'.format(m.__qualname__)
+        flusher = Flusher(m, db_name=db_name, mongo_uri=mongo_uri, mongo_client_cb=mongo_client_cb,
+                          collection_name=collection_name, connection_options=connection_options,
+                          verbose=verbose, batch_size=batch_size, pause=pause, keep_version=version)
+        flusher.connect()
+        deleted += flusher.flush()
+        flusher.disconnect()
+    return deleted
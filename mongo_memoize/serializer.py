@@ -1,13 +1,81 @@
 # -*- coding: utf-8 -*-
 
 import base64
+import bz2
+import dataclasses
+import datetime
+import decimal
+import importlib
+import lzma
+import struct
 import sys
+import zlib
+
+from bson.binary import Binary
+from bson.objectid import ObjectId
 
 if sys.version_info[0] == 2:
     import cPickle as pickle
 else:
     import pickle
 
+#: BSON binary subtype of raw pickle payloads.
+PICKLE_SUBTYPE = 0x80
+
+#: BSON binary subtype of :class:`OutOfBandPickleSerializer` payloads.
+OUT_OF_BAND_SUBTYPE = 0x81
+
+_OUT_OF_BAND_MAGIC = b'MMOB'
+_OUT_OF_BAND_ALIGNMENT = 64
+
+_codecs = {}
+
+
+def register_codec(name, compress, decompress):
+    """Register a compression codec for :class:`CompressedSerializer`.
+
+    :param str name: The codec name, stored in the cache documents.
+    :param compress: A function taking the data and the compression level
+        (None for the codec default) and returning the compressed data.
+    :param decompress: A function returning the decompressed data.
+    """
+    _codecs[name] = (compress, decompress)
+
+
+def available_codecs():
+    """Return the names of the registered codecs."""
+    return sorted(_codecs)
+
+
+register_codec('zlib', lambda data, level: zlib.compress(data, -1 if level is None else level),
+               zlib.decompress)
+register_codec('bz2', lambda data, level: bz2.compress(data, 9 if level is None else level),
+               bz2.decompress)
+register_codec('lzma', lambda data, level: lzma.compress(data, preset=level), lzma.decompress)
+
+try:
+    import lz4.frame
+except ImportError:
+    pass
+else:
+    register_codec('lz4', lambda data, level: lz4.frame.compress(data, compression_level=level or 0),
+                   lz4.frame.decompress)
+
+try:
+    import zstandard
+except ImportError:
+    pass
+else:
+    register_codec('zstd', lambda data, level: zstandard.ZstdCompressor(level=3 if level is None else level).compress(data),
+                   lambda data: zstandard.ZstdDecompressor().decompress(data))
+
+try:
+    import snappy
+except ImportError:
+    pass
+else:
+    register_codec('snappy', lambda data, level: snappy.compress(data), snappy.decompress)
+
 
 class NoopSerializer(object):
     """Serializer that does nothing.
@@ -20,20 +88,294 @@ class NoopSerializer(object):
     def serialize(self, obj):
         return obj
 
-    def deserialize(self, serialized):
+    def deserialize(self, serialized, subtype=None):
+        if subtype is not None:
+            # reassembled from chunks: as read from a document
+            return Binary(serialized, subtype) if subtype else bytes(serialized)
         return serialized
 
 
 class PickleSerializer(object):
     """Serializer using Pickle.
 
+    Results are stored as base64 text by default. With `binary`, the pickle
+    is stored as BSON binary data (subtype :data:`PICKLE_SUBTYPE`), which is
+    about 25% smaller and cheaper to encode and decode. Both formats are
+    always readable, so existing caches can be switched without flushing
+    them.
+
     :param int protocol: Pickle protocol version.
+    :param bool binary: Whether to store raw binary payloads.
     """
-    def __init__(self, protocol=-1):
+    def __init__(self, protocol=-1, binary=False):
         self._protocol = protocol
+        self._binary = binary
 
     def serialize(self, obj):
-        return base64.b64encode(pickle.dumps(obj, protocol=self._protocol))
+        data = pickle.dumps(obj, protocol=self._protocol)
+        if self._binary:
+            return Binary(data, PICKLE_SUBTYPE)
+        return base64.b64encode(data)
 
-    def deserialize(self, serialized):
+    def deserialize(self, serialized, subtype=None):
+        if subtype is None:
+            subtype = getattr(serialized, 'subtype', None)
+        if subtype == PICKLE_SUBTYPE:
+            return pickle.loads(serialized)
         return pickle.loads(base64.b64decode(serialized))
+
+
+class CompressedSerializer(object):
+    """Serializer compressing the output of another serializer.
+
+    Only payloads of at least `threshold` bytes are compressed. They are
+    stored with the name of their codec, so documents written with any
+    codec, or uncompressed, can always be read back.
+
+    The stdlib codecs ``zlib``, ``bz2`` and ``lzma`` are always available;
+    ``lz4``, ``zstd`` and ``snappy`` are registered when their packages are
+    installed. Other codecs can be added with :func:`register_codec`.
+
+    :param serializer: The serializer producing the payload.
+        ``PickleSerializer(binary=True)`` is used by default.
+    :param str codec: The codec name.
+    :param int level: The compression level. The codec default is used if
+        not specified.
+    :param int threshold: The minimum payload size in bytes to compress.
+    """
+    def __init__(self, serializer=None, codec='zlib', level=None, threshold=1024):
+        if codec not in _codecs:
+            raise ValueError('Unknown codec: {}. Available codecs: {}'.format(
+                codec, ', '.join(available_codecs())))
+
+        self._serializer = serializer
+        if not self._serializer:
+            self._serializer = PickleSerializer(binary=True)
+        self._codec = codec
+        self._level = level
+        self._threshold = threshold
+
+    def serialize(self, obj):
+        data = self._serializer.serialize(obj)
+        if not isinstance(data, (bytes, bytearray)) or len(data) < self._threshold:
+            return data
+
+        compressed = _codecs[self._codec][0](data, self._level)
+        if len(compressed) >= len(data):
+            return data
+
+        serialized = {'__codec__': self._codec, 'data': Binary(compressed)}
+        if isinstance(data, Binary) and data.subtype:
+            serialized['subtype'] = data.subtype
+        return serialized
+
+    def deserialize(self, serialized, subtype=None):
+        if subtype is not None:
+            # an uncompressed payload reassembled from chunks
+            return self._serializer.deserialize(serialized, subtype=subtype)
+
+        if isinstance(serialized, dict) and '__codec__' in serialized:
+            codec = serialized['__codec__']
+            if codec not in _codecs:
+                raise ValueError('The cached item is compressed with {}, which is not available.'.format(codec))
+
+            serialized_data = _codecs[codec][1](serialized['data'])
+            if 'subtype' in serialized:
+                serialized_data = Binary(serialized_data, serialized['subtype'])
+            serialized = serialized_data
+
+        return self._serializer.deserialize(serialized)
+
+
+class OutOfBandPickleSerializer(object):
+    """Serializer using Pickle protocol 5 with out-of-band buffers.
+
+    Large buffers such as the data of NumPy arrays are not copied into the
+    pickle stream: they are laid out next to it, aligned, in a single BSON
+    binary payload (subtype :data:`OUT_OF_BAND_SUBTYPE`). On read, the arrays
+    are rebuilt directly on top of the fetched bytes, without copying them,
+    and are therefore read-only unless the result was reassembled from
+    chunks.
+
+    Objects without out-of-band support are pickled as usual, so this
+    serializer also works when NumPy is not installed.
+    """
+    def __init__(self):
+        if pickle.HIGHEST_PROTOCOL < 5:
+            raise RuntimeError('Pickle protocol 5 is not available.')
+
+    def serialize(self, obj):
+        buffers = []
+        main = pickle.dumps(obj, protocol=5, buffer_callback=buffers.append)
+        parts = [memoryview(main)] + [buf.raw() for buf in buffers]
+
+        header = _OUT_OF_BAND_MAGIC + struct.pack('<I{}Q'.format(len(parts)), len(buffers), *map(len, parts))
+        chunks = [header]
+        size = len(header)
+        for part in parts:
+            padding = _align(size) - size
+            chunks.append(b'\0' * padding)
+            chunks.append(part)
+            size += padding + len(part)
+        return Binary(b''.join(chunks), OUT_OF_BAND_SUBTYPE)
+
+    def deserialize(self, serialized, subtype=None):
+        view = memoryview(serialized)
+        if view[:4] != _OUT_OF_BAND_MAGIC:
+            raise ValueError('Not an out-of-band pickle payload.')
+
+        count, = struct.unpack_from('<I', view, 4)
+        lengths = struct.unpack_from('<{}Q'.format(count + 1), view, 8)
+        offset = 8 + 8 * (count + 1)
+        parts = []
+        for length in lengths:
+            offset = _align(offset)
+            parts.append(view[offset:offset + length])
+            offset += length
+
+        return pickle.loads(parts[0], buffers=parts[1:])
+
+
+def _align(offset):
+    return -(-offset // _OUT_OF_BAND_ALIGNMENT) * _OUT_OF_BAND_ALIGNMENT
+
+
+_NATIVE_SCALARS = (type(None), bool, float, bytes, ObjectId)
+_INT64_MIN = -2 ** 63
+_INT64_MAX = 2 ** 63 - 1
+_MAX_DEPTH = 100
+
+
+def _is_native(obj, depth=0):
+    # whether `obj` is stored as is by BSON and read back unchanged
+    cls = type(obj)
+    if cls in _NATIVE_SCALARS:
+        return True
+    if cls is int:
+        return _INT64_MIN <= obj <= _INT64_MAX
+    if cls is str:
+        return obj.isascii() or _is_utf8(obj)
+    if depth >= _MAX_DEPTH:
+        return False
+    if cls is list:
+        return all(_is_native(item, depth + 1) for item in obj)
+    if cls is dict:
+        return all(type(key) is str and key and key[0] != '$' and '.' not in key and '\0' not in key
+                   and _is_native(value, depth + 1) for key, value in obj.items())
+    return False
+
+
+def _is_utf8(string):
+    try:
+        string.encode('utf-8')
+    except UnicodeEncodeError:
+        return False
+    return True
+
+
+def _encode_dataclass(obj):
+    fields = {f.name: getattr(obj, f.name) for f in dataclasses.fields(obj)}
+    if not _is_native(fields):
+        raise TypeError
+    cls = type(obj)
+    return {'class': '{}:{}'.format(cls.__module__, cls.__qualname__), 'fields': fields}
+
+
+def _decode_dataclass(value):
+    module_name, qualname = value['class'].split(':')
+    cls = importlib.import_module(module_name)
+    for name in qualname.split('.'):
+        cls = getattr(cls, name)
+    obj = cls.__new__(cls)
+    for name, field_value in value['fields'].items():
+        # also works for frozen dataclasses
+        object.__setattr__(obj, name, field_value)
+    return obj
+
+
+def _encode_items(obj):
+    items = list(obj)
+    if not _is_native(items):
+        raise TypeError
+    return items
+
+
+class TypedSerializer(object):
+    """Serializer choosing the encoding from the type of the result.
+
+    * BSON-native results (None, bool, int64, float, str, bytes, ObjectId, and
+      lists and dicts of them) are stored as is, without any encoding.
+    * Results of a registered type are stored as ``{'__type__': tag, 'value':
+      encoded}``. ``datetime``, ``date``, ``Decimal``, ``tuple``, ``set``,
+      ``frozenset`` and dataclasses are registered by default.
+    * NumPy arrays are stored as with :class:`OutOfBandPickleSerializer`.
+    * Everything else is pickled as with ``PickleSerializer(binary=True)``.
+
+    Arrays and pickles are stored as binary values, so large ones can be
+    spilled into chunks (see ``spill_threshold``).
+
+    The stored value tells which decoder to use, so decoding never has to
+    guess.
+    """
+    def __init__(self):
+        self._encoders = {}
+        self._decoders = {}
+        self._pickle = PickleSerializer(binary=True)
+        self._out_of_band = OutOfBandPickleSerializer() if pickle.HIGHEST_PROTOCOL >= 5 else None
+
+        self.register(datetime.datetime, 'datetime', datetime.datetime.isoformat, datetime.datetime.fromisoformat)
+        self.register(datetime.date, 'date', datetime.date.isoformat, datetime.date.fromisoformat)
+        self.register(decimal.Decimal, 'decimal', str, decimal.Decimal)
+        self.register(tuple, 'tuple', _encode_items, tuple)
+        self.register(set, 'set', _encode_items, set)
+        self.register(frozenset, 'frozenset', _encode_items, frozenset)
+        self._decoders['dataclass'] = _decode_dataclass
+
+    def register(self, cls, tag, encode, decode):
+        """Register the encoding of a type.
+
+        :param type cls: The type. Subclasses are not matched.
+        :param str tag: The name of the encoding, stored with the value.
+        :param encode: A function returning a BSON-native representation of
+            an instance. It may raise :class:`TypeError` to fall back to pickle.
+        :param decode: A function rebuilding the instance from it.
+        """
+        self._encoders[cls] = (tag, encode)
+        self._decoders[tag] = decode
+
+    def serialize(self, obj):
+        cls = type(obj)
+        if _is_native(obj) and not (cls is dict and '__type__' in obj):
+            return obj
+
+        tag, encode = self._encoders.get(cls, (None, None))
+        if tag is None and dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+            tag, encode = 'dataclass', _encode_dataclass
+        if tag is not None:
+            try:
+                return {'__type__': tag, 'value': encode(obj)}
+            except TypeError:
+                pass
+        elif cls.__name__ == 'ndarray' and cls.__module__ == 'numpy' and not obj.dtype.hasobject \
+                and self._out_of_band is not None:
+            return self._out_of_band.serialize(obj)
+
+        return self._pickle.serialize(obj)
+
+    def deserialize(self, serialized, subtype=None):
+        if isinstance(serialized, dict):
+            if '__type__' in serialized:
+                return self._decoders[serialized['__type__']](serialized['value'])
+            return serialized
+
+        if subtype is None:
+            subtype = getattr(serialized, 'subtype', None)
+        if subtype == OUT_OF_BAND_SUBTYPE:
+            return self._out_of_band.deserialize(serialized)
+        if subtype == PICKLE_SUBTYPE:
+            return self._pickle.deserialize(serialized, subtype=subtype)
+        if isinstance(serialized, bytearray):
+            # native binary data reassembled from chunks
+            return Binary(serialized, subtype) if subtype else bytes(serialized)
+
+        return serialized
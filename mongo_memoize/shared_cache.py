@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import os
+import sqlite3
+import threading
+import time
+
+import bson
+
+# the last access time of an entry is updated at most this often, in seconds,
+# so that most hits are read-only
+_TOUCH_INTERVAL = 60
+
+# the share of max_bytes kept when entries are evicted
+_EVICTION_TARGET = 0.9
+
+_EVICTION_BATCH = 100
+
+
+class SharedCache(object):
+    """Bounded cache in a SQLite file, shared by the processes of a host.
+
+    It is used as a tier between the in-process cache and MongoDB (see the
+    `shared_cache` argument of :func:`memoize <mongo_memoize.memoize>`), so
+    that workers of the same host compute or fetch a result once. It holds
+    serialized results: the processes decode their own copy.
+
+    The file is opened in WAL mode, so readers never wait for writers, and
+    each thread of each process has its own connection. When the entries
+    take more than `max_bytes`, the expired ones, then the least recently
+    used ones are removed. SQLite errors, e.g. a writer waiting more than
+    `timeout` seconds for another one, are counted and treated as misses.
+
+    :param str path: The SQLite file, on a local filesystem.
+    :param int max_bytes: The approximate maximum size of the entries in
+        bytes.
+    :param int max_entry_bytes: The size in bytes above which results are not
+        stored. Defaults to a tenth of `max_bytes`.
+    :param ttl: The maximum time in seconds an entry is kept. Entries never
+        outlive the ``expiresAt`` of their MongoDB document (see ``max_age``).
+    :param float timeout: The number of seconds a write waits for the lock of
+        the file.
+    """
+
+    def __init__(self, path, max_bytes=256 * 1024 * 1024, max_entry_bytes=None, ttl=None, timeout=1.0):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes if max_entry_bytes is not None else max_bytes // 10
+        self.ttl = ttl
+        self.timeout = timeout
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.errors = 0
+
+    def _connect(self):
+        # connections do not survive os.fork(); the child opens its own
+        pid = os.getpid()
+        if getattr(self._local, 'pid', None) == pid:
+            return self._local.conn
+
+        conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('CREATE TABLE IF NOT EXISTS entries ('
+                     'key BLOB PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, '
+                     'expires REAL, accessed REAL NOT NULL)')
+        conn.execute('CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)')
+        conn.execute('CREATE INDEX IF NOT EXISTS entries_expires ON entries (expires)')
+        self._local.conn = conn
+        self._local.pid = pid
+        return conn
+
+    def _count(self, counter, n=1):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + n)
+
+    def get(self, key, default=None):
+        """Return the value cached for `key` and the UNIX time at which it
+        expires (or None), or `default`."""
+        now = time.time()
+        try:
+            conn = self._connect()
+            row = conn.execute('SELECT value, expires, accessed FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is not None and now - row[2] >= _TOUCH_INTERVAL:
+                conn.execute('UPDATE entries SET accessed = ? WHERE key = ?', (now, key))
+        except sqlite3.Error:
+            self._count('errors')
+            return default
+
+        if row is None or (row[1] is not None and row[1] <= now):
+            self._count('misses')
+            return default
+        self._count('hits')
+        return bson.decode(row[0])['v'], row[1]
+
+    def set(self, key, value, expires=None):
+        """Cache `value`, a value that BSON can encode, under `key`.
+
+        :param float expires: The UNIX time at which the entry expires.
+        """
+        now = time.time()
+        if self.ttl is not None and (expires is None or now + self.ttl < expires):
+            expires = now + self.ttl
+        if expires is not None and expires <= now:
+            return
+
+        data = bson.encode({'v': value})
+        if len(data) > self.max_entry_bytes:
+            return
+        try:
+            conn = self._connect()
+            conn.execute('INSERT OR REPLACE INTO entries (key, value, size, expires, accessed) VALUES (?, ?, ?, ?, ?)',
+                         (key, data, len(data), expires, now))
+            self._evict(conn, now)
+        except sqlite3.Error:
+            self._count('errors')
+
+    def _used_bytes(self, conn):
+        page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+        page_count = conn.execute('PRAGMA page_count').fetchone()[0]
+        freelist_count = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        return (page_count - freelist_count) * page_size
+
+    def _evict(self, conn, now):
+        if self._used_bytes(conn) <= self.max_bytes:
+            return
+
+        evicted = conn.execute('DELETE FROM entries WHERE expires <= ?', (now,)).rowcount
+        while self._used_bytes(conn) > self.max_bytes * _EVICTION_TARGET:
+            deleted = conn.execute('DELETE FROM entries WHERE key IN '
+                                   '(SELECT key FROM entries ORDER BY accessed LIMIT ?)',
+                                   (_EVICTION_BATCH,)).rowcount
+            if not deleted:
+                break
+            evicted += deleted
+        self._count('evictions', evicted)
+
+    def delete(self, key):
+        """Remove the entry of `key`."""
+        try:
+            self._connect().execute('DELETE FROM entries WHERE key = ?', (key,))
+        except sqlite3.Error:
+            self._count('errors')
+
+    def clear(self):
+        """Remove every entry, for every process."""
+        self._connect().execute('DELETE FROM entries')
+
+    def __len__(self):
+        return self._connect().execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    @property
+    def size(self):
+        """Approximate size of the entries in bytes."""
+        return self._connect().execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+
+    def stats(self):
+        """Return the hit, miss, eviction and error counters of this process."""
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            errors=self.errors,
+        )
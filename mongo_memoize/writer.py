@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+import atexit
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+from pymongo import DeleteMany, UpdateOne
+
+_FLUSH = object()
+_STOP = object()
+
+
+class BackgroundWriter(object):
+    """Writes cache documents to MongoDB from a background thread.
+
+    Queued upserts are sent with unordered bulk writes, when `batch_size`
+    writes are queued or `flush_interval` seconds after the first queued
+    write. The queue is bounded: when it is full, :meth:`put` waits up to
+    `block_timeout` seconds and then drops the write. Queued writes are
+    flushed at interpreter exit.
+
+    :param int batch_size: The maximum number of writes per bulk write.
+    :param float flush_interval: The maximum number of seconds a write stays
+        in the queue.
+    :param int max_queue_size: The maximum number of queued writes.
+    :param float block_timeout: The number of seconds :meth:`put` waits for
+        room in a full queue before dropping the write.
+    """
+
+    def __init__(self, batch_size=500, flush_interval=1.0, max_queue_size=10000, block_timeout=0):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue_size = max_queue_size
+        self.block_timeout = block_timeout
+
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
+        self.flushes = 0
+        self.flush_time = 0.0
+        self.last_flush_latency = None
+        self.max_flush_latency = None
+
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._thread = None
+
+    def put(self, cache_col, filter, update):
+        """Queue an upsert. Return False if the write was dropped."""
+        return self._put((cache_col, filter, update))
+
+    def delete(self, col, filter):
+        """Queue the deletion of the documents matching `filter`, written
+        after the upserts queued before it. Return False if it was dropped."""
+        return self._put((col, filter, None))
+
+    def _put(self, item):
+        self._start()
+        try:
+            if self.block_timeout:
+                self._queue.put(item, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(item)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+        return True
+
+    def flush(self, timeout=None):
+        """Write every queued upsert. Return False on timeout."""
+        if self._pid != os.getpid():
+            return True
+        self._start()
+        done = threading.Event()
+        self._queue.put((_FLUSH, done, None))
+        return done.wait(timeout)
+
+    def close(self, timeout=10):
+        """Flush the queue and stop the writer thread. Later writes start
+        it again."""
+        if self._pid != os.getpid() or not self._thread.is_alive():
+            return
+        self._queue.put((_STOP, None, None))
+        self._thread.join(timeout)
+
+    def stats(self):
+        """Return the queue depth and the write, drop and flush counters."""
+        return dict(
+            queued=self._queue.qsize() if self._pid == os.getpid() else 0,
+            written=self.written,
+            dropped=self.dropped,
+            errors=self.errors,
+            flushes=self.flushes,
+            last_flush_latency=self.last_flush_latency,
+            max_flush_latency=self.max_flush_latency,
+            avg_flush_latency=self.flush_time / self.flushes if self.flushes else None,
+        )
+
+    def _start(self):
+        pid = os.getpid()
+        if self._pid == pid and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid != pid:
+                # the thread (and the queue) of the parent do not survive
+                # os.fork(); its writes are flushed by the parent
+                self._queue = queue.Queue(self.max_queue_size)
+                self._thread = None
+                atexit.register(self.close)
+            if self._thread is None or not self._thread.is_alive():
+                # or restarted for the writes queued after close()
+                self._thread = threading.Thread(target=self._run, name='mongo_memoize_writer')
+                self._thread.daemon = True
+                self._thread.start()
+            self._pid = pid
+
+    def _run(self):
+        stopping = False
+        while True:
+            if stopping:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    return
+                deadline = 0
+            else:
+                item = self._queue.get()
+                deadline = time.monotonic() + self.flush_interval
+
+            batch = []
+            waiters = []
+            while True:
+                if item[0] is _FLUSH:
+                    waiters.append(item[1])
+                    deadline = 0
+                elif item[0] is _STOP:
+                    # drain whatever is still queued, then exit
+                    stopping = True
+                    deadline = 0
+                else:
+                    batch.append(item)
+                    if len(batch) >= self.batch_size:
+                        break
+
+                remaining = deadline - time.monotonic()
+                try:
+                    if remaining > 0:
+                        item = self._queue.get(timeout=remaining)
+                    else:
+                        item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+
+            if batch:
+                self._write(batch)
+            for done in waiters:
+                done.set()
+
+    def _write(self, batch):
+        # the last write of a key wins; upserting the same key twice in one
+        # unordered bulk write could fail on the unique index. Collections
+        # are written in the order of their first write, so deletions of
+        # chunks come after the documents which stopped pointing to them.
+        collections = OrderedDict()
+        for cache_col, filter, update in batch:
+            requests = collections.setdefault(cache_col.full_name, (cache_col, OrderedDict()))[1]
+            if update is None:
+                requests[(None,) + tuple(sorted(filter.items()))] = DeleteMany(filter)
+            else:
+                requests[tuple(sorted(filter.items()))] = UpdateOne(filter, update, upsert=True)
+
+        start = time.perf_counter()
+        written = errors = 0
+        for cache_col, requests in collections.values():
+            # the counters are of cache documents
+            upserts = sum(1 for request in requests.values() if isinstance(request, UpdateOne))
+            try:
+                cache_col.bulk_write(list(requests.values()), ordered=False)
+                written += upserts
+            except Exception:
+                errors += upserts
+        latency = time.perf_counter() - start
+
+        with self._lock:
+            self.written += written
+            self.errors += errors
+            self.flushes += 1
+            self.flush_time += latency
+            self.last_flush_latency = latency
+            if self.max_flush_latency is None or latency > self.max_flush_latency:
+                self.max_flush_latency = latency
+
+
+_default_writer = None
+_default_writer_lock = threading.Lock()
+
+
+def get_default_writer():
+    """Return the process-wide :class:`BackgroundWriter`."""
+    global _default_writer
+
+    if _default_writer is None:
+        with _default_writer_lock:
+            if _default_writer is None:
+                _default_writer = BackgroundWriter()
+    return _default_writer
@@ -0,0 +1,51 @@
+import unittest
+
+import pymongo
+from bson.binary import Binary
+from mongo_memoize.chunks import ChunkStore, ensure_chunk_indexes
+
+MONGO_URI = "mongodb://localhost"
+DB_NAME = 'test'
+
+
+class TestChunkStore(unittest.TestCase):
+    def setUp(self) -> None:
+        self.client = pymongo.MongoClient(MONGO_URI)
+        self.chunk_col = self.client[DB_NAME]['cache.chunks']
+        ensure_chunk_indexes(self.chunk_col)
+        self.store = ChunkStore(self.chunk_col, chunk_size=100)
+
+    def tearDown(self) -> None:
+        self.client.drop_database(DB_NAME)
+        self.client.close()
+
+    def test_put_get(self):
+        data = bytes(bytearray(range(256))) * 2
+        ref = self.store.put('key', data, qualname='func')
+        self.assertEqual(ref['size'], 512)
+        self.assertEqual(ref['chunks'], 6)
+        self.assertEqual(self.chunk_col.count_documents({'key': 'key', 'qualname': 'func'}), 6)
+        self.assertEqual(self.store.get('key', ref), data)
+
+    def test_binary_payload(self):
+        data = Binary(b'x' * 250, 0x80)
+        ref = self.store.put('key', data)
+        payload = self.store.get('key', ref)
+        self.assertIsInstance(payload, bytearray)
+        self.assertEqual(payload, data)
+
+    def test_missing_chunks(self):
+        ref = self.store.put('key', b'x' * 250)
+        self.chunk_col.delete_one({'key': 'key', 'n': 1})
+        self.assertIsNone(self.store.get('key', ref))
+
+    def test_delete_keeps_generation(self):
+        old = self.store.put('key', b'a' * 250)
+        new = self.store.put('key', b'b' * 150)
+        self.store.delete('key', keep=new['gen'])
+        self.assertIsNone(self.store.get('key', old))
+        self.assertEqual(self.store.get('key', new), b'b' * 150)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,12 @@
+import datetime
+import time
 import pymongo
-from mongo_memoize import memoize
+from mongo_memoize import memoize, LocalCache
 import unittest
 from collections import defaultdict
-from mongo_memoize import reset_cache
+from mongo_memoize import reset_cache, invalidate_tags, collect_old_versions
+from mongo_memoize.cli import main
+from mongo_memoize.decorator import function_collection_name
 
 
 MONGO_URI = "mongodb://localhost"
@@ -33,6 +37,46 @@ def normal_function():
         call_count['normal_function'] = 1
     return True
 
+@memoize(db_name=DB_NAME, mongo_uri=MONGO_URI, collection_name=None, max_age=60)
+def own_collection(a):
+    call_count['own_collection'] += 1
+    return a
+
+
+@memoize(db_name=DB_NAME, mongo_uri=MONGO_URI, collection_name=None, prefix='other')
+def other_collection(a):
+    call_count['other_collection'] += 1
+    return a
+
+
+@memoize(db_name=DB_NAME, mongo_uri=MONGO_URI, queryable_args=True)
+def get_orders(customer_id, status='open'):
+    call_count['get_orders'] += 1
+    return [customer_id, status]
+
+
+@memoize(db_name=DB_NAME, mongo_uri=MONGO_URI, queryable_args=True)
+def get_invoices(customer_id, year):
+    call_count['get_invoices'] += 1
+    return [customer_id, year]
+
+
+@memoize(db_name=DB_NAME, mongo_uri=MONGO_URI, collection_name=None)
+def dedicated(a):
+    return a
+
+
+@memoize(db_name=DB_NAME, mongo_uri=MONGO_URI, collection_name=None, skip_schema=True)
+def unmanaged(a):
+    return a
+
+
+@memoize(db_name=DB_NAME, mongo_uri=MONGO_URI, local_cache=LocalCache(), tags='prices')
+def local_price(a):
+    call_count['local_price'] += 1
+    return a
+
+
 class TestClearCache(unittest.TestCase):
     def setUp(self) -> None:
         self.client = pymongo.MongoClient(MONGO_URI)
@@ -71,3 +115,220 @@ class TestClearCache(unittest.TestCase):
         
         normal_function()
         self.assertEqual(call_count['normal_function'], 2)
+
+    def test_function_collection(self):
+        own_collection(1)
+        other_collection(1)
+        own_collection(1)
+        other_collection(1)
+        self.assertEqual(call_count['own_collection'], 1)
+        self.assertEqual(call_count['other_collection'], 1)
+
+        db = self.client[DB_NAME]
+        own_name = 'memoize_mytests.test_clearcache_own_collection'
+        self.assertEqual(own_collection.memoizer.collection_name, own_name)
+        self.assertEqual(db[own_name].count_documents({}), 1)
+        self.assertEqual(db['other_mytests.test_clearcache_other_collection'].count_documents({}), 1)
+
+        # the collection is dropped and bootstrapped again
+        reset_cache(own_collection, db_name=DB_NAME, mongo_client_cb=get_db_conn)
+        self.assertEqual(db[own_name].count_documents({}), 0)
+        self.assertIn('expiresAt_1', db[own_name].index_information())
+
+        own_collection(1)
+        other_collection(1)
+        self.assertEqual(call_count['own_collection'], 2)
+        self.assertEqual(call_count['other_collection'], 1)
+
+    def test_several_functions(self):
+        for customer_id in range(3):
+            get_orders(customer_id)
+            get_invoices(customer_id, 2026)
+        normal_function()
+
+        calls = dict(call_count)
+        self.assertEqual(reset_cache([get_orders, get_invoices]), 6)
+        self.assertEqual(self.client[DB_NAME]['cache'].count_documents({}), 1)
+
+        get_orders(0)
+        get_invoices(0, 2026)
+        self.assertEqual(call_count['get_orders'], calls['get_orders'] + 1)
+        self.assertEqual(call_count['get_invoices'], calls['get_invoices'] + 1)
+
+    def test_where(self):
+        get_orders(1)
+        get_orders(1, status='closed')
+        get_orders(2)
+        get_invoices(1, 2026)
+        col = self.client[DB_NAME]['cache']
+        self.assertEqual(col.find_one({'qualname': 'get_orders', 'params.customer_id': 2})['params'],
+                         {'customer_id': 2, 'status': 'open'})
+
+        self.assertEqual(reset_cache([get_orders, get_invoices], where={'customer_id': 1}), 3)
+        self.assertEqual(reset_cache(get_orders, where={'customer_id': 1}), 0)
+        self.assertEqual(col.count_documents({}), 1)
+
+    def test_where_requires_queryable_args(self):
+        with self.assertRaises(ValueError):
+            reset_cache(dedicated, where={'a': 5})
+        with self.assertRaises(ValueError):
+            reset_cache([get_orders, dedicated], where={'customer_id': 1})
+
+    def test_older_than(self):
+        get_orders(10)
+        get_orders(11)
+        col = self.client[DB_NAME]['cache']
+        col.update_one({'params.customer_id': 10},
+                       {'$set': {'cachedAt': datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=2)}})
+
+        self.assertEqual(reset_cache(get_orders, older_than=datetime.timedelta(days=1)), 1)
+        self.assertEqual(col.count_documents({'qualname': 'get_orders'}), 1)
+        # cachedAt is stored to the millisecond
+        time.sleep(0.01)
+        self.assertEqual(reset_cache(get_orders, older_than=0), 1)
+
+    def test_batches(self):
+        for customer_id in range(25):
+            get_invoices(customer_id, 2026)
+        self.assertEqual(reset_cache(get_invoices, batch_size=10), 25)
+        self.assertEqual(self.client[DB_NAME]['cache'].count_documents({}), 0)
+
+    def test_count_dedicated(self):
+        dedicated(5)
+        dedicated(6)
+        self.assertEqual(reset_cache(dedicated), 2)
+
+    def test_dedicated_chunk_indexes(self):
+        '''the chunks collection is recreated with its indexes'''
+        dedicated(5)
+        reset_cache(dedicated)
+        chunk_col = self.client[DB_NAME][dedicated.memoizer.collection_name + '.chunks']
+        self.assertIn('key_1_gen_1_n_1', chunk_col.index_information())
+
+    def test_local_cache(self):
+        '''the in-process tier of the function is emptied too'''
+        local_price(1)
+        self.assertEqual(reset_cache(local_price), 1)
+        calls = call_count['local_price']
+        local_price(1)
+        self.assertEqual(call_count['local_price'], calls + 1)
+
+    def test_dedicated_skip_schema(self):
+        '''a collection whose schema is managed elsewhere is emptied, not dropped'''
+        self.assertEqual(unmanaged(5), 5)
+        col = self.client[DB_NAME][unmanaged.memoizer.collection_name]
+        col.create_index('qualname')
+
+        self.assertEqual(reset_cache(unmanaged), 1)
+        self.assertEqual(col.count_documents({}), 0)
+        self.assertIn('qualname_1', col.index_information())
+
+
+class TestFunctionCollectionName(unittest.TestCase):
+
+    def test_sanitized(self):
+        def inner():
+            pass
+        inner.__qualname__ = 'Report.<locals>.total'
+        self.assertEqual(function_collection_name('memoize', inner),
+                         'memoize_mytests.test_clearcache_Report._locals_.total')
+
+    def test_long_names(self):
+        def inner():
+            pass
+        inner.__qualname__ = 'f' * 200
+        name = function_collection_name('memoize', inner)
+        self.assertEqual(len(name), 80)
+        inner.__qualname__ = 'f' * 199 + 'g'
+        self.assertNotEqual(function_collection_name('memoize', inner), name)
+
+
+@memoize(db_name=DB_NAME, mongo_uri=MONGO_URI, tags=lambda result, customer_id: ['customer:{}'.format(customer_id)])
+def customer_orders(customer_id):
+    call_count['customer_orders'] += 1
+    return [customer_id]
+
+
+@memoize(db_name=DB_NAME, mongo_uri=MONGO_URI, tags='catalog', collection_name=None)
+def products(category):
+    call_count['products'] += 1
+    return category
+
+
+class TestInvalidateTags(unittest.TestCase):
+    def setUp(self) -> None:
+        self.client = pymongo.MongoClient(MONGO_URI)
+
+    def tearDown(self) -> None:
+        self.client.drop_database(DB_NAME)
+        self.client.close()
+
+    def test_invalidate_tags(self):
+        customer_orders(1)
+        customer_orders(2)
+        col = self.client[DB_NAME]['cache']
+        self.assertEqual(col.find_one({'tags': 'customer:1'})['qualname'], 'customer_orders')
+
+        calls = call_count['customer_orders']
+        self.assertEqual(invalidate_tags(['customer:1'], db_name=DB_NAME, mongo_client_cb=get_db_conn), 1)
+        customer_orders(1)
+        customer_orders(2)
+        self.assertEqual(call_count['customer_orders'], calls + 1)
+
+    def test_functions(self):
+        products('books')
+        products('games')
+        customer_orders(3)
+        self.assertIn('tags_1', self.client[DB_NAME][products.memoizer.collection_name].index_information())
+
+        self.assertEqual(invalidate_tags(['catalog', 'customer:3'], functions=[products, customer_orders]), 3)
+        calls = call_count['products']
+        products('books')
+        self.assertEqual(call_count['products'], calls + 1)
+
+    def test_functions_local_cache(self):
+        local_price(2)
+        self.assertEqual(invalidate_tags(['prices'], functions=[local_price]), 1)
+        calls = call_count['local_price']
+        local_price(2)
+        self.assertEqual(call_count['local_price'], calls + 1)
+
+
+def report(month):
+    call_count['report'] += 1
+    return month
+
+
+report_v1 = memoize(db_name=DB_NAME, mongo_uri=MONGO_URI, version='2026.1')(report)
+report_v2 = memoize(db_name=DB_NAME, mongo_uri=MONGO_URI, version='2026.2')(report)
+
+
+class TestCollectOldVersions(unittest.TestCase):
+    def setUp(self) -> None:
+        self.client = pymongo.MongoClient(MONGO_URI)
+
+    def tearDown(self) -> None:
+        self.client.drop_database(DB_NAME)
+        self.client.close()
+
+    def test_collect_old_versions(self):
+        for month in range(1, 6):
+            report_v1(month)
+        report_v2(1)
+        col = self.client[DB_NAME]['cache']
+        col.insert_one({'key': 'unversioned', 'qualname': 'report', 'module': __name__})
+        # a function of the same name in another module
+        col.insert_one({'key': 'other', 'qualname': 'report', 'module': 'myapp.reports', 'version': '1'})
+
+        self.assertEqual(collect_old_versions(report_v2, batch_size=2), 6)
+        self.assertEqual(col.count_documents({'qualname': 'report'}), 2)
+        self.assertEqual(col.count_documents({'qualname': 'report', 'module': 'myapp.reports'}), 1)
+        calls = call_count['report']
+        report_v2(1)
+        self.assertEqual(call_count['report'], calls)
+
+    def test_cli(self):
+        report_v1(1)
+        report_v2(1)
+        main(['gc', 'mytests.test_clearcache:report_v2', '--batch-size', '10'])
+        self.assertEqual(self.client[DB_NAME]['cache'].count_documents({'qualname': 'report'}), 1)
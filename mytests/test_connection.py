@@ -0,0 +1,51 @@
+import unittest
+from mongo_memoize import connection
+from mongo_memoize.decorator import Memoizer
+
+MONGO_URI = "mongodb://localhost"
+
+
+class TestClientPool(unittest.TestCase):
+    def tearDown(self) -> None:
+        connection.close_clients()
+
+    def test_same_uri_shares_client(self):
+        client1 = connection.get_client(MONGO_URI, {'connect': False})
+        client2 = connection.get_client(MONGO_URI, {'connect': False})
+        self.assertIs(client1, client2)
+
+    def test_different_options_use_different_clients(self):
+        client1 = connection.get_client(MONGO_URI, {'connect': False})
+        client2 = connection.get_client(MONGO_URI, {'connect': False, 'appname': 'other'})
+        self.assertIsNot(client1, client2)
+
+    def test_new_client_after_fork(self):
+        client1 = connection.get_client(MONGO_URI, {'connect': False})
+        # pretend the pool was populated by a parent process
+        connection._pid = -1
+        client2 = connection.get_client(MONGO_URI, {'connect': False})
+        self.assertIsNot(client1, client2)
+        client1.close()
+
+    def test_memoizers_share_client(self):
+        memoizer1 = Memoizer(mongo_uri=MONGO_URI, connection_options={'connect': False})
+        memoizer2 = Memoizer(mongo_uri=MONGO_URI, connection_options={'connect': False})
+        memoizer1.connect()
+        memoizer2.connect()
+        self.assertIs(memoizer1.db_conn, memoizer2.db_conn)
+
+    def test_client_cb_called_once(self):
+        calls = []
+
+        def client_cb():
+            calls.append(1)
+            return connection.get_client(MONGO_URI, {'connect': False})
+
+        memoizer = Memoizer(mongo_client_cb=client_cb)
+        memoizer.connect()
+        memoizer.connect()
+        self.assertEqual(len(calls), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
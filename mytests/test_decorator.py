@@ -1,7 +1,16 @@
 import pymongo
-from mongo_memoize import memoize
+from bson.binary import Binary
+from pymongo import monitoring
+from mongo_memoize import memoize, LocalCache, reset_cache, PickleMD5KeyGenerator, PickleDigestKeyGenerator, \
+    InMemoryCollector, SharedCache, TypedSerializer
 import unittest
 from collections import defaultdict
+import asyncio
+import os
+import pickle
+import tempfile
+from mongo_memoize.decorator import code_version
+import threading
 import time
 
 MONGO_URI = "mongodb://localhost"
@@ -13,6 +22,20 @@ def get_db_conn():
     return client
 
 
+class CommandCounter(monitoring.CommandListener):
+    def __init__(self):
+        self.commands = defaultdict(int)
+
+    def started(self, event):
+        self.commands[event.command_name] += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
 class TestMemoize(unittest.TestCase):
     def setUp(self) -> None:
         self.client = pymongo.MongoClient(MONGO_URI)
@@ -89,6 +112,359 @@ class TestMemoize(unittest.TestCase):
         multiply(2, 3)
         self.assertEqual(call_count['check_max_age'], 2)
 
+    def test_decorating_does_not_connect(self):
+        '''decorating a function must not touch the network'''
+        calls = []
+
+        def client_cb():
+            calls.append(1)
+            return get_db_conn()
+
+        @memoize(db_name=DB_NAME, mongo_client_cb=client_cb)
+        def func():
+            return True
+
+        self.assertEqual(len(calls), 0)
+        self.assertTrue(func())
+        self.assertEqual(len(calls), 1)
+
+    def test_schema_bootstrapped_once(self):
+        '''indexes are created on the first call only'''
+        counter = CommandCounter()
+        client = pymongo.MongoClient(MONGO_URI, event_listeners=[counter])
+
+        @memoize(db_name=DB_NAME, mongo_client_cb=lambda: client, max_age=60)
+        def func(a):
+            return a
+
+        for i in range(5):
+            self.assertEqual(func(i), i)
+        # key, qualname and expiresAt
+        self.assertEqual(counter.commands['createIndexes'], 3)
+        self.assertEqual(counter.commands['find'], 5)
+        client.close()
+
+    def test_skip_schema(self):
+        counter = CommandCounter()
+        client = pymongo.MongoClient(MONGO_URI, event_listeners=[counter])
+
+        @memoize(db_name=DB_NAME, mongo_client_cb=lambda: client, skip_schema=True)
+        def func(a):
+            return a
+
+        self.assertEqual(func(1), 1)
+        self.assertEqual(counter.commands['createIndexes'], 0)
+        func.memoizer.ensure_schema()
+        # key and qualname
+        self.assertEqual(counter.commands['createIndexes'], 2)
+        client.close()
+
+    def test_local_cache(self):
+        '''hits are served by the in-process tier first'''
+        self.assertEqual(local_square(3), 9)
+        self.assertEqual(local_square(3), 9)
+        self.assertEqual(call_count['local_square'], 1)
+
+        stats = local_square.memoizer.stats()
+        self.assertEqual(stats['local']['hits'], 1)
+        self.assertEqual(stats['local']['misses'], 1)
+        self.assertEqual(stats['mongo']['misses'], 1)
+        self.assertEqual(stats['mongo']['hits'], 0)
+
+        # falls through to MongoDB on a local miss
+        local_square.memoizer.local_cache.clear()
+        self.assertEqual(local_square(3), 9)
+        self.assertEqual(call_count['local_square'], 1)
+        self.assertEqual(local_square.memoizer.stats()['mongo']['hits'], 1)
+
+    def test_local_cache_size(self):
+        '''the entries of the in-process tier are as large as their payload'''
+        self.assertEqual(local_profile(1), {'bio': 'x' * 5000})
+        self.assertGreater(local_profile.memoizer.local_cache.size, 5000)
+
+    def test_shared_local_cache(self):
+        '''functions sharing a LocalCache do not read the results of each other'''
+        self.assertEqual(local_user(1), 'user1')
+        self.assertEqual(local_order(1), 'order1')
+        self.assertEqual(local_user(1), 'user1')
+        self.assertEqual(len(shared_local_cache), 2)
+
+    def test_shared_cache(self):
+        '''the processes of a host share the results in the shared tier'''
+        self.assertEqual(worker_a(8), 4)
+        stats = worker_b.memoizer.stats()
+        self.assertEqual(worker_b(8), 4)
+        self.assertEqual(call_count['halve'], 1)
+        self.assertEqual(worker_b.memoizer.stats()['mongo'], stats['mongo'])
+        self.assertEqual(worker_b.memoizer.stats()['shared']['hits'], stats['shared']['hits'] + 1)
+
+        # and then the in-process tier
+        self.assertEqual(worker_b(8), 4)
+        self.assertEqual(worker_b.memoizer.stats()['shared']['hits'], stats['shared']['hits'] + 1)
+
+        self.assertEqual(worker_a.map([(8,), (10,)]), [4, 5])
+        self.assertEqual(worker_b.map([(8,), (10,)]), [4, 5])
+        self.assertEqual(call_count['halve'], 2)
+
+    def test_shared_cache_async(self):
+        '''coroutines access the shared tier off the event loop'''
+        async def run():
+            self.assertEqual(await async_worker_a(8), 4)
+            self.assertEqual(await async_worker_b(8), 4)
+            self.assertEqual(await async_worker_b(12), 6)
+
+        asyncio.run(run())
+        self.assertEqual(call_count['async_halve'], 2)
+        self.assertEqual(async_worker_b.memoizer.stats()['mongo']['hits'], 0)
+        self.assertEqual(async_worker_b.memoizer.stats()['shared']['hits'], 1)
+        self.assertTrue(async_shared_cache.threads)
+        self.assertNotIn(threading.main_thread(), async_shared_cache.threads)
+
+    def test_map(self):
+        '''batch calls only compute the misses'''
+        call_count['map_add'] = 0
+        self.assertEqual(map_add(1), 1)
+        self.assertEqual(map_add.map([(1,), (2,), (2,), (3,)], [{}, {}, {}, {'b': 1}]), [1, 2, 2, 4])
+        self.assertEqual(call_count['map_add'], 3)
+
+        self.assertEqual(map_add.map([(2,), (3,)], [{}, {'b': 1}]), [2, 4])
+        self.assertEqual(call_count['map_add'], 3)
+        self.assertEqual(map_add(3, b=1), 4)
+        self.assertEqual(call_count['map_add'], 3)
+
+    def test_map_with_executor(self):
+        from concurrent.futures import ThreadPoolExecutor
+        call_count['map_add'] = 0
+        with ThreadPoolExecutor(2) as executor:
+            self.assertEqual(map_add.map(kwarg_list=[{'a': 5}, {'a': 6}], executor=executor), [5, 6])
+        self.assertEqual(map_add(a=5), 5)
+        self.assertEqual(call_count['map_add'], 2)
+
+    def test_coroutine_function(self):
+        '''concurrent awaits of the same key share one computation'''
+        async def run():
+            results = await asyncio.gather(*[async_double(21) for _ in range(5)])
+            self.assertEqual(results, [42] * 5)
+            self.assertEqual(call_count['async_double'], 1)
+            self.assertEqual(await async_double(21), 42)
+            self.assertEqual(call_count['async_double'], 1)
+
+        asyncio.run(run())
+
+    def test_single_flight(self):
+        '''concurrent misses of the same key compute it once'''
+        threads = [threading.Thread(target=slow_identity, args=(1,)) for _ in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(call_count['slow_identity'], 1)
+        self.assertEqual(slow_identity(1), 1)
+        self.assertEqual(call_count['slow_identity'], 1)
+
+    def test_single_flight_rechecks_mongodb(self):
+        '''a miss that becomes leader after another flight stored the result does not compute it'''
+        self.assertEqual(flight_identity(2), 2)
+        self.assertEqual(call_count['flight_identity'], 1)
+
+        func = flight_identity.__wrapped__
+        cache_key = flight_identity.memoizer.make_key(func, (2,), {})
+        self.assertEqual(flight_identity.memoizer._compute_once(func, (2,), {}, cache_key), 2)
+        self.assertEqual(call_count['flight_identity'], 1)
+
+    def test_stale_while_revalidate(self):
+        '''stale results are returned immediately and refreshed in the background'''
+        self.assertEqual(stale_counter(), 1)
+        self.assertEqual(stale_counter(), 1)
+        time.sleep(1.5)
+
+        # stale: served from the cache while it is being recomputed
+        self.assertEqual(stale_counter(), 1)
+        time.sleep(0.5)
+        self.assertEqual(call_count['stale_counter'], 2)
+        self.assertEqual(stale_counter(), 2)
+
+    def test_map_stale_while_revalidate(self):
+        '''stale results found by map are recomputed in the background'''
+        self.assertEqual(stale_square.map([(3,)]), [9])
+        time.sleep(1.5)
+
+        self.assertEqual(stale_square.map([(3,)]), [9])
+        time.sleep(0.5)
+        self.assertEqual(call_count['stale_square'], 2)
+
+    def test_spill_to_chunks(self):
+        '''results larger than spill_threshold are stored in chunks'''
+        self.assertEqual(big_range(1000), list(range(1000)))
+        self.assertEqual(big_range(1000), list(range(1000)))
+        self.assertEqual(call_count['big_range'], 1)
+
+        db = self.client[DB_NAME]
+        self.assertGreater(db['cache.chunks'].count_documents({}), 1)
+        self.assertNotIn('result', db['cache'].find_one({'qualname': 'big_range'}))
+
+        reset_cache(big_range, db_name=DB_NAME, mongo_client_cb=get_db_conn)
+        self.assertEqual(db['cache.chunks'].count_documents({}), 0)
+
+    def test_spill_native_payload(self):
+        '''payloads stored as BSON documents are spilled by their encoded size'''
+        self.assertEqual(native_range(1000), list(range(1000)))
+        self.assertEqual(native_range(1000), list(range(1000)))
+        self.assertEqual(call_count['native_range'], 1)
+
+        db = self.client[DB_NAME]
+        self.assertNotIn('result', db['cache'].find_one({'qualname': 'native_range'}))
+        self.assertEqual(db['cache'].find_one({'qualname': 'native_range'})['spill']['encoding'], 'bson')
+
+    def test_spills(self):
+        '''documents spill by the BSON size of their payload'''
+        spills = native_range.memoizer.spills
+        self.assertFalse(spills({'result': list(range(10))}))
+        self.assertTrue(spills({'result': list(range(1000))}))
+        self.assertFalse(spills({'result': {'bio': 'x' * 900}}))
+        self.assertTrue(spills({'result': {'bio': 'x' * 1024}}))
+        self.assertTrue(spills({'result': 'é' * 600}))
+
+    def test_spill_custom_serializer(self):
+        '''serializers taking only the payload read spilled results'''
+        self.assertEqual(custom_range(1000), list(range(1000)))
+        self.assertEqual(custom_range(1000), list(range(1000)))
+        self.assertEqual(call_count['custom_range'], 1)
+        self.assertIn('spill', self.client[DB_NAME]['cache'].find_one({'qualname': 'custom_range'}))
+
+    def test_inline_write_removes_chunks(self):
+        '''the chunks of a spilled result are removed when an inline result replaces it'''
+        self.assertEqual(spilled_range(1500), list(range(1500)))
+        db = self.client[DB_NAME]
+        self.assertGreater(db['cache.chunks'].count_documents({}), 1)
+
+        memoizer = spilled_range.memoizer
+        func = spilled_range.__wrapped__
+        cache_key = memoizer.make_key(func, (1500,), {})
+        memoizer.save(func, cache_key, memoizer.make_document(func, (1500,), {}, [0]))
+        self.assertEqual(db['cache.chunks'].count_documents({}), 0)
+        self.assertEqual(memoizer.fetch(func, cache_key), [0])
+
+    def test_legacy_key_generator(self):
+        '''results cached with hex keys are read and moved to binary keys'''
+        self.assertEqual(hex_cube(3), 27)
+        self.assertEqual(call_count['cube'], 1)
+        col = self.client[DB_NAME]['cache']
+        self.assertIsInstance(col.find_one({'qualname': 'cube'})['key'], str)
+
+        self.assertEqual(digest_cube(3), 27)
+        self.assertEqual(call_count['cube'], 1)
+        self.assertIsInstance(col.find_one({'qualname': 'cube'})['key'], bytes)
+        self.assertEqual(col.count_documents({}), 1)
+
+        self.assertEqual(digest_cube.map([(3,), (4,)]), [27, 64])
+        self.assertEqual(call_count['cube'], 2)
+
+    def test_key_as_id(self):
+        '''the cache key is the _id and no key index is created'''
+        self.assertEqual(id_square(4), 16)
+        self.assertEqual(id_square(4), 16)
+        self.assertEqual(id_square.map([(4,), (5,)]), [16, 25])
+        self.assertEqual(call_count['id_square'], 2)
+
+        col = self.client[DB_NAME]['cache_by_id']
+        self.assertEqual(col.count_documents({'key': {'$exists': True}}), 0)
+        self.assertEqual(col.count_documents({}), 2)
+        self.assertNotIn('key_1', col.index_information())
+
+    def test_lean(self):
+        '''lean documents have no debug fields and lookups only read the payload'''
+        self.assertEqual(lean_len('x' * 100), 100)
+        self.assertEqual(lean_len('x' * 100), 100)
+        self.assertEqual(call_count['lean_len'], 1)
+
+        col = self.client[DB_NAME]['cache']
+        document = col.find_one({'qualname': 'lean_len'})
+        self.assertNotIn('args', document)
+        self.assertNotIn('kwargs', document)
+
+        memoizer = lean_len.memoizer
+        cached_obj = memoizer.lookup(col, memoizer.make_key(lean_len, ('x' * 100,), {}))
+        self.assertEqual(set(cached_obj), {'_id', 'key', 'result'})
+
+    def test_metrics(self):
+        metrics.reset()
+        self.assertEqual(measured_div(4), 3)
+        self.assertEqual(measured_div(4), 3)
+        self.assertRaises(ZeroDivisionError, measured_div, 0)
+        self.assertEqual(measured_div.map([(4,), (6,)]), [3, 2])
+
+        snapshot = metrics.snapshot()['measured_div']
+        self.assertEqual(snapshot['hits'], 2)
+        self.assertEqual(snapshot['misses'], 3)
+        self.assertEqual(snapshot['errors'], 1)
+        self.assertEqual(snapshot['phases']['key']['count'], 5)
+        self.assertEqual(snapshot['phases']['lookup']['count'], 4)
+        self.assertEqual(snapshot['phases']['compute']['count'], 2)
+        self.assertEqual(snapshot['phases']['deserialize']['count'], 2)
+        self.assertEqual(snapshot['phases']['serialize']['count'], 2)
+        self.assertEqual(snapshot['phases']['write']['count'], 2)
+        self.assertEqual(snapshot['payload_size']['count'], 2)
+
+    def test_cache_exceptions(self):
+        '''selected exceptions are cached and raised again until they expire'''
+        self.assertRaises(ValueError, flaky_parse, 'x')
+        self.assertRaises(ValueError, flaky_parse, 'x')
+        self.assertEqual(call_count['flaky_parse'], 1)
+
+        # other exceptions are not cached
+        self.assertRaises(TypeError, flaky_parse, None)
+        self.assertRaises(TypeError, flaky_parse, None)
+        self.assertEqual(call_count['flaky_parse'], 3)
+
+        time.sleep(1.1)
+        self.assertRaises(ValueError, flaky_parse, 'x')
+        self.assertEqual(call_count['flaky_parse'], 4)
+
+    def test_cached_exception_of_another_function(self):
+        '''a cached exception is not raised by another function of the module called with the same arguments'''
+        self.assertRaises(ValueError, flaky_parse, 'y')
+        self.assertEqual(parse_length('y'), 1)
+        self.assertRaises(ValueError, flaky_parse, 'y')
+
+    def test_negative_ttl(self):
+        '''negative results expire after negative_ttl'''
+        self.assertEqual(find_user(1), None)
+        self.assertEqual(find_user(2), 'user2')
+        self.assertEqual(find_user(1), None)
+        self.assertEqual(find_user(2), 'user2')
+        self.assertEqual(call_count['find_user'], 2)
+
+        time.sleep(1.1)
+        self.assertEqual(find_user(1), None)
+        self.assertEqual(find_user(2), 'user2')
+        self.assertEqual(call_count['find_user'], 3)
+
+        document = self.client[DB_NAME]['cache'].find_one({'qualname': 'find_user', 'args': '(2,)'})
+        self.assertNotIn('expiresAt', document)
+
+    def test_debug_max_length(self):
+        self.assertEqual(truncated_len('x' * 100), 100)
+        document = self.client[DB_NAME]['cache'].find_one({'qualname': 'truncated_len'})
+        self.assertEqual(document['args'], "('" + 'x' * 8 + '...')
+
+    def test_version(self):
+        '''bumping the version of a function misses the results of the previous one'''
+        self.assertEqual(square_v1(3), 9)
+        self.assertEqual(square_v1(3), 9)
+        self.assertEqual(call_count['square'], 1)
+        self.assertEqual(square_v2(3), 9)
+        self.assertEqual(square_v2(3), 9)
+        self.assertEqual(call_count['square'], 2)
+
+        versions = sorted(d['version'] for d in self.client[DB_NAME]['cache'].find({'qualname': 'square'}))
+        self.assertEqual(versions, ['1', '2'])
+
+        # functions of the same module no longer share keys once versioned
+        self.assertEqual(auto_square(3), 9)
+        self.assertEqual(call_count['square'], 3)
+        self.assertEqual(auto_square.memoizer.get_version(square), code_version(square))
+
 
 @memoize(db_name=DB_NAME, mongo_uri=MONGO_URI)
 def memoize_function_run_check():
@@ -137,5 +513,215 @@ def multiply(a, b):
     return a * b
 
 
+@memoize(db_name=DB_NAME, mongo_client_cb=get_db_conn, local_cache=LocalCache(max_entries=10))
+def local_square(a):
+    call_count['local_square'] += 1
+    return a * a
+
+
+@memoize(db_name=DB_NAME, mongo_client_cb=get_db_conn, serializer=TypedSerializer(), local_cache=LocalCache())
+def local_profile(a):
+    return {'bio': 'x' * 5000}
+
+
+@memoize(db_name=DB_NAME, mongo_client_cb=get_db_conn)
+def map_add(a, b=0):
+    call_count['map_add'] += 1
+    return a + b
+
+
+@memoize(db_name=DB_NAME, mongo_client_cb=get_db_conn)
+async def async_double(a):
+    call_count['async_double'] += 1
+    await asyncio.sleep(0.1)
+    return a * 2
+
+
+@memoize(db_name=DB_NAME, mongo_client_cb=get_db_conn, single_flight=True, lease_timeout=5)
+def slow_identity(a):
+    call_count['slow_identity'] += 1
+    time.sleep(0.2)
+    return a
+
+
+@memoize(db_name=DB_NAME, mongo_client_cb=get_db_conn, single_flight=True)
+def flight_identity(a):
+    call_count['flight_identity'] += 1
+    return a
+
+
+@memoize(db_name=DB_NAME, mongo_client_cb=get_db_conn, max_age=60, stale_ttl=1)
+def stale_counter():
+    call_count['stale_counter'] += 1
+    return call_count['stale_counter']
+
+
+@memoize(db_name=DB_NAME, mongo_client_cb=get_db_conn, max_age=60, stale_ttl=1)
+def stale_square(a):
+    call_count['stale_square'] += 1
+    return a * a
+
+
+@memoize(db_name=DB_NAME, mongo_client_cb=get_db_conn, spill_threshold=1024, chunk_size=512)
+def big_range(n):
+    call_count['big_range'] += 1
+    return list(range(n))
+
+
+@memoize(db_name=DB_NAME, mongo_client_cb=get_db_conn, serializer=TypedSerializer(), spill_threshold=1024,
+         chunk_size=512)
+def native_range(n):
+    call_count['native_range'] += 1
+    return list(range(n))
+
+
+@memoize(db_name=DB_NAME, mongo_client_cb=get_db_conn, spill_threshold=1024, chunk_size=512)
+def spilled_range(n):
+    return list(range(n))
+
+
+class TaggedPickleSerializer(object):
+    def serialize(self, obj):
+        return Binary(pickle.dumps(obj), 128)
+
+    def deserialize(self, serialized):
+        assert serialized.subtype == 128
+        return pickle.loads(serialized)
+
+
+@memoize(db_name=DB_NAME, mongo_client_cb=get_db_conn, serializer=TaggedPickleSerializer(), spill_threshold=1024,
+         chunk_size=512)
+def custom_range(n):
+    call_count['custom_range'] += 1
+    return list(range(n))
+
+
+def cube(a):
+    call_count['cube'] += 1
+    return a ** 3
+
+
+hex_cube = memoize(db_name=DB_NAME, mongo_client_cb=get_db_conn)(cube)
+digest_cube = memoize(db_name=DB_NAME, mongo_client_cb=get_db_conn, key_generator=PickleDigestKeyGenerator(),
+                      legacy_key_generator=PickleMD5KeyGenerator())(cube)
+
+
+@memoize(db_name=DB_NAME, mongo_client_cb=get_db_conn, collection_name='cache_by_id', key_as_id=True)
+def id_square(a):
+    call_count['id_square'] += 1
+    return a * a
+
+
+@memoize(db_name=DB_NAME, mongo_client_cb=get_db_conn, lean=True)
+def lean_len(s):
+    call_count['lean_len'] += 1
+    return len(s)
+
+
+@memoize(db_name=DB_NAME, mongo_client_cb=get_db_conn, debug_max_length=10)
+def truncated_len(s):
+    return len(s)
+
+
+metrics = InMemoryCollector()
+
+
+@memoize(db_name=DB_NAME, mongo_client_cb=get_db_conn, metrics=metrics)
+def measured_div(a):
+    return 12 // a
+
+
+@memoize(db_name=DB_NAME, mongo_client_cb=get_db_conn, cache_exceptions=(ValueError,), exception_ttl=1)
+def flaky_parse(s):
+    call_count['flaky_parse'] += 1
+    return int(s)
+
+
+@memoize(db_name=DB_NAME, mongo_client_cb=get_db_conn, cache_exceptions=(ValueError,), exception_ttl=1)
+def parse_length(s):
+    return len(s)
+
+
+@memoize(db_name=DB_NAME, mongo_client_cb=get_db_conn, negative_ttl=1)
+def find_user(user_id):
+    call_count['find_user'] += 1
+    return 'user%d' % user_id if user_id % 2 == 0 else None
+
+
+def square(a):
+    call_count['square'] += 1
+    return a * a
+
+
+square_v1 = memoize(db_name=DB_NAME, mongo_client_cb=get_db_conn, version=1)(square)
+square_v2 = memoize(db_name=DB_NAME, mongo_client_cb=get_db_conn, version=2)(square)
+auto_square = memoize(db_name=DB_NAME, mongo_client_cb=get_db_conn, version='auto')(square)
+
+
+def halve(a):
+    call_count['halve'] += 1
+    return a // 2
+
+
+shared_local_cache = LocalCache()
+
+
+@memoize(db_name=DB_NAME, mongo_client_cb=get_db_conn, collection_name='users', local_cache=shared_local_cache)
+def local_user(a):
+    return 'user%d' % a
+
+
+@memoize(db_name=DB_NAME, mongo_client_cb=get_db_conn, collection_name=None, local_cache=shared_local_cache)
+def local_order(a):
+    return 'order%d' % a
+
+
+shared_cache = SharedCache(os.path.join(tempfile.mkdtemp(), 'shared.sqlite'))
+worker_a = memoize(db_name=DB_NAME, mongo_client_cb=get_db_conn, local_cache=LocalCache(),
+                   shared_cache=shared_cache)(halve)
+worker_b = memoize(db_name=DB_NAME, mongo_client_cb=get_db_conn, local_cache=LocalCache(),
+                   shared_cache=SharedCache(shared_cache.path))(halve)
+
+
+class ThreadRecordingCache(SharedCache):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.threads = set()
+
+    def get(self, *args, **kwargs):
+        self.threads.add(threading.current_thread())
+        return super().get(*args, **kwargs)
+
+    def set(self, *args, **kwargs):
+        self.threads.add(threading.current_thread())
+        return super().set(*args, **kwargs)
+
+
+async def async_halve(a):
+    call_count['async_halve'] += 1
+    return a // 2
+
+
+async_shared_cache = ThreadRecordingCache(os.path.join(tempfile.mkdtemp(), 'shared.sqlite'))
+async_worker_a = memoize(db_name=DB_NAME, mongo_client_cb=get_db_conn, shared_cache=async_shared_cache)(async_halve)
+async_worker_b = memoize(db_name=DB_NAME, mongo_client_cb=get_db_conn,
+                         shared_cache=ThreadRecordingCache(async_shared_cache.path))(async_halve)
+
+
+class TestCodeVersion(unittest.TestCase):
+
+    def test_code_version(self):
+        def first(a):
+            return a in {'x', 'y'}
+
+        def second(a):
+            return a in {'x', 'z'}
+
+        self.assertEqual(code_version(first), code_version(first))
+        self.assertNotEqual(code_version(first), code_version(second))
+        self.assertEqual(code_version(auto_square), code_version(square))
+        self.assertRaises(ValueError, code_version, len)
+
+
 if __name__ == '__main__':
     unittest.main()
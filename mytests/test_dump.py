@@ -0,0 +1,102 @@
+import os
+import shutil
+import tempfile
+import unittest
+from collections import defaultdict
+
+import pymongo
+from mongo_memoize import memoize, LocalCache
+from mongo_memoize.cli import main
+from mongo_memoize.dump import export_cache, import_cache
+
+MONGO_URI = "mongodb://localhost"
+DB_NAME = 'test'
+call_count = defaultdict(int)
+
+
+def get_db_conn():
+    return pymongo.MongoClient(MONGO_URI)
+
+
+class TestDump(unittest.TestCase):
+    def setUp(self) -> None:
+        self.client = pymongo.MongoClient(MONGO_URI)
+        self.db = self.client[DB_NAME]
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self) -> None:
+        self.client.drop_database(DB_NAME)
+        self.client.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_export_import(self):
+        calls = call_count['squares']
+        for n in range(5):
+            source(n)
+        # in the same collection, not exported
+        self.assertEqual(other(7), 14)
+
+        path = os.path.join(self.tmpdir, 'squares.bson.gz')
+        self.assertEqual(export_cache(source, path, batch_size=2), 5)
+        self.assertEqual(import_cache(path, target, batch_size=2), 5)
+        self.assertEqual(self.db['imported'].count_documents({}), 5)
+        self.assertEqual(self.db['imported'].count_documents({'key': {'$exists': True}}), 0)
+        self.assertGreater(self.db['imported.chunks'].count_documents({}), 0)
+
+        # importing again is harmless
+        self.assertEqual(import_cache(path, target), 5)
+        self.assertEqual(self.db['imported'].count_documents({}), 5)
+
+        for n in range(5):
+            self.assertEqual(target(n), [i * i for i in range(n * 100)])
+        self.assertEqual(call_count['squares'], calls + 5)
+
+    def test_cli(self):
+        source(1)
+        path = os.path.join(self.tmpdir, 'squares.bson')
+        main(['export', 'mytests.test_dump:source', path])
+        main(['--db-name', DB_NAME, 'import', path, '--collection-name', 'copy'])
+        self.assertEqual(self.db['copy'].count_documents({'key': {'$exists': True}}), 1)
+
+    def test_prefetch(self):
+        for n in range(4):
+            hot(n)
+        for _ in range(3):
+            hot(2)
+        hot(3)
+        hot.memoizer.flush_hits()
+        self.assertEqual(self.db['cache'].find_one({'qualname': 'hot', 'args': '(2,)'})['hits'], 3)
+
+        hot.memoizer.local_cache.clear()
+        self.assertEqual(hot.prefetch(2), 2)
+        calls = call_count['hot']
+        local_hits = hot.memoizer.local_cache.hits
+        self.assertEqual(hot(2), 2)
+        self.assertEqual(hot(3), 3)
+        self.assertEqual(hot.memoizer.local_cache.hits, local_hits + 2)
+        self.assertEqual(call_count['hot'], calls)
+
+
+def squares(n):
+    call_count['squares'] += 1
+    return [i * i for i in range(n * 100)]
+
+
+def twice(n):
+    return 2 * n
+
+
+source = memoize(db_name=DB_NAME, mongo_client_cb=get_db_conn, spill_threshold=1024)(squares)
+other = memoize(db_name=DB_NAME, mongo_client_cb=get_db_conn)(twice)
+target = memoize(db_name=DB_NAME, mongo_client_cb=get_db_conn, collection_name='imported',
+                 key_as_id=True)(squares)
+
+
+@memoize(db_name=DB_NAME, mongo_client_cb=get_db_conn, track_hits=True, local_cache=LocalCache())
+def hot(n):
+    call_count['hot'] += 1
+    return n
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,6 @@
 import unittest
-from mongo_memoize import PickleMD5KeyGenerator
+import hashlib
+from mongo_memoize import PickleMD5KeyGenerator, PickleDigestKeyGenerator
 
 class TestPickleMD5KeyGenerator(unittest.TestCase):
 
@@ -25,5 +26,27 @@ class TestPickleMD5KeyGenerator(unittest.TestCase):
         result2 = generator2('my_function', (1, 2), {'a': 3})
         self.assertNotEqual(result1, result2)
 
+class TestPickleDigestKeyGenerator(unittest.TestCase):
+
+    def test_default_digest(self):
+        generator = PickleDigestKeyGenerator()
+        key = generator('my_function', (1, 2), {'a': 3, 'b': 4})
+        self.assertIsInstance(key, bytes)
+        self.assertEqual(len(key), 16)
+        self.assertEqual(key, generator('my_function', (1, 2), {'b': 4, 'a': 3}))
+        self.assertNotEqual(key, generator('my_function', (2, 1), {'a': 3, 'b': 4}))
+
+    def test_algorithm(self):
+        key = PickleDigestKeyGenerator(algorithm='sha256', digest_size=20)('my_function', (1,), {})
+        self.assertEqual(len(key), 20)
+        self.assertEqual(len(PickleDigestKeyGenerator(algorithm='blake2s', digest_size=8)('f', (), {})), 8)
+
+    def test_custom_algorithm(self):
+        generator = PickleDigestKeyGenerator(algorithm=lambda data: hashlib.sha1(data).digest())
+        self.assertEqual(len(generator('my_function', (1,), {})), 20)
+
+    def test_unknown_algorithm(self):
+        self.assertRaises(ValueError, PickleDigestKeyGenerator, algorithm='nope')
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,50 @@
+import time
+import unittest
+
+import pymongo
+from mongo_memoize.lease import Lease, ensure_lease_indexes
+
+MONGO_URI = "mongodb://localhost"
+DB_NAME = 'test'
+
+
+class TestLease(unittest.TestCase):
+    def setUp(self) -> None:
+        self.client = pymongo.MongoClient(MONGO_URI)
+        self.lease_col = self.client[DB_NAME]['cache.leases']
+        ensure_lease_indexes(self.lease_col)
+
+    def tearDown(self) -> None:
+        self.client.drop_database(DB_NAME)
+        self.client.close()
+
+    def test_exclusive(self):
+        lease1 = Lease(self.lease_col, 'key', 10)
+        lease2 = Lease(self.lease_col, 'key', 10)
+        self.assertTrue(lease1.acquire())
+        self.assertFalse(lease2.acquire())
+        self.assertTrue(Lease(self.lease_col, 'other', 10).acquire())
+
+    def test_release(self):
+        lease1 = Lease(self.lease_col, 'key', 10)
+        lease2 = Lease(self.lease_col, 'key', 10)
+        self.assertTrue(lease1.acquire())
+        # only the owner can release the lease
+        lease2.release()
+        self.assertFalse(lease2.acquire())
+        lease1.release()
+        self.assertTrue(lease2.acquire())
+
+    def test_take_over_expired_lease(self):
+        lease1 = Lease(self.lease_col, 'key', 0.1)
+        lease2 = Lease(self.lease_col, 'key', 10)
+        self.assertTrue(lease1.acquire())
+        time.sleep(0.2)
+        self.assertTrue(lease2.acquire())
+        # the expired owner no longer holds it
+        lease1.release()
+        self.assertFalse(lease1.acquire())
+
+
+if __name__ == '__main__':
+    unittest.main()
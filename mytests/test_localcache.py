@@ -0,0 +1,79 @@
+import threading
+import time
+import unittest
+from mongo_memoize import LocalCache
+
+
+class TestLocalCache(unittest.TestCase):
+
+    def test_get_set(self):
+        cache = LocalCache()
+        self.assertIsNone(cache.get('a'))
+        cache.set('a', 1)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_none_value_is_cached(self):
+        cache = LocalCache()
+        missing = object()
+        cache.set('a', None)
+        self.assertIsNone(cache.get('a', missing))
+
+    def test_max_entries_evicts_least_recently_used(self):
+        cache = LocalCache(max_entries=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.evictions, 1)
+
+    def test_max_bytes(self):
+        cache = LocalCache(max_bytes=100)
+        cache.set('a', 'x', size=60)
+        cache.set('b', 'y', size=60)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.get('b'), 'y')
+        self.assertEqual(cache.size, 60)
+
+        # entries larger than the cache are never stored
+        cache.set('c', 'z', size=200)
+        self.assertIsNone(cache.get('c'))
+        self.assertEqual(cache.get('b'), 'y')
+
+    def test_ttl(self):
+        cache = LocalCache(ttl=0.05)
+        cache.set('a', 1)
+        self.assertEqual(cache.get('a'), 1)
+        time.sleep(0.1)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.size, 0)
+
+    def test_entry_expiry_shorter_than_ttl(self):
+        cache = LocalCache(ttl=60)
+        cache.set('a', 1, expires=time.time() - 1)
+        self.assertIsNone(cache.get('a'))
+
+    def test_concurrent_access(self):
+        cache = LocalCache(max_entries=50, max_bytes=1000)
+
+        def worker(n):
+            for i in range(1000):
+                cache.set((n, i % 100), i, size=10)
+                cache.get((n, (i + 1) % 100))
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertLessEqual(len(cache), 50)
+        self.assertEqual(cache.size, 10 * len(cache))
+
+
+if __name__ == '__main__':
+    unittest.main()
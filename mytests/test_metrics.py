@@ -0,0 +1,75 @@
+import unittest
+
+from mongo_memoize import CallbackCollector, InMemoryCollector
+from mongo_memoize.metrics import Histogram
+
+
+class TestHistogram(unittest.TestCase):
+
+    def test_empty(self):
+        snapshot = Histogram().snapshot()
+        self.assertEqual(snapshot['count'], 0)
+        self.assertIsNone(snapshot['mean'])
+        self.assertIsNone(snapshot['p99'])
+
+    def test_percentiles(self):
+        histogram = Histogram()
+        for value in range(1, 1001):
+            histogram.add(value / 1000.0)
+        snapshot = histogram.snapshot()
+        self.assertEqual(snapshot['count'], 1000)
+        self.assertEqual(snapshot['min'], 0.001)
+        self.assertEqual(snapshot['max'], 1.0)
+        self.assertAlmostEqual(snapshot['mean'], 0.5005)
+        self.assertTrue(0.5 <= snapshot['p50'] <= 0.5 * 1.19)
+        self.assertTrue(0.9 <= snapshot['p90'] <= 1.0)
+        self.assertTrue(0.99 <= snapshot['p99'] <= 1.0)
+
+    def test_zero(self):
+        histogram = Histogram()
+        histogram.add(0)
+        histogram.add(0)
+        histogram.add(4)
+        self.assertEqual(histogram.percentile(0.5), 0)
+        self.assertEqual(histogram.percentile(1), 4)
+
+
+class TestInMemoryCollector(unittest.TestCase):
+
+    def test_snapshot(self):
+        collector = InMemoryCollector()
+        collector.count('f', 'hits')
+        collector.count('f', 'misses', 2)
+        collector.timing('f', 'lookup', 0.001)
+        collector.timing('f', 'lookup', 0.003)
+        collector.payload_size('f', 100)
+        collector.count('g', 'errors')
+
+        snapshot = collector.snapshot()
+        self.assertEqual(snapshot['f']['hits'], 1)
+        self.assertEqual(snapshot['f']['misses'], 2)
+        self.assertEqual(snapshot['f']['errors'], 0)
+        self.assertEqual(list(snapshot['f']['phases']), ['lookup'])
+        self.assertEqual(snapshot['f']['phases']['lookup']['count'], 2)
+        self.assertEqual(snapshot['f']['payload_size']['max'], 100)
+        self.assertEqual(snapshot['g']['errors'], 1)
+        self.assertIsNone(snapshot['g']['payload_size'])
+
+        collector.reset()
+        self.assertEqual(collector.snapshot(), {})
+
+
+class TestCallbackCollector(unittest.TestCase):
+
+    def test_callbacks(self):
+        calls = []
+        collector = CallbackCollector(on_count=lambda *args: calls.append(('count',) + args),
+                                      on_timing=lambda *args: calls.append(('timing',) + args))
+        collector.count('f', 'hits', 1)
+        collector.timing('f', 'key', 0.5)
+        collector.payload_size('f', 10)
+        self.assertEqual(calls, [('count', 'f', 'hits', 1), ('timing', 'f', 'key', 0.5)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+from collections import defaultdict
+
+import pymongo
+from mongo_memoize import memoize
+from mongo_memoize.migration import migrate_to_key_as_id
+
+MONGO_URI = "mongodb://localhost"
+DB_NAME = 'test'
+call_count = defaultdict(int)
+
+
+def get_db_conn():
+    return pymongo.MongoClient(MONGO_URI)
+
+
+class TestMigration(unittest.TestCase):
+    def setUp(self) -> None:
+        self.client = pymongo.MongoClient(MONGO_URI)
+        self.db = self.client[DB_NAME]
+
+    def tearDown(self) -> None:
+        self.client.drop_database(DB_NAME)
+        self.client.close()
+
+    def test_migrate_to_key_as_id(self):
+        for n in range(5):
+            self.assertEqual(old_layout(n), list(range(n * 100)))
+        self.assertEqual(call_count['layout'], 5)
+
+        copied = migrate_to_key_as_id(self.db, 'cache', 'cache_by_id', batch_size=2)
+        self.assertEqual(copied, 5)
+        self.assertEqual(self.db['cache_by_id'].count_documents({'key': {'$exists': True}}), 0)
+        self.assertEqual(self.db['cache_by_id.chunks'].count_documents({}),
+                         self.db['cache.chunks'].count_documents({}))
+
+        # running it again is harmless
+        self.assertEqual(migrate_to_key_as_id(self.db, 'cache', 'cache_by_id'), 5)
+        self.assertEqual(self.db['cache_by_id'].count_documents({}), 5)
+
+        for n in range(5):
+            self.assertEqual(new_layout(n), list(range(n * 100)))
+        self.assertEqual(call_count['layout'], 5)
+
+
+def layout(n):
+    call_count['layout'] += 1
+    return list(range(n * 100))
+
+
+old_layout = memoize(db_name=DB_NAME, mongo_client_cb=get_db_conn, spill_threshold=1024)(layout)
+new_layout = memoize(db_name=DB_NAME, mongo_client_cb=get_db_conn, spill_threshold=1024,
+                     collection_name='cache_by_id', key_as_id=True)(layout)
+
+
+if __name__ == '__main__':
+    unittest.main()
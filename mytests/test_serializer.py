@@ -1,5 +1,31 @@
+import dataclasses
+import datetime
+import decimal
 import unittest
-from mongo_memoize import NoopSerializer, PickleSerializer
+import bson
+try:
+    import numpy
+except ImportError:
+    numpy = None
+from mongo_memoize import NoopSerializer, PickleSerializer, CompressedSerializer, OutOfBandPickleSerializer, \
+    TypedSerializer
+from mongo_memoize import serializer as serializer_module
+from mongo_memoize.serializer import available_codecs, register_codec
+
+
+@dataclasses.dataclass(frozen=True)
+class Point(object):
+    x: int
+    y: int
+
+
+class Celsius(object):
+    def __init__(self, degrees):
+        self.degrees = degrees
+
+    def __eq__(self, other):
+        return isinstance(other, Celsius) and other.degrees == self.degrees
+
 
 class TestSerializers(unittest.TestCase):
 
@@ -36,6 +62,151 @@ class TestSerializers(unittest.TestCase):
         serialized = serializer.serialize(obj)
         deserialized = serializer.deserialize(serialized)
         self.assertEqual(deserialized, obj)
+    def test_pickle_serializer_binary(self):
+        serializer = PickleSerializer(binary=True)
+        obj = {"data": b"\x00\x01", "list": [1, 2, 3]}
+
+        # Test a round trip through BSON
+        doc = bson.decode(bson.encode({'result': serializer.serialize(obj)}))
+        self.assertIsInstance(doc['result'], bson.Binary)
+        self.assertEqual(serializer.deserialize(doc['result']), obj)
+
+    def test_pickle_serializer_binary_reads_base64(self):
+        obj = {"data": 42}
+        legacy = bson.decode(bson.encode({'result': PickleSerializer().serialize(obj)}))
+        self.assertEqual(PickleSerializer(binary=True).deserialize(legacy['result']), obj)
+
+        binary = bson.decode(bson.encode({'result': PickleSerializer(binary=True).serialize(obj)}))
+        self.assertEqual(PickleSerializer().deserialize(binary['result']), obj)
+
+    def test_pickle_serializer_binary_is_smaller(self):
+        obj = list(range(1000))
+        self.assertLess(len(PickleSerializer(binary=True).serialize(obj)),
+                        len(PickleSerializer().serialize(obj)))
+    def test_compressed_serializer(self):
+        obj = [{"id": i, "name": "user"} for i in range(1000)]
+        for codec in available_codecs():
+            serializer = CompressedSerializer(codec=codec)
+            serialized = serializer.serialize(obj)
+            self.assertEqual(serialized['__codec__'], codec)
+            self.assertLess(len(serialized['data']), len(PickleSerializer(binary=True).serialize(obj)))
+
+            doc = bson.decode(bson.encode({'result': serialized}))
+            self.assertEqual(serializer.deserialize(doc['result']), obj)
+
+    def test_compressed_serializer_threshold(self):
+        serializer = CompressedSerializer(threshold=1024)
+        serialized = serializer.serialize({"data": 42})
+        self.assertIsInstance(serialized, bytes)
+        self.assertEqual(serializer.deserialize(serialized), {"data": 42})
+
+    def test_compressed_serializer_reads_other_codecs(self):
+        obj = list(range(1000))
+        serialized = CompressedSerializer(codec='lzma', level=1).serialize(obj)
+        self.assertEqual(CompressedSerializer(codec='zlib').deserialize(serialized), obj)
+
+        # uncompressed legacy entries
+        legacy = PickleSerializer().serialize(obj)
+        self.assertEqual(CompressedSerializer(PickleSerializer()).deserialize(legacy), obj)
+
+    def test_compressed_serializer_custom_codec(self):
+        register_codec('reversed', lambda data, level: bytes(data)[::-1], lambda data: bytes(data)[::-1])
+        self.addCleanup(serializer_module._codecs.pop, 'reversed')
+        serializer = CompressedSerializer(NoopSerializer(), codec='reversed', threshold=0)
+        # not smaller once "compressed": stored as is
+        self.assertEqual(serializer.serialize(b'abc'), b'abc')
+
+    def test_compressed_serializer_unknown_codec(self):
+        self.assertRaises(ValueError, CompressedSerializer, codec='unknown')
+    def test_out_of_band_serializer(self):
+        serializer = OutOfBandPickleSerializer()
+        obj = {"data": 42, "list": [1, 2, 3], "bytes": b"abc"}
+
+        doc = bson.decode(bson.encode({'result': serializer.serialize(obj)}))
+        self.assertIsInstance(doc['result'], bson.Binary)
+        self.assertEqual(serializer.deserialize(doc['result']), obj)
+
+    @unittest.skipUnless(numpy, 'NumPy is not installed')
+    def test_out_of_band_serializer_numpy(self):
+        serializer = OutOfBandPickleSerializer()
+        obj = {"array": numpy.arange(100000, dtype='float64'),
+               "matrix": numpy.arange(12).reshape(3, 4).T}
+
+        doc = bson.decode(bson.encode({'result': serializer.serialize(obj)}))
+        deserialized = serializer.deserialize(doc['result'])
+        self.assertTrue(numpy.array_equal(deserialized["array"], obj["array"]))
+        self.assertTrue(numpy.array_equal(deserialized["matrix"], obj["matrix"]))
+
+        # the array is a view on the fetched payload
+        payload = numpy.frombuffer(doc['result'], dtype='uint8')
+        self.assertTrue(numpy.shares_memory(deserialized["array"], payload))
+        self.assertFalse(deserialized["array"].flags.writeable)
+
+        # payloads reassembled from chunks give writable arrays
+        deserialized = serializer.deserialize(bytearray(doc['result']), subtype=doc['result'].subtype)
+        self.assertTrue(deserialized["array"].flags.writeable)
+
+    def roundtrip(self, serializer, obj):
+        doc = bson.decode(bson.encode({'result': serializer.serialize(obj)}))
+        return serializer.deserialize(doc['result'])
+
+    def test_typed_serializer_native(self):
+        serializer = TypedSerializer()
+        for obj in [None, True, 42, 1.5, "text", u"caf\xe9", b"bytes",
+                    [1, "a", None], {"data": 42, "nested": {"list": [1, 2, 3]}}]:
+            self.assertIs(serializer.serialize(obj), obj)
+            self.assertEqual(self.roundtrip(serializer, obj), obj)
+
+    def test_typed_serializer_registered_types(self):
+        serializer = TypedSerializer()
+        for obj in [datetime.datetime(2020, 1, 2, 3, 4, 5, 6, tzinfo=datetime.timezone.utc),
+                    datetime.date(2020, 1, 2), decimal.Decimal("1.10"), (1, 2), {1, 2},
+                    frozenset(["a"]), Point(1, 2)]:
+            self.assertIn('__type__', serializer.serialize(obj))
+            deserialized = self.roundtrip(serializer, obj)
+            self.assertEqual(deserialized, obj)
+            self.assertIs(type(deserialized), type(obj))
+
+    def test_typed_serializer_register(self):
+        serializer = TypedSerializer()
+        serializer.register(Celsius, 'celsius', lambda obj: obj.degrees, Celsius)
+
+        self.assertEqual(serializer.serialize(Celsius(20)), {'__type__': 'celsius', 'value': 20})
+        self.assertEqual(self.roundtrip(serializer, Celsius(20)), Celsius(20))
+
+    def test_typed_serializer_falls_back_to_pickle(self):
+        serializer = TypedSerializer()
+        for obj in [2 ** 64, {1: "int key"}, {"$set": 1}, {"a.b": 1}, {"__type__": "x"},
+                    [1, (2, 3)], (1, Celsius(20)), Point(1, (2, 3)), Celsius(20)]:
+            serialized = serializer.serialize(obj)
+            self.assertIsInstance(serialized, bson.Binary)
+            self.assertEqual(self.roundtrip(serializer, obj), obj)
+            # payloads reassembled from chunks
+            self.assertEqual(serializer.deserialize(bytearray(serialized), subtype=serialized.subtype), obj)
+
+    @unittest.skipUnless(numpy, 'NumPy is not installed')
+    def test_typed_serializer_numpy(self):
+        serializer = TypedSerializer()
+        obj = numpy.arange(1000, dtype='float64')
+
+        serialized = serializer.serialize(obj)
+        self.assertEqual(serialized.subtype, serializer_module.OUT_OF_BAND_SUBTYPE)
+        self.assertTrue(numpy.array_equal(self.roundtrip(serializer, obj), obj))
+        self.assertTrue(numpy.array_equal(serializer.deserialize(bytearray(serialized), subtype=serialized.subtype),
+                                          obj))
+
+    def test_deserialize_buffer(self):
+        '''payloads reassembled from chunks are read as their stored subtype says'''
+        for serializer, obj in [(PickleSerializer(), {"data": 42}), (PickleSerializer(binary=True), {"data": 42}),
+                                (CompressedSerializer(threshold=10 ** 6), {"data": 42}),
+                                (TypedSerializer(), Celsius(20))]:
+            serialized = serializer.serialize(obj)
+            subtype = getattr(serialized, 'subtype', 0)
+            self.assertEqual(serializer.deserialize(bytearray(serialized), subtype=subtype), obj)
+
+        # binary results are read back as from a document
+        self.assertIs(type(TypedSerializer().deserialize(bytearray(b"bytes"), subtype=0)), bytes)
+        self.assertIs(type(NoopSerializer().deserialize(bytearray(b"bytes"), subtype=0)), bytes)
 
 if __name__ == '__main__':
     unittest.main()
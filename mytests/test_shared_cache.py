@@ -0,0 +1,103 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from bson.binary import Binary
+from mongo_memoize import SharedCache
+from mongo_memoize.serializer import PICKLE_SUBTYPE
+
+
+def _fill(path, worker):
+    cache = SharedCache(path)
+    for i in range(50):
+        cache.set(b'%d-%d' % (worker, i), i)
+
+
+class TestSharedCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'cache.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_get_set(self):
+        cache = SharedCache(self.path)
+        self.assertIsNone(cache.get(b'a'))
+        cache.set(b'a', Binary(b'payload', PICKLE_SUBTYPE), expires=time.time() + 60)
+        value, expires = cache.get(b'a')
+        self.assertEqual(value, Binary(b'payload', PICKLE_SUBTYPE))
+        self.assertEqual(value.subtype, PICKLE_SUBTYPE)
+        self.assertGreater(expires, time.time())
+        self.assertEqual(cache.stats()['hits'], 1)
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_payload_types(self):
+        cache = SharedCache(self.path)
+        for value in ({'a': [1, 2]}, 'text', None, b'bytes'):
+            cache.set(b'k', value)
+            self.assertEqual(cache.get(b'k'), (value, None))
+
+    def test_shared_between_instances(self):
+        SharedCache(self.path).set(b'a', 1)
+        self.assertEqual(SharedCache(self.path).get(b'a'), (1, None))
+
+    def test_expiry(self):
+        cache = SharedCache(self.path, ttl=0.1)
+        cache.set(b'a', 1)
+        cache.set(b'b', 2, expires=time.time() - 1)
+        self.assertEqual(cache.get(b'a')[0], 1)
+        self.assertIsNone(cache.get(b'b'))
+        time.sleep(0.15)
+        self.assertIsNone(cache.get(b'a'))
+
+    def test_max_bytes(self):
+        cache = SharedCache(self.path, max_bytes=200 * 1024)
+        for i in range(100):
+            cache.set(b'%d' % i, Binary(os.urandom(5000)))
+        self.assertLess(cache.size, 200 * 1024)
+        self.assertGreater(cache.evictions, 0)
+        self.assertIsNone(cache.get(b'0'))
+        self.assertIsNotNone(cache.get(b'99'))
+
+        # too large for a tenth of the cache
+        cache.set(b'large', Binary(os.urandom(30 * 1024)))
+        self.assertIsNone(cache.get(b'large'))
+
+    def test_threads(self):
+        cache = SharedCache(self.path)
+
+        def worker(n):
+            for i in range(50):
+                cache.set(b'%d-%d' % (n, i), i)
+                self.assertEqual(cache.get(b'%d-%d' % (n, i))[0], i)
+
+        threads = [threading.Thread(target=worker, args=(n,)) for n in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(cache), 200)
+        self.assertEqual(cache.stats()['errors'], 0)
+
+    def test_processes(self):
+        processes = [multiprocessing.Process(target=_fill, args=(self.path, n)) for n in range(4)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        self.assertEqual(len(SharedCache(self.path)), 200)
+
+    def test_clear(self):
+        cache = SharedCache(self.path)
+        cache.set(b'a', 1)
+        cache.delete(b'a')
+        self.assertIsNone(cache.get(b'a'))
+        cache.set(b'b', 1)
+        cache.clear()
+        self.assertEqual(len(cache), 0)
@@ -0,0 +1,77 @@
+import unittest
+
+import pymongo
+from mongo_memoize import BackgroundWriter
+
+MONGO_URI = "mongodb://localhost"
+DB_NAME = 'test'
+
+
+class TestBackgroundWriter(unittest.TestCase):
+    def setUp(self) -> None:
+        self.client = pymongo.MongoClient(MONGO_URI)
+        self.col = self.client[DB_NAME]['cache']
+
+    def tearDown(self) -> None:
+        self.client.drop_database(DB_NAME)
+        self.client.close()
+
+    def test_flush(self):
+        writer = BackgroundWriter(batch_size=10, flush_interval=60)
+        for i in range(25):
+            self.assertTrue(writer.put(self.col, {'key': str(i)}, {'$set': {'result': i}}))
+        self.assertTrue(writer.flush(10))
+        self.assertEqual(self.col.count_documents({}), 25)
+
+        stats = writer.stats()
+        self.assertEqual(stats['written'], 25)
+        self.assertEqual(stats['queued'], 0)
+        self.assertGreaterEqual(stats['flushes'], 3)
+        writer.close()
+
+    def test_last_write_wins(self):
+        writer = BackgroundWriter(flush_interval=60)
+        writer.put(self.col, {'key': 'a'}, {'$set': {'result': 1}})
+        writer.put(self.col, {'key': 'a'}, {'$set': {'result': 2}})
+        writer.flush(10)
+        self.assertEqual(self.col.find_one({'key': 'a'})['result'], 2)
+        writer.close()
+
+    def test_delete(self):
+        chunk_col = self.client[DB_NAME]['cache.chunks']
+        chunk_col.insert_one({'key': 'a', 'n': 0})
+        writer = BackgroundWriter(flush_interval=60)
+        writer.put(self.col, {'key': 'a'}, {'$set': {'result': 1}})
+        self.assertTrue(writer.delete(chunk_col, {'key': 'a'}))
+        writer.flush(10)
+        self.assertEqual(self.col.find_one({'key': 'a'})['result'], 1)
+        self.assertEqual(chunk_col.count_documents({}), 0)
+        self.assertEqual(writer.stats()['written'], 1)
+        writer.close()
+
+    def test_close_drains_queue(self):
+        writer = BackgroundWriter(flush_interval=60)
+        for i in range(5):
+            writer.put(self.col, {'key': str(i)}, {'$set': {'result': i}})
+        writer.close()
+        self.assertEqual(self.col.count_documents({}), 5)
+
+    def test_put_after_close(self):
+        writer = BackgroundWriter(flush_interval=60)
+        writer.put(self.col, {'key': 'a'}, {'$set': {'result': 1}})
+        writer.close()
+        self.assertTrue(writer.put(self.col, {'key': 'b'}, {'$set': {'result': 2}}))
+        self.assertTrue(writer.flush(10))
+        self.assertEqual(self.col.count_documents({}), 2)
+        writer.close()
+
+    def test_full_queue_drops_writes(self):
+        writer = BackgroundWriter(max_queue_size=1, flush_interval=60)
+        results = [writer.put(self.col, {'key': str(i)}, {'$set': {'result': i}}) for i in range(100)]
+        self.assertIn(False, results)
+        self.assertEqual(writer.stats()['dropped'], results.count(False))
+        writer.close()
+
+
+if __name__ == '__main__':
+    unittest.main()